@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import load_activity_config, MODEL_RATE_LIMIT, MODEL_RATE_BURST
+from extract_config_client import ExtractConfigClient
+from user_feedback_client import UserFeedbackClient
+from resilient_call import ResilientCaller
+from config_store import ConfigStore
+from config_validator import ConfigValidator
+from turn_engine import TurnEngine
+from layout_engine import ClassroomLayout
+from playback import PlaybackController, NullSink
+from tracing import get_tracer
+
+GREETING = "Hello there!"  # The first system message of a conversation that does not give one
+MAX_ERRORS = 10  # Validation errors recorded per configuration
+
+
+def read_conversations(path):
+    """Reads scripted teacher conversations from a JSONL file.
+
+    Each line is an object with the teacher's responses in "turns", and optionally an "id"
+    (or "name", as in benchmark scripts), a starting "config" and a "greeting". Conversations
+    without an id are named after their line, e.g. 'line-3'.
+
+    Args:
+        path: The path of the JSONL file.
+
+    Returns:
+        A list of conversations, each with an "id".
+
+    Raises:
+        ValueError: If a line is not a conversation, or two conversations have the same id.
+    """
+    conversations = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            conversation = json.loads(line)
+            if not isinstance(conversation, dict) or not isinstance(conversation.get("turns"), list):
+                raise ValueError(f"Line {number} of {path} is not a conversation with a list of turns")
+            conversation = {**conversation, "id": str(conversation.get("id") or conversation.get("name") or f"line-{number}")}
+            if conversation["id"] in seen:
+                raise ValueError(f"Duplicate conversation id {conversation['id']!r} on line {number} of {path}")
+            seen.add(conversation["id"])
+            conversations.append(conversation)
+    return conversations
+
+
+def read_checkpoint(path):
+    """Returns the ids of the conversations an output file records as done.
+
+    A record cut short by a crash (a last line without a newline) is removed from the file, so
+    that records appended when the batch is resumed start on a line of their own.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get("status") == "done":
+            done.add(record.get("id"))
+    return done
+
+
+def create_clients(caller):
+    """Creates the model clients of one worker, making their calls through the batch's caller."""
+    extractor = ExtractConfigClient(caller=caller)
+    feedback_client = UserFeedbackClient(caller=caller)
+    extractor.warm_up()
+    feedback_client.warm_up()
+    return extractor, feedback_client
+
+
+class BatchRunner:
+    def __init__(self, output_path, workers=4, caller=None, make_clients=create_clients, resume=False, on_record=None):
+        """Initializes the BatchRunner, which runs scripted conversations without a terminal.
+
+        Each worker has its own clients and runs one conversation at a time through the turn
+        engine, turn by turn, without rendering or speech. The workers share one
+        ResilientCaller, whose concurrency and rate limits bound the model calls of the whole
+        batch. Each conversation's record (its final configuration, whether it is valid, and the
+        feedback and per-stage timings of each turn) is appended to the output file as soon as
+        the conversation finishes. The output file is also the checkpoint: when resuming, the
+        conversations it records as done are skipped.
+
+        Args:
+            output_path: The JSONL file to write the records to.
+            workers: The number of conversations run at once.
+            caller: The ResilientCaller shared by the workers; defaults to one allowing two model
+                calls in flight per worker (extraction and feedback overlap).
+            make_clients: Callable (caller) returning a worker's (extractor, feedback_client).
+            resume: Whether to append to the output file, skipping the conversations it records
+                as done, rather than overwrite it.
+            on_record: Optional callable (record) called after each record is written.
+        """
+        self.output_path = output_path
+        self.workers = workers
+        self.caller = caller or ResilientCaller(max_concurrency=2 * workers)
+        self.make_clients = make_clients
+        self.resume = resume
+        self.on_record = on_record
+        self.player = PlaybackController(NullSink())  # Never played: batch turns are not spoken
+
+    async def run(self, conversations):
+        """Runs conversations with the pool of workers.
+
+        Args:
+            conversations: The conversations to run, e.g. from read_conversations.
+
+        Returns:
+            A summary with the numbers of conversations done, failed and skipped, the number of
+            turns, the elapsed seconds and the model call counts.
+        """
+        done = read_checkpoint(self.output_path) if self.resume else set()
+        queue = asyncio.Queue()
+        for conversation in conversations:
+            if conversation["id"] not in done:
+                queue.put_nowait(conversation)
+        summary = {"done": 0, "failed": 0, "skipped": len(conversations) - queue.qsize(), "turns": 0}
+
+        # Every worker has up to two blocking stages running at once (extraction and feedback)
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=2 * self.workers + 2, thread_name_prefix="batch")
+        )
+        start = time.perf_counter()
+        with open(self.output_path, "a" if self.resume else "w", encoding="utf-8") as output:
+            async def worker():
+                clients = None
+                while not queue.empty():
+                    conversation = queue.get_nowait()
+                    if clients is None:
+                        clients = await asyncio.to_thread(self.make_clients, self.caller)
+                    record = await self.run_conversation(conversation, *clients)
+                    # Written from the event loop only, so records are never interleaved
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+                    summary[record["status"]] += 1
+                    summary["turns"] += len(record["turns"])
+                    if self.on_record is not None:
+                        self.on_record(record)
+
+            await asyncio.gather(*(worker() for _ in range(min(self.workers, queue.qsize()))))
+        return {**summary, "seconds": round(time.perf_counter() - start, 3), "model_calls": self.caller.stats()}
+
+    async def run_conversation(self, conversation, extractor, feedback_client):
+        """Runs the turns of one conversation and returns its record.
+
+        Like an interactive session, 'undo' and 'redo' step through the configuration's
+        versions. A turn that fails ends the conversation, which is recorded as failed with
+        the turns completed so far.
+        """
+        if hasattr(extractor, "layout"):
+            # Placement requests ('Group 1 at the back') hold for the rest of a conversation, not the next one
+            extractor.layout = ClassroomLayout()
+        store = ConfigStore(conversation.get("config") or load_activity_config())
+        engine = TurnEngine(extractor, feedback_client, render=lambda config: None, synthesize=None,
+                            player=self.player, store=store)
+        record = {"id": conversation["id"], "status": "done"}
+        turns = []
+        prev_system_response = conversation.get("greeting") or GREETING
+        start = time.perf_counter()
+        # The conversation's turns are numbered, and its spans written, apart from the other workers'
+        with get_tracer().session(conversation=conversation["id"]):
+            try:
+                for user_input in conversation["turns"]:
+                    command = user_input.strip().lower()
+                    engine.last_timings = {}
+                    if command in ("undo", "redo"):
+                        feedback, intent = await engine.step_history(command), command
+                    else:
+                        _, feedback = await engine.run_turn(prev_system_response, user_input, store.config, store.config)
+                        if engine.last_error is not None:
+                            raise engine.last_error
+                        intent = engine.last_intent.kind
+                    turns.append({
+                        "input": user_input, "intent": intent, "feedback": feedback,
+                        "timings": {stage: round(seconds, 4) for stage, seconds in engine.last_timings.items()}
+                    })
+                    prev_system_response = feedback
+            except Exception as e:
+                record.update(status="failed", error=f"{type(e).__name__}: {e}")
+
+        errors = [error.message for error in ConfigValidator().iter_errors(store.config)]
+        record.update(
+            config=store.config, valid=not errors, errors=errors[:MAX_ERRORS], turns=turns,
+            seconds=round(time.perf_counter() - start, 3)
+        )
+        return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run scripted teacher conversations headlessly, several at a time.")
+    parser.add_argument("conversations", help="JSONL file with one conversation per line: {\"id\", \"turns\": [...], \"config\"?}.")
+    parser.add_argument("--output", "-o", required=True, help="JSONL file to write one record per conversation to.")
+    parser.add_argument("--workers", type=int, default=4, help="Conversations run at once.")
+    parser.add_argument("--max-calls", type=int, help="Model calls in flight at once (default: twice the workers).")
+    parser.add_argument("--rate-limit", type=float, default=MODEL_RATE_LIMIT, help="Model calls started per second.")
+    parser.add_argument("--rate-burst", type=float, default=MODEL_RATE_BURST, help="Model calls that may start at once within the rate limit.")
+    parser.add_argument("--resume", action="store_true", help="Skip the conversations the output file records as done and append to it.")
+    args = parser.parse_args(argv)
+
+    conversations = read_conversations(args.conversations)
+    caller = ResilientCaller(max_concurrency=args.max_calls or 2 * args.workers, rate_limit=args.rate_limit,
+                             rate_burst=args.rate_burst)
+    total = len(conversations)
+
+    def report(record):
+        print(f"{record['id']}: {record['status']} ({len(record['turns'])} turns, {record['seconds']:.1f}s"
+              f"{', invalid configuration' if not record['valid'] else ''})", file=sys.stderr)
+
+    runner = BatchRunner(args.output, workers=args.workers, caller=caller, resume=args.resume, on_record=report)
+    print(f"Running {total} conversations with {args.workers} workers...", file=sys.stderr)
+    try:
+        # The clients and the turn engine print their progress for interactive sessions
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            summary = asyncio.run(runner.run(conversations))
+    finally:
+        get_tracer().close()
+    print(json.dumps(summary, indent=2))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
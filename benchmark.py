@@ -0,0 +1,374 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import re
+import select
+import subprocess
+import sys
+import time
+from config import load_activity_config
+from extract_config_client import ExtractConfigClient, SYSTEM_INSTRUCTION as EXTRACT_SYSTEM_INSTRUCTION
+from user_feedback_client import UserFeedbackClient, SYSTEM_INSTRUCTION as FEEDBACK_SYSTEM_INSTRUCTION
+from model_backends import LocalBackend, rule_based_extraction, rule_based_feedback
+from response_cache import ResponseCache
+from resilient_call import ResilientCaller
+from turn_engine import TurnEngine
+from tracing import read_trace
+from playback import PlaybackController, NullSink
+from classroom_renderer import ClassroomRenderer, VirtualScreen
+from config_diff import diff_configs, summarize_changes
+from config_generator import generate_config, edit_config
+from config_validator import ConfigValidator
+from visibility import VisibilityMatrix
+from user_feedback_client import missing_items
+import utils
+
+# Scripted teacher conversations used when no script file is given
+DEFAULT_SESSIONS = [
+    {
+        "name": "software_project",
+        "turns": [
+            "The project name is Awesome Project. The board is called Main Board. "
+            "The phases are Planning, Development, and Testing. The groups are Managers, Developers, and Testers.",
+            "Add a phase: Deployment.",
+            "The groups are QA Team and Operations.",
+            "What does the bucket view do?"
+        ]
+    },
+    {
+        "name": "science_inquiry",
+        "turns": [
+            "The project is called Plant Growth Inquiry. The board is called Lab Board. "
+            "Phases: Brainstorm, Experiment and Reflect. Groups: Team A, Team B, Team C.",
+            "Add a phase: Share.",
+            "Thanks, that looks right."
+        ]
+    }
+]
+
+# Offline settings for the startup benchmark, so that no model, speech or audio service is contacted
+STARTUP_ENVIRONMENT = {"MODEL_BACKEND": "local", "SPEECH_BACKEND": "null", "PLAYBACK_BACKEND": "null", "SESSION_DIR": ""}
+# Numbers of students in the configurations of the scale benchmark
+DEFAULT_SCALE_SIZES = [30, 100, 300, 1000, 3000]
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(samples):
+    """Summarizes per-stage duration samples as p50/p95/max in milliseconds."""
+    return {
+        stage: {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "max_ms": round(max(values) * 1000, 3)
+        }
+        for stage, values in sorted(samples.items())
+    }
+
+
+class ScriptedTurnEngine(TurnEngine):
+    """A TurnEngine that reads teacher responses from a script and records each turn's timings."""
+
+    def __init__(self, turns, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.turns = list(turns) + ["exit"]
+        self.turn_timings = []
+        self.intents = []
+
+    async def prompt(self, message):
+        if self.last_timings:
+            self.turn_timings.append(self.last_timings)
+            self.intents.append(self.last_intent.kind)
+            self.last_timings = {}
+        self.stop_speaking()
+        return self.turns.pop(0)
+
+
+def run_turn_benchmark(sessions, repeat, latency, tokens_per_second, replay_dir=None, render_seconds=0.0, fault_rate=0.0,
+                       slow_rate=0.0, slow_seconds=0.0, hedge=False, sectioned=False, delta_mode=True):
+    """Drives scripted sessions through the turn engine against the local model backend.
+
+    Each repetition uses a fresh response cache, so every model call pays its simulated latency.
+
+    Args:
+        sessions: A list of {"name", "turns"} scripted conversations.
+        repeat: The number of times to run each session.
+        latency: Simulated seconds before the first token of each model call.
+        tokens_per_second: Simulated output token rate, or None for instant output.
+        replay_dir: Optional response cache directory with recorded Vertex responses to replay.
+        render_seconds: Simulated time the teacher spends looking at the classroom each turn.
+        fault_rate: Share of model calls that fail with a transient error and are retried.
+        slow_rate: Share of model calls delayed by slow_seconds, to measure tail latency.
+        slow_seconds: The extra delay of slow model calls.
+        hedge: Whether slow model calls are hedged with a duplicate request.
+        sectioned: Whether configurations are regenerated section by section, concurrently.
+        delta_mode: Whether extraction requests JSON Patch deltas before regenerating.
+
+    Returns:
+        A dictionary of per-stage p50/p95 turn latencies, with the model call counts and the
+        number of turns routed by each intent.
+    """
+    samples = {}
+    intents = {}
+
+    def render(config):
+        if render_seconds:
+            time.sleep(render_seconds)
+
+    faults = {"fault_rate": fault_rate, "slow_rate": slow_rate, "slow_seconds": slow_seconds}
+    caller = ResilientCaller(backoff=0.05, hedge=hedge)  # Shared, so that hedging learns across sessions
+    for _ in range(repeat):
+        for session in sessions:
+            extractor = ExtractConfigClient(backend=LocalBackend(
+                EXTRACT_SYSTEM_INSTRUCTION, rule_based_extraction, replay_dir, latency, tokens_per_second, **faults),
+                caller=caller, sectioned=sectioned, delta_mode=delta_mode)
+            feedback_client = UserFeedbackClient(backend=LocalBackend(
+                FEEDBACK_SYSTEM_INSTRUCTION, rule_based_feedback, replay_dir, latency, tokens_per_second, **faults),
+                caller=caller)
+            extractor.cache = feedback_client.cache = ResponseCache(directory=None)
+
+            engine = ScriptedTurnEngine(session["turns"], extractor, feedback_client, render=render,
+                                        synthesize=lambda text: None, player=PlaybackController(NullSink()))
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(engine.run_session("Hello there!", load_activity_config()))
+
+            for timings in engine.turn_timings:
+                for stage, seconds in timings.items():
+                    samples.setdefault(stage, []).append(seconds)
+            for intent in engine.intents:
+                intents[intent] = intents.get(intent, 0) + 1
+
+    return {**summarize(samples), "model_calls": caller.stats(), "intents": intents}
+
+
+def _python(*args, **kwargs):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    environment = {**os.environ, **STARTUP_ENVIRONMENT}
+    return subprocess.Popen([sys.executable, *args], cwd=directory, env=environment, **kwargs)
+
+
+def time_command(*args):
+    """Returns the seconds taken by a Python process running to completion."""
+    start = time.perf_counter()
+    process = _python(*args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    process.wait()
+    return time.perf_counter() - start
+
+
+def time_to_prompt(prompt="Teacher response: ", timeout=30):
+    """Returns the seconds from launching the designer until it asks for the first response."""
+    start = time.perf_counter()
+    process = _python("-u", "ck_designer.py", stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                      stderr=subprocess.DEVNULL)
+    output = b""
+    try:
+        while prompt.encode() not in output:
+            remaining = timeout - (time.perf_counter() - start)
+            if remaining <= 0 or not select.select([process.stdout], [], [], remaining)[0]:
+                raise TimeoutError(f"No {prompt!r} prompt within {timeout} seconds")
+            data = os.read(process.stdout.fileno(), 4096)
+            if not data:
+                raise RuntimeError("The designer exited before its first prompt")
+            output += data
+        return time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+
+
+def heaviest_imports(module="ck_designer", count=10):
+    """Returns the top-level imports of a module that take the longest, from python -X importtime."""
+    process = _python("-X", "importtime", "-c", f"import {module}", stdout=subprocess.DEVNULL,
+                      stderr=subprocess.PIPE, text=True)
+    _, report = process.communicate()
+    # Imports are reported after the modules they import, nested by two spaces per level
+    imports = []
+    for match in IMPORT_TIME_PATTERN.finditer(report):
+        cumulative, depth, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if depth == 1 and name == module:
+            break
+        if depth == 1:
+            imports = []  # Imported at interpreter start (e.g. site), not by the module
+        elif depth == 3:
+            imports.append((name, cumulative))
+    ranked = sorted(imports, key=lambda item: item[1], reverse=True)[:count]
+    return [{"module": name, "ms": round(us / 1000, 1)} for name, us in ranked]
+
+
+def run_startup_benchmark(repeat):
+    """Measures the interpreter start, the import of the designer and the time until the first prompt."""
+    samples = {"interpreter": [], "import": [], "first_prompt": []}
+    for _ in range(repeat):
+        interpreter = time_command("-c", "pass")
+        samples["interpreter"].append(interpreter)
+        samples["import"].append(max(0.0, time_command("-c", "import ck_designer") - interpreter))
+        samples["first_prompt"].append(time_to_prompt())
+    return summarize(samples)
+
+
+def _time(samples, stage, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    samples.setdefault(stage, []).append(time.perf_counter() - start)
+    return result
+
+
+def run_scale_benchmark(sizes, repeat, screen_size=(40, 120), **shape):
+    """Measures the local per-turn work on generated configurations of increasing size.
+
+    For each number of students, a configuration is generated with the other counts given in
+    shape (see generate_config), and a turn's worth of edits is made to it with edit_config.
+    The stages measured are full schema validation with jsonschema, the incremental validator,
+    the prompts of both clients, classroom rendering to a virtual screen, the structural diff,
+    compiling the visibility matrix and exporting every account's access, and the removal of
+    markdown fences from a response the size of the configuration.
+
+    Args:
+        sizes: The numbers of students to measure.
+        repeat: The number of times each stage is measured per size.
+        screen_size: The (height, width) of the virtual screen.
+        shape: The other arguments of generate_config, e.g. phases, groups or devices.
+
+    Returns:
+        A list with the sizes in bytes and the per-stage p50/p95 durations of each size.
+    """
+    import jsonschema
+
+    extractor = ExtractConfigClient(backend=LocalBackend(EXTRACT_SYSTEM_INSTRUCTION, rule_based_extraction))
+    schema_validator = jsonschema.validators.validator_for(extractor.schema)(extractor.schema)
+    feedback_client = UserFeedbackClient(backend=LocalBackend(FEEDBACK_SYSTEM_INSTRUCTION, rule_based_feedback))
+    message, user_input = "What would you like to change?", "Move one student and add another."
+
+    results = []
+    for students in sizes:
+        config = generate_config(students=students, **shape)
+        edited = edit_config(config)
+        response = "Here is the configuration:\n```json\n" + json.dumps(edited, indent=2) + "\n```"
+        validator = ConfigValidator()
+        validator.validate(config)
+        renderer = ClassroomRenderer(VirtualScreen(*screen_size), virtual=True)
+        renderer.update(config)
+        samples = {}
+        prompts = {}
+
+        for turn in range(repeat):
+            # Alternate between the configurations, so that each turn sees one turn's worth of changes
+            before, after = (config, edited) if turn % 2 == 0 else (edited, config)
+            _time(samples, "jsonschema", schema_validator.validate, after)
+            _time(samples, "validate_full", ConfigValidator().validate, after)
+            _time(samples, "validate_incremental", validator.validate, after)
+
+            payload = {"prev_system_response": message, "user_input": user_input, "current_config": before}
+            prompts["extraction_patch"] = _time(samples, "prompt_extraction_patch", extractor.patch_prompt.build, payload)
+            prompts["extraction_full"] = _time(samples, "prompt_extraction_full", extractor.full_prompt.build, payload)
+            changes = _time(samples, "diff", diff_configs, before, after)
+            payload = {"user_input": user_input, "changes": summarize_changes(changes), "missing": missing_items(after)}
+            prompts["feedback"] = _time(samples, "prompt_feedback", feedback_client.prompt.build, payload)
+            payload = {**payload, "current_config": after}
+            prompts["feedback_question"] = _time(samples, "prompt_feedback_question",
+                                                 feedback_client.question_prompt.build, payload)
+
+            _time(samples, "render_full", ClassroomRenderer(VirtualScreen(*screen_size), virtual=True).update, after)
+            _time(samples, "render_incremental", renderer.update, after)
+            visibility = _time(samples, "visibility_compile", VisibilityMatrix, after)
+            _time(samples, "visibility_export", visibility.export)
+            _time(samples, "remove_json_markdown", utils.remove_json_markdown, response)
+
+        results.append({
+            "students": students,
+            "config_bytes": len(json.dumps(config, separators=(",", ":"), ensure_ascii=False).encode("utf-8")),
+            "changes": len(diff_configs(config, edited)),
+            "prompt_bytes": {name: prompt.report()["total_bytes"] for name, prompt in prompts.items()},
+            "stages": summarize(samples)
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks for the CK Board designer.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    turns = subparsers.add_parser("turns", help="Per-stage turn latency of scripted sessions against the local model backend.")
+    turns.add_argument("--script", help="JSON file with a list of {\"name\", \"turns\"} sessions.")
+    turns.add_argument("--repeat", type=int, default=5)
+    turns.add_argument("--latency", type=float, default=0.05, help="Simulated seconds before the first token.")
+    turns.add_argument("--tokens-per-second", type=float, default=500.0, help="Simulated output token rate (0 for instant).")
+    turns.add_argument("--render-seconds", type=float, default=0.0, help="Simulated time spent viewing the classroom.")
+    turns.add_argument("--fault-rate", type=float, default=0.0, help="Share of model calls failing with a transient error.")
+    turns.add_argument("--slow-rate", type=float, default=0.0, help="Share of model calls delayed by --slow-seconds.")
+    turns.add_argument("--slow-seconds", type=float, default=1.0)
+    turns.add_argument("--hedge", action="store_true", help="Hedge slow model calls with a duplicate request.")
+    turns.add_argument("--sectioned", action="store_true", help="Regenerate only the affected sections, concurrently.")
+    turns.add_argument("--full", action="store_true", help="Regenerate the configuration instead of requesting patches.")
+    turns.add_argument("--replay-dir", help="Response cache directory with recorded responses to replay.")
+    turns.add_argument("--output", help="Write the results to this JSON file instead of stdout.")
+
+    trace = subparsers.add_parser("trace", help="Per-span p50/p95 durations of a trace file written with TRACE_FILE.")
+    trace.add_argument("trace_file")
+
+    startup = subparsers.add_parser("startup", help="Launch time of the designer until the first prompt, with the local backends.")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--output", help="Write the results to this JSON file instead of stdout.")
+
+    scale = subparsers.add_parser("scale", help="Validation, prompt, rendering and diff time on generated configurations of increasing size.")
+    scale.add_argument("--sizes", type=lambda text: [int(size) for size in text.split(",")], default=DEFAULT_SCALE_SIZES,
+                       help="Comma-separated numbers of students.")
+    scale.add_argument("--repeat", type=int, default=10)
+    scale.add_argument("--teachers", type=int, default=2)
+    scale.add_argument("--devices", type=int, default=10)
+    scale.add_argument("--groups", type=int, default=6)
+    scale.add_argument("--phases", type=int, default=4)
+    scale.add_argument("--boards", type=int, default=2)
+    scale.add_argument("--buckets", type=int, default=4)
+    scale.add_argument("--output", help="Write the results to this JSON file instead of stdout.")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "turns":
+        sessions = DEFAULT_SESSIONS
+        if args.script:
+            with open(args.script, "r") as f:
+                sessions = json.load(f)
+        results = {
+            "benchmark": "turns",
+            "parameters": {"repeat": args.repeat, "latency": args.latency, "tokens_per_second": args.tokens_per_second,
+                           "render_seconds": args.render_seconds, "fault_rate": args.fault_rate,
+                           "slow_rate": args.slow_rate, "slow_seconds": args.slow_seconds, "hedge": args.hedge,
+                           "sectioned": args.sectioned, "full": args.full},
+            "stages": run_turn_benchmark(sessions, args.repeat, args.latency, args.tokens_per_second or None,
+                                         args.replay_dir, args.render_seconds, args.fault_rate, args.slow_rate,
+                                         args.slow_seconds, args.hedge, args.sectioned, not args.full)
+        }
+    elif args.command == "trace":
+        results = {"benchmark": "trace", "trace_file": args.trace_file, "stages": summarize(read_trace(args.trace_file))}
+    elif args.command == "startup":
+        results = {"benchmark": "startup", "parameters": {"repeat": args.repeat, "environment": STARTUP_ENVIRONMENT},
+                   "stages": run_startup_benchmark(args.repeat), "heaviest_imports": heaviest_imports()}
+    elif args.command == "scale":
+        shape = {"teachers": args.teachers, "devices": args.devices, "groups": args.groups, "phases": args.phases,
+                 "boards": args.boards, "buckets": args.buckets}
+        results = {"benchmark": "scale", "parameters": {"repeat": args.repeat, **shape},
+                   "sizes": run_scale_benchmark(args.sizes, args.repeat, **shape)}
+
+    output = json.dumps(results, indent=2)
+    if getattr(args, "output", None):
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
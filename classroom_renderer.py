@@ -0,0 +1,321 @@
+import curses
+from curses import textpad
+from layout_engine import OccupancyGrid, ICON_WIDTH, place_label, to_cell
+from visibility import RESOURCES, VisibilityMatrix
+
+# Colors for groups; groups beyond the sixth reuse the colors in order
+GROUP_COLORS = ("COLOR_RED", "COLOR_GREEN", "COLOR_BLUE", "COLOR_YELLOW", "COLOR_MAGENTA", "COLOR_CYAN")
+ACCOUNT_ICONS = {"teachers": "👩‍🏫", "students": "👩", "devices": "💻"}
+NAVIGATION_HINT = "Left/right: switch phase. Any other key: continue."
+
+
+def classroom_frame(height, width):
+    """Returns the (top, left, bottom, right) of the classroom's frame on a screen.
+
+    The classroom is drawn between the phase title and the resource lines, which are followed
+    by the status and navigation lines.
+    """
+    return 5, 2, height - 4 - len(RESOURCES), width - 2
+
+
+def classroom_cells(height, width):
+    """Returns the (columns, rows) of cells an account icon can take in the classroom of a screen."""
+    top, left, bottom, right = classroom_frame(height, width)
+    # Inside the frame, with room for the icon's width at the right
+    return max(2, right - left - ICON_WIDTH), max(2, bottom - top - 1)
+
+
+class VirtualScreen:
+    """A curses window stand-in that records writes to a character grid."""
+
+    def __init__(self, height=30, width=80):
+        self.height, self.width = height, width
+        self.clear()
+        self.writes = 0
+
+    def getmaxyx(self):
+        return self.height, self.width
+
+    def clear(self):
+        self.rows = [[" "] * self.width for _ in range(self.height)]
+
+    def addstr(self, y, x, text, attr=0):
+        self.writes += 1
+        for offset, char in enumerate(text):
+            if 0 <= y < self.height and 0 <= x + offset < self.width:
+                self.rows[y][x + offset] = char
+
+    def refresh(self):
+        pass
+
+    def row(self, y):
+        return "".join(self.rows[y])
+
+    def text(self):
+        return "\n".join(self.row(y) for y in range(self.height))
+
+
+class ClassroomRenderer:
+    def __init__(self, stdscr=None, virtual=False):
+        """Initializes the ClassroomRenderer, a long-lived view of the classroom, one phase at a time.
+
+        The renderer keeps its screen between turns and only redraws the cells (accounts,
+        names, and resource lines) that changed since the last configuration it drew.
+
+        Args:
+            stdscr: The curses window to draw on; if None, the renderer sets up the terminal on
+                first use and suspends it (returning to the shell) between turns.
+            virtual: Whether stdscr is a virtual screen (e.g. in tests or benchmarks), in which
+                case colors are not set up and frames are drawn with ASCII characters.
+        """
+        self.stdscr = stdscr
+        self.owns_screen = stdscr is None
+        self.virtual = virtual
+        self.phase_index = 0
+        self.group_pairs = {}
+        self.colors_ready = False
+        self.config = None
+        self.visibility = VisibilityMatrix(None)
+        self.size = None
+        # Whether the configuration on screen is one being streamed in (see show_section)
+        self.previewing = False
+        # Cells currently on screen: key -> (y, x, text, width, color pair)
+        self.cells = {}
+
+    def start(self):
+        """Sets up the terminal for curses, as curses.wrapper would."""
+        self.stdscr = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        self.stdscr.keypad(True)
+        try:
+            curses.start_color()
+        except curses.error:
+            pass
+
+    def suspend(self):
+        """Returns the terminal to the shell between turns; the screen is kept for the next turn."""
+        self.previewing = False
+        if self.owns_screen and self.stdscr is not None and not curses.isendwin():
+            curses.endwin()
+
+    def close(self):
+        """Restores the terminal for good."""
+        if self.owns_screen and self.stdscr is not None:
+            self.stdscr.keypad(False)
+            curses.nocbreak()
+            curses.echo()
+            curses.endwin()
+            self.stdscr = None
+
+    def show(self, config, phase=None):
+        """Displays the classroom for a configuration and waits for a key press.
+
+        The left and right arrow keys switch phase in place; any other key returns.
+
+        Args:
+            config: The configuration to display.
+            phase: Optional phase to display: a phase name, 'next' or 'previous'; defaults to
+                the phase displayed last.
+        """
+        if self.stdscr is None:
+            self.start()
+        try:
+            if phase is not None:
+                self.select_phase(config, phase)
+            self.update(config)
+            while True:
+                key = self.stdscr.getch()
+                if key in (curses.KEY_RIGHT, ord("n")):
+                    self.set_phase(self.phase_index + 1)
+                elif key in (curses.KEY_LEFT, ord("p")):
+                    self.set_phase(self.phase_index - 1)
+                else:
+                    break
+        finally:
+            self.suspend()
+
+    def show_section(self, config, key, value):
+        """Draws a configuration with one top-level section replaced, without waiting for a key press.
+
+        Called while a new configuration streams in: sections drawn since the last suspend are
+        kept, so the classroom fills in section by section. The screen stays up until the next
+        show() or suspend().
+
+        Args:
+            config: The configuration the new one is replacing.
+            key: The name of the section that streamed in.
+            value: The new value of the section.
+        """
+        if self.stdscr is None:
+            self.start()
+        base = self.config if self.previewing else config
+        self.previewing = True
+        self.update({**base, key: value})
+
+    def set_phase(self, index):
+        """Switches the displayed phase, redrawing only what differs between the two phases."""
+        phases = (self.config or {}).get("phases") or []
+        if phases:
+            self.phase_index = index % len(phases)
+            self.update(self.config)
+
+    def select_phase(self, config, phase):
+        """Selects the phase to display next by name, or one step with 'next' or 'previous'."""
+        names = [item.get("name") if isinstance(item, dict) else item for item in config.get("phases") or []]
+        if phase in ("next", "previous") and names:
+            self.phase_index = (self.phase_index + (1 if phase == "next" else -1)) % len(names)
+        elif phase in names:
+            self.phase_index = names.index(phase)
+
+    def _color_pair(self, group):
+        """Returns the color pair number of a group, initializing color pairs once."""
+        if not self.colors_ready:
+            self.colors_ready = True
+            if not self.virtual and curses.has_colors():
+                for i, color in enumerate(GROUP_COLORS):
+                    curses.init_pair(i + 1, getattr(curses, color), curses.COLOR_BLACK)
+        return self.group_pairs.get(group, 0)
+
+    def _attr(self, pair):
+        return 0 if self.virtual else curses.color_pair(pair)
+
+    def _put(self, y, x, text, pair=0):
+        try:
+            self.stdscr.addstr(y, x, text, self._attr(pair))
+        except curses.error:
+            pass  # Writing to the bottom-right corner or off screen
+
+    def _rectangle(self, top, left, bottom, right):
+        if not self.virtual:
+            try:
+                textpad.rectangle(self.stdscr, top, left, bottom, right)
+            except curses.error:
+                pass
+            return
+        self._put(top, left, "+" + "-" * (right - left - 1) + "+")
+        for y in range(top + 1, bottom):
+            self._put(y, left, "|")
+            self._put(y, right, "|")
+        self._put(bottom, left, "+" + "-" * (right - left - 1) + "+")
+
+    def _layout(self, config, height, width):
+        """Computes the cells to display: key -> (y, x, text, width, color pair)."""
+        cells = {}
+
+        def message(text, offset):
+            cells[("message",)] = (height // 2, max(0, width // 2 - offset), text, len(text), 0)
+            return cells
+
+        if not config.get("phases"):
+            return message("No phases defined yet.", 10)
+        if not config.get("boards"):
+            return message("No boards defined yet.", 9)
+
+        phase = config["phases"][self.phase_index % len(config["phases"])]
+        current_phase, current_board_name = phase["name"], phase["board"]
+        current_board = next((board for board in config["boards"] if board["board_name"] == current_board_name), None)
+        if current_board is None:
+            return message("Board not found for this phase.", 12)
+
+        display_width = width - 4
+        cells[("phase",)] = (1, 2 + display_width // 2 - len(current_phase) // 2, current_phase, len(current_phase), 0)
+
+        classroom_top, classroom_left, classroom_bottom, classroom_right = classroom_frame(height, width)
+        accounts = config.get("accounts", {})
+        # Locations are in room units, scaled to the cells of the classroom rectangle as ClassroomLayout does
+        classroom = classroom_cells(height, width)
+
+        # Icons first, then their name labels wherever they do not overlap an icon or another label
+        grid = OccupancyGrid(width, height)
+        labels = []
+        for account_type in ("teachers", "students", "devices"):
+            members = accounts.get(account_type, {})
+            if not members:
+                cells[("status",)] = (height - 3, 2, f"Error: No {account_type} defined yet.", 0, 0)
+                continue
+            for name, details in members.items():
+                location = details.get("locations", {}).get(current_phase)
+                if location is None:
+                    continue
+
+                # Ensure the account is within classroom bounds
+                column, row = to_cell(location, classroom)
+                x, y = classroom_left + 1 + column, classroom_top + 1 + row
+                x = max(classroom_left + 1, min(x, classroom_right - 2))
+                y = max(classroom_top + 1, min(y, classroom_bottom - 1))
+                groups = details.get("groups") or [None]
+                pair = self._color_pair(groups[0])
+                icon = ACCOUNT_ICONS[account_type]
+                # Erasing an icon also covers each of its code points
+                cells[(account_type, name, "icon")] = (y, x, icon, max(ICON_WIDTH, len(icon)), pair)
+                grid.occupy(x, y, ICON_WIDTH)
+                labels.append((account_type, name, x, y, pair))
+
+        label_bounds = (classroom_left + 1, classroom_top + 1, classroom_right - 1, classroom_bottom - 1)
+        for account_type, name, x, y, pair in labels:
+            position = place_label(grid, x, y, name, label_bounds)
+            if position is not None:
+                cells[(account_type, name, "name")] = (position[1], position[0], name, len(name), pair)
+
+        if ("status",) in cells:
+            y, x, text, _, pair = cells[("status",)]
+            cells[("status",)] = (y, x, text, len(text), pair)
+
+        resource_y = classroom_bottom + 1
+        for resource_name in RESOURCES:
+            if not self.visibility.defines(resource_name, current_phase):
+                text = f"{resource_name.capitalize()}: Resource not defined yet."
+            else:
+                seeing = self.visibility.groups_seeing(resource_name, current_phase)
+                text = f"{resource_name.capitalize()}: " + ", ".join(seeing)
+            cells[("resource", resource_name)] = (resource_y, 2, text, len(text), 0)
+            resource_y += 1
+
+        cells[("hint",)] = (height - 1, 2, NAVIGATION_HINT[:max(0, width - 3)], min(len(NAVIGATION_HINT), max(0, width - 3)), 0)
+        return cells
+
+    def update(self, config):
+        """Draws a configuration, redrawing only the cells that changed since the last update.
+
+        Args:
+            config: The configuration to display.
+        """
+        height, width = self.stdscr.getmaxyx()
+        if config is not self.config:
+            self.visibility = VisibilityMatrix(config)
+            self.group_pairs = {group: i % len(GROUP_COLORS) + 1 for i, group in enumerate(config.get("groups", []))}
+            phases = config.get("phases") or []
+            self.phase_index = min(self.phase_index, max(0, len(phases) - 1))
+        self.config = config
+
+        cells = self._layout(config, height, width)
+        framed = ("phase",) in cells
+        full_redraw = (height, width) != self.size or framed != (("phase",) in self.cells)
+        self.size = (height, width)
+
+        if full_redraw:
+            self.stdscr.clear()
+            if framed:
+                self._rectangle(0, 2, 3, width - 2)
+                self._rectangle(*classroom_frame(height, width))
+            changed = cells
+        else:
+            changed = {key: cell for key, cell in cells.items() if self.cells.get(key) != cell}
+            removed = [cell for key, cell in self.cells.items() if cells.get(key) != cell]
+
+            # Erase cells that moved or disappeared, then redraw unchanged cells they overlapped
+            erased = {}
+            for y, x, _, cell_width, _ in removed:
+                self._put(y, x, " " * cell_width)
+                erased.setdefault(y, []).append((x, x + cell_width))
+            for key, (y, x, text, cell_width, pair) in cells.items():
+                if key not in changed and any(x < end and start < x + cell_width for start, end in erased.get(y, ())):
+                    changed[key] = (y, x, text, cell_width, pair)
+
+        for y, x, text, _, pair in changed.values():
+            self._put(y, x, text, pair)
+
+        self.cells = cells
+        self.stdscr.refresh()
+        return len(changed)
@@ -1,5 +1,6 @@
 import os
 import json
+import functools
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -10,6 +11,53 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 LOCATION = os.getenv("LOCATION")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL")
 
+# Model backend: 'vertex' (Gemini on Vertex AI) or 'local' (deterministic stand-in for offline runs)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "vertex")
+LOCAL_MODEL_LATENCY = float(os.getenv("LOCAL_MODEL_LATENCY", "0"))
+LOCAL_MODEL_TOKENS_PER_SECOND = float(os.getenv("LOCAL_MODEL_TOKENS_PER_SECOND", "0")) or None
+LOCAL_MODEL_REPLAY_DIR = os.getenv("LOCAL_MODEL_REPLAY_DIR")
+# Fault injection for the local backend: share of calls that fail, or that are slowed down by LOCAL_MODEL_SLOW_SECONDS
+LOCAL_MODEL_FAULT_RATE = float(os.getenv("LOCAL_MODEL_FAULT_RATE", "0"))
+LOCAL_MODEL_SLOW_RATE = float(os.getenv("LOCAL_MODEL_SLOW_RATE", "0"))
+LOCAL_MODEL_SLOW_SECONDS = float(os.getenv("LOCAL_MODEL_SLOW_SECONDS", "5"))
+
+# Model calls: deadline per call and per first response chunk, retries of transient errors, optional
+# hedged duplicate requests (MODEL_HEDGE=1), and limits shared by the sessions of this process
+MODEL_DEADLINE = float(os.getenv("MODEL_DEADLINE", "120"))
+MODEL_FIRST_CHUNK_TIMEOUT = float(os.getenv("MODEL_FIRST_CHUNK_TIMEOUT", "30"))
+MODEL_RETRIES = int(os.getenv("MODEL_RETRIES", "3"))
+MODEL_HEDGE = os.getenv("MODEL_HEDGE", "0").lower() in ("1", "true", "yes")
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "4"))
+MODEL_RATE_LIMIT = float(os.getenv("MODEL_RATE_LIMIT", "0")) or None  # Calls per second
+MODEL_RATE_BURST = float(os.getenv("MODEL_RATE_BURST", "0")) or None
+
+# Model response cache (set RESPONSE_CACHE_DIR to persist responses between runs)
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR")
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+RESPONSE_CACHE_DISK_BYTES = int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(50 * 1024 * 1024)))
+
+# Extraction: EXTRACTION_SECTIONED=1 regenerates only the sections an edit affects, with one concurrent
+# model call per section, before falling back to regenerating the whole configuration
+EXTRACTION_SECTIONED = os.getenv("EXTRACTION_SECTIONED", "0").lower() in ("1", "true", "yes")
+# EXTRACTION_REPAIR=0 asks the model again for any invalid configuration instead of repairing it locally
+EXTRACTION_REPAIR = os.getenv("EXTRACTION_REPAIR", "1").lower() in ("1", "true", "yes")
+
+# Tracing (set TRACE_FILE to write the spans of each turn as JSON lines; TRACE_PROFILE_TURN to cProfile one turn)
+TRACE_FILE = os.getenv("TRACE_FILE")
+TRACE_PROFILE_TURN = int(os.getenv("TRACE_PROFILE_TURN", "0")) or None
+
+# Speech: 'gtts' (online), 'pyttsx3' (offline system voices) or 'null' (no audio, e.g. headless Linux)
+SPEECH_BACKEND = os.getenv("SPEECH_BACKEND", "gtts")
+SPEECH_SPEED = float(os.getenv("SPEECH_SPEED", "3"))
+SPEECH_CACHE_SIZE = int(os.getenv("SPEECH_CACHE_SIZE", "128"))
+# Audio output: 'auto', 'simpleaudio', 'pyaudio', 'command' (afplay/aplay) or 'null'
+PLAYBACK_BACKEND = os.getenv("PLAYBACK_BACKEND", "auto")
+
+# Session journal: each session is saved under SESSION_DIR as it is edited (empty to disable); see --resume
+SESSION_DIR = os.getenv("SESSION_DIR", "sessions")
+SESSION_HISTORY = int(os.getenv("SESSION_HISTORY", "50"))  # Versions kept for undo
+SESSION_SEGMENT_BYTES = int(os.getenv("SESSION_SEGMENT_BYTES", str(1024 * 1024)))
+
 # Paths to configuration files
 ACTIVITY_CONFIG_FILE = "activity_config_template.json"
 ACTIVITY_CONFIG_SCHEMA_FILE = "activity_config_schema.json"
@@ -23,3 +71,8 @@ def load_activity_config_schema():
     """Loads the activity configuration schema from the JSON file."""
     with open(ACTIVITY_CONFIG_SCHEMA_FILE, "r") as f:
         return json.load(f)
+
+@functools.lru_cache(maxsize=None)
+def activity_config_schema():
+    """Returns the activity configuration schema, loaded once and shared by the clients; do not modify it."""
+    return load_activity_config_schema()
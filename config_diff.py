@@ -0,0 +1,184 @@
+import json
+from collections import namedtuple
+from visibility import resource_grants
+
+MAX_LISTED = 8  # Names listed per change line before the rest are counted
+
+
+def _phase_name(phase):
+    """Returns the name of a phase, given as an object or (in older configurations) as a string."""
+    return phase.get("name") if isinstance(phase, dict) else phase
+
+
+def _format(value):
+    if isinstance(value, dict) and set(value) == {"x", "y"}:
+        return f"({value['x']}, {value['y']})"
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _listed(names, sign=""):
+    names = list(names)
+    listed = [f"{sign}{name}" for name in names[:MAX_LISTED]]
+    if len(names) > MAX_LISTED:
+        listed.append(f"{sign}{len(names) - MAX_LISTED} more")
+    return listed
+
+
+class Change(namedtuple("Change", ["kind", "path", "added", "removed", "before", "after"])):
+    """A change between two configurations.
+
+    kind is 'members' (names added to or removed from a collection), 'value' (a value replaced),
+    'order' (the same names in a different order) or 'moved' (account locations in one phase,
+    with added holding (name, before, after) triples).
+    """
+
+    def describe(self):
+        """Returns the change as one compact line, e.g. 'groups: +QA Team -Testers'."""
+        path = "/".join(str(part) for part in self.path)
+        if self.kind == "members":
+            return f"{path}: " + " ".join(_listed(self.added, "+") + _listed(self.removed, "-"))
+        if self.kind == "order":
+            return f"{path}: reordered to " + ", ".join(_listed(self.after))
+        if self.kind == "moved":
+            moves = [f"{name} {_format(before) if before else 'unplaced'} -> {_format(after) if after else 'unplaced'}"
+                     for name, before, after in self.added[:MAX_LISTED]]
+            if len(self.added) > MAX_LISTED:
+                moves.append(f"{len(self.added) - MAX_LISTED} more moved")
+            return f"{path}: " + "; ".join(moves)
+        return f"{path}: {_format(self.before)} -> {_format(self.after)}"
+
+
+def _members(path, before, after, changes):
+    """Records the names added to and removed from a collection, ignoring order."""
+    before_set, after_set = set(before), set(after)
+    added = [name for name in after if name not in before_set]
+    removed = [name for name in before if name not in after_set]
+    if added or removed:
+        changes.append(Change("members", path, added, removed, None, None))
+    return before_set & after_set
+
+
+def _value(path, before, after, changes):
+    if before != after:
+        changes.append(Change("value", path, [], [], before, after))
+
+
+def _order(path, before, after, common, changes):
+    """Records a reordering of the names kept in a collection."""
+    before_order = [name for name in before if name in common]
+    after_order = [name for name in after if name in common]
+    if before_order != after_order:
+        changes.append(Change("order", path, [], [], before_order, after_order))
+
+
+def _diff_phases(before, after, changes):
+    old = {_phase_name(phase): phase for phase in before if isinstance(phase, (dict, str))}
+    new = {_phase_name(phase): phase for phase in after if isinstance(phase, (dict, str))}
+    common = _members(("phases",), list(old), list(new), changes)
+    for name in new:
+        if name in common and isinstance(old[name], dict) and isinstance(new[name], dict):
+            _value(("phases", name, "board"), old[name].get("board"), new[name].get("board"), changes)
+    _order(("phases",), list(old), list(new), common, changes)
+
+
+def _diff_visibility(path, before, after, changes):
+    """Records the groups that started or stopped seeing a resource, per phase."""
+    import numpy as np
+
+    phases = list(dict.fromkeys([*before, *after]))
+    groups = dict.fromkeys(
+        group for visibility in (after, before) for assigned in visibility.values() if isinstance(assigned, list)
+        for group in assigned if isinstance(group, str)
+    )
+    phase_index = {phase: row for row, phase in enumerate(phases)}
+    group_index = {group: column for column, group in enumerate(groups)}
+    old, new = resource_grants(before, phase_index, group_index)[0], resource_grants(after, phase_index, group_index)[0]
+    names = list(groups)
+    for row in np.flatnonzero((old != new).any(axis=1)):
+        added, removed = np.flatnonzero(new[row] & ~old[row]), np.flatnonzero(old[row] & ~new[row])
+        changes.append(Change("members", path + (phases[row],), [names[column] for column in added],
+                              [names[column] for column in removed], None, None))
+
+
+def _diff_boards(before, after, changes):
+    old = {board.get("board_name"): board for board in before if isinstance(board, dict)}
+    new = {board.get("board_name"): board for board in after if isinstance(board, dict)}
+    common = _members(("boards",), list(old), list(new), changes)
+    for board_name in new:
+        if board_name not in common or old[board_name] == new[board_name]:
+            continue
+        old_board, new_board = old[board_name], new[board_name]
+        for key in dict.fromkeys([*old_board, *new_board]):
+            old_value, new_value = old_board.get(key), new_board.get(key)
+            if key == "board_name" or old_value == new_value:
+                continue
+            path = ("boards", board_name, key)
+            if isinstance(old_value or new_value, dict):
+                _diff_visibility(path, old_value or {}, new_value or {}, changes)
+            elif isinstance(old_value or new_value, list):
+                _members(path, old_value or [], new_value or [], changes)
+            else:
+                _value(path, old_value, new_value, changes)
+
+
+def _diff_accounts(before, after, changes):
+    for account_type in dict.fromkeys([*before, *after]):
+        old, new = before.get(account_type) or {}, after.get(account_type) or {}
+        if old == new:
+            continue
+        common = _members(("accounts", account_type), list(old), list(new), changes)
+        moves = {}
+        for name in new:
+            if name not in common or old[name] == new[name]:
+                continue
+            _members(("accounts", account_type, name, "groups"), old[name].get("groups") or [],
+                     new[name].get("groups") or [], changes)
+            old_locations, new_locations = old[name].get("locations") or {}, new[name].get("locations") or {}
+            for phase in dict.fromkeys([*old_locations, *new_locations]):
+                if old_locations.get(phase) != new_locations.get(phase):
+                    moves.setdefault(phase, []).append((name, old_locations.get(phase), new_locations.get(phase)))
+        for phase, moved in moves.items():
+            changes.append(Change("moved", ("accounts", account_type, "locations", phase), moved, [], None, None))
+
+
+def diff_configs(before, after):
+    """Compares two activity configurations structurally.
+
+    Phases, boards and accounts are matched by name, so reordering them or editing one
+    reports only that item. Resource visibility is compared per phase, and account
+    locations are reported as moves per phase. New accounts are reported as added,
+    without their locations.
+
+    Args:
+        before: The configuration before the turn.
+        after: The configuration after the turn.
+
+    Returns:
+        A list of Change tuples, empty if the configurations are equal.
+    """
+    before, after = before or {}, after or {}
+    if before is after or before == after:
+        return []
+
+    changes = []
+    for key in dict.fromkeys([*before, *after]):
+        old, new = before.get(key), after.get(key)
+        if old == new:
+            continue
+        if key == "phases":
+            _diff_phases(old or [], new or [], changes)
+        elif key == "boards":
+            _diff_boards(old or [], new or [], changes)
+        elif key == "groups":
+            common = _members(("groups",), old or [], new or [], changes)
+            _order(("groups",), old or [], new or [], common, changes)
+        elif key == "accounts":
+            _diff_accounts(old or {}, new or {}, changes)
+        else:
+            _value((key,), old, new, changes)
+    return changes
+
+
+def summarize_changes(changes):
+    """Returns the compact, one line per change summary of a diff."""
+    return [change.describe() for change in changes]
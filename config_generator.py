@@ -0,0 +1,119 @@
+import copy
+import math
+import random
+from layout_engine import ROOM_WIDTH, ROOM_HEIGHT, DEFAULT_ZONES, STUDENT_AREA
+from visibility import RESOURCES
+
+MAX_BUCKETS = 4  # From the activity config schema
+ACCOUNT_PREFIXES = {"students": "Student", "teachers": "Teacher", "devices": "Device"}
+
+
+def _seats(count, area, width=ROOM_WIDTH, height=ROOM_HEIGHT):
+    """Returns count (x, y) seats spread in rows over an area given as fractions of the room."""
+    if not count:
+        return []
+    left, top, right, bottom = area
+    x0, x1 = int(left * width), int(right * width) - 1
+    y0, y1 = int(top * height), int(bottom * height) - 1
+    columns = max(1, min(x1 - x0 + 1, math.ceil(math.sqrt(count * (x1 - x0 + 1) / max(1, y1 - y0 + 1)))))
+    rows = math.ceil(count / columns)
+    return [
+        (x0 + (index % columns) * (x1 - x0) // max(1, columns - 1),
+         y0 + (index // columns) * (y1 - y0) // max(1, rows - 1))
+        for index in range(count)
+    ]
+
+
+def generate_config(students=30, teachers=1, devices=0, groups=4, phases=3, boards=1, buckets=2, seed=0):
+    """Generates a schema-valid activity configuration of a given size, e.g. for benchmarks.
+
+    Phases are assigned to boards in turn, and each board's resources are visible to a random
+    set of groups in each of its phases. Accounts are seated in rows (teachers at the front,
+    devices at the back), in a different order in each phase, so that every account moves
+    between phases. The same arguments always give the same configuration.
+
+    Args:
+        students: The number of students.
+        teachers: The number of teachers.
+        devices: The number of devices.
+        groups: The number of groups; accounts are assigned to them in turn.
+        phases: The number of phases.
+        boards: The number of boards; at most the number of phases.
+        buckets: The number of buckets on each board, at most 4.
+        seed: The seed of the random choices.
+
+    Returns:
+        The configuration as a JSON object.
+    """
+    if buckets > MAX_BUCKETS:
+        raise ValueError(f"A board has at most {MAX_BUCKETS} buckets")
+    if groups < 1 or phases < 1 or not 1 <= boards <= phases:
+        raise ValueError("A configuration needs at least one group and phase, and one to as many boards as phases")
+
+    rng = random.Random(seed)
+    group_names = [f"Group {i + 1}" for i in range(groups)]
+    board_names = [f"Board {i + 1}" for i in range(boards)]
+    phase_list = [{"name": f"Phase {i + 1}", "board": board_names[i % boards]} for i in range(phases)]
+
+    board_list = []
+    for board_name in board_names:
+        board_phases = [phase["name"] for phase in phase_list if phase["board"] == board_name]
+        board = {"board_name": board_name}
+        for resource in RESOURCES:
+            board[resource] = {
+                phase: sorted(rng.sample(group_names, rng.randint(1 if resource == "canvas" else 0, groups)), key=group_names.index)
+                for phase in board_phases
+            }
+        board["buckets"] = [f"Bucket {i + 1}" for i in range(buckets)]
+        board_list.append(board)
+
+    counts = {"teachers": teachers, "students": students, "devices": devices}
+    accounts = {}
+    for account_type, count in counts.items():
+        digits = len(str(count))
+        names = [f"{ACCOUNT_PREFIXES[account_type]} {i + 1:0{digits}d}" for i in range(count)]
+        seats = _seats(count, DEFAULT_ZONES.get(account_type, STUDENT_AREA))
+        locations = {name: {} for name in names}
+        for phase in phase_list:
+            order = rng.sample(seats, len(seats))
+            for name, (x, y) in zip(names, order):
+                locations[name][phase["name"]] = {"x": x, "y": y}
+        accounts[account_type] = {
+            name: {"groups": [group_names[i % groups]], "locations": locations[name]} for i, name in enumerate(names)
+        }
+
+    return {
+        "project_name": f"Synthetic Classroom ({students} students)",
+        "phases": phase_list,
+        "boards": board_list,
+        "groups": group_names,
+        "accounts": accounts
+    }
+
+
+def edit_config(config, seed=0):
+    """Returns a copy of a configuration with the edits of a typical turn, e.g. for diff benchmarks.
+
+    A student is moved in the first phase, a student is added without locations, and the
+    groups that see the first board's canvas in its first phase change. The input is not modified.
+    """
+    rng = random.Random(seed)
+    edited = copy.copy(config)
+    accounts = edited["accounts"] = dict(config["accounts"])
+    students = accounts["students"] = dict(accounts.get("students", {}))
+    phase = config["phases"][0]["name"]
+    if students:
+        name = rng.choice(sorted(students))
+        locations = dict(students[name]["locations"])
+        locations[phase] = {"x": rng.randint(0, ROOM_WIDTH), "y": rng.randint(0, ROOM_HEIGHT)}
+        students[name] = {**students[name], "locations": locations}
+    students[f"New Student {len(students) + 1}"] = {"groups": [config["groups"][0]], "locations": {}}
+
+    board = dict(config["boards"][0])
+    canvas = board["canvas"] = dict(board["canvas"])
+    board_phase = next(iter(canvas), None)
+    if board_phase is not None:
+        shown = set(canvas[board_phase]) ^ {rng.choice(config["groups"])}
+        canvas[board_phase] = [group for group in config["groups"] if group in shown]
+    edited["boards"] = [board] + config["boards"][1:]
+    return edited
@@ -0,0 +1,189 @@
+import json
+import re
+from collections import namedtuple
+from json_patch import apply_patch, JsonPatchError
+
+MAX_ROUNDS = 4  # References are only checked once a subtree is schema-valid, so a repair can reveal more errors
+MAX_LISTED = 8  # Repairs listed per log line before the rest are counted
+
+
+class Repair(namedtuple("Repair", ["operation", "reason"])):
+    """A local fix of a validation error: a JSON Patch operation and the reason it was made."""
+
+    def describe(self):
+        """Returns the repair as one compact line, e.g. "/boards/0/buckets: removed 1 duplicate"."""
+        return f"{self.operation['path']}: {self.reason}"
+
+
+def _pointer(path):
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in path)
+
+
+def _lookup(config, path):
+    """Returns the value at a path of a configuration, or None if the path does not exist."""
+    value = config
+    for part in path:
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and isinstance(part, int) and 0 <= part < len(value):
+            value = value[part]
+        else:
+            return None
+    return value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _normalized(name):
+    """Returns a name without case, spacing, punctuation or a plural s, e.g. 'developers' -> 'developer'."""
+    key = re.sub(r"[\W_]+", "", name.casefold())
+    return key[:-1] if len(key) > 3 and key.endswith("s") else key
+
+
+def closest_name(name, names):
+    """Returns the one name of names that name refers to up to case, spacing and a plural s, or None."""
+    if not isinstance(name, str):
+        return None
+    key = _normalized(name)
+    matches = {candidate for candidate in names if isinstance(candidate, str) and _normalized(candidate) == key}
+    return matches.pop() if len(matches) == 1 else None
+
+
+def _defined(config, section, key=None):
+    items = config.get(section) if isinstance(config.get(section), list) else []
+    return [item.get(key) if isinstance(item, dict) and key else item for item in items]
+
+
+def repairs_for(config, error):
+    """Returns the repairs that fix a validation error of a configuration, or [] if there is no safe fix.
+
+    Out-of-range numbers are clamped, non-integral coordinates rounded, duplicate items removed
+    and lists over their maximum length truncated. A reference to an undefined phase, board or
+    group is pointed at the defined name it differs from only in case, spacing or a plural s;
+    otherwise an undefined phase is dropped (its visibility or location) and an undefined
+    group declared, since something is assigned to it. Accounts without locations get empty
+    ones, to be placed locally.
+
+    Args:
+        config: The configuration the error was found in.
+        error: A jsonschema.exceptions.ValidationError from ConfigValidator.iter_errors.
+
+    Returns:
+        A list of Repair tuples.
+    """
+    path, rule, bound = list(error.absolute_path), error.validator, error.validator_value
+    pointer, value = _pointer(path), _lookup(config, path)
+
+    if rule in ("minimum", "maximum") and _is_number(value) and _is_number(bound):
+        clamped = max(value, bound) if rule == "minimum" else min(value, bound)
+        return [Repair({"op": "replace", "path": pointer, "value": clamped}, f"clamped {value} to the {rule} {bound}")]
+    if rule == "type" and bound == "integer" and _is_number(value):
+        return [Repair({"op": "replace", "path": pointer, "value": round(value)}, f"rounded {value}")]
+    if rule == "uniqueItems" and isinstance(value, list):
+        unique = []
+        for item in value:
+            if item not in unique:
+                unique.append(item)
+        removed = len(value) - len(unique)
+        return [Repair({"op": "replace", "path": pointer, "value": unique},
+                       f"removed {removed} duplicate{'s' if removed != 1 else ''}")]
+    if rule == "maxItems" and isinstance(value, list) and isinstance(bound, int):
+        return [Repair({"op": "replace", "path": pointer, "value": value[:bound]},
+                       f"kept the first {bound} of {len(value)} items")]
+    if rule == "required" and path[:1] == ["accounts"] and len(path) == 3 and isinstance(value, dict):
+        if [key for key in bound if key not in value] == ["locations"]:
+            return [Repair({"op": "add", "path": pointer + "/locations", "value": {}},
+                           "added empty locations, to be placed locally")]
+        return []
+
+    if rule == "phaseReference" and path:
+        container = _lookup(config, path[:-1])
+        match = closest_name(error.instance, _defined(config, "phases", "name"))
+        if match is not None and isinstance(container, dict) and match not in container:
+            return [Repair({"op": "move", "from": pointer, "path": _pointer(path[:-1] + [match])},
+                           f"{error.instance!r} renamed to the defined phase {match!r}")]
+        return [Repair({"op": "remove", "path": pointer}, f"dropped the undefined phase {error.instance!r}")]
+    if rule == "groupReference":
+        match = closest_name(error.instance, _defined(config, "groups"))
+        if match is not None:
+            return [Repair({"op": "replace", "path": pointer, "value": match},
+                           f"{error.instance!r} replaced by the defined group {match!r}")]
+        if isinstance(error.instance, str) and isinstance(config.get("groups"), list):
+            return [Repair({"op": "add", "path": "/groups/-", "value": error.instance},
+                           f"declared the group {error.instance!r}, which {pointer} refers to")]
+        return []
+    if rule == "boardReference":
+        boards = [name for name in _defined(config, "boards", "board_name") if isinstance(name, str)]
+        match = closest_name(error.instance, boards) or (boards[0] if len(boards) == 1 else None)
+        if match is not None:
+            return [Repair({"op": "replace", "path": pointer, "value": match},
+                           f"{error.instance!r} replaced by the board {match!r}")]
+    return []
+
+
+def repair_config(config, validator, max_rounds=MAX_ROUNDS):
+    """Validates a configuration, repairing its errors locally where a safe fix exists.
+
+    The repairs of all errors found are applied together as one JSON Patch (so the input is
+    not modified, and unchanged parts are shared with it), and the result is validated again,
+    for up to max_rounds rounds. If an error has no safe repair, none is attempted.
+
+    Args:
+        config: The configuration to validate, e.g. as generated by the model.
+        validator: The ConfigValidator to validate with.
+        max_rounds: The maximum number of rounds of repairs.
+
+    Returns:
+        A tuple of the valid (possibly repaired) configuration and the list of Repair tuples made.
+
+    Raises:
+        jsonschema.exceptions.ValidationError: If the configuration is invalid and cannot be
+            repaired; the most relevant unrepairable error is raised.
+    """
+    import jsonschema
+
+    repairs = []
+    errors = list(validator.iter_errors(config))
+    for _ in range(max_rounds):
+        if not errors:
+            break
+        # One repair per path: the others are found again in the next round if still needed. Duplicates
+        # are removed before a list is truncated, so that truncation keeps as many distinct items as it can.
+        errors.sort(key=lambda error: error.validator != "uniqueItems")
+        operations = {}
+        unrepairable = []
+        for error in errors:
+            fixes = repairs_for(config, error)
+            if not fixes:
+                unrepairable.append(error)
+            for fix in fixes:
+                path = fix.operation["path"]
+                key = json.dumps(fix.operation, sort_keys=True) if path.endswith("/-") else path
+                operations.setdefault(key, (_pointer(error.absolute_path), fix))
+        # Errors inside a part that is dropped need no repair (e.g. an undefined group of an undefined phase)
+        dropped = [fix.operation["path"] + "/" for _, fix in operations.values() if fix.operation["op"] == "remove"]
+        operations = {key: (source, fix) for key, (source, fix) in operations.items()
+                      if not any(source.startswith(prefix) for prefix in dropped)}
+        if unrepairable:
+            raise jsonschema.exceptions.best_match(unrepairable)
+        try:
+            # Deeper paths first, so that a fix inside a phase's visibility comes before the phase is moved or dropped
+            fixes = sorted((fix for _, fix in operations.values()), key=lambda fix: -fix.operation["path"].count("/"))
+            config = apply_patch(config, [fix.operation for fix in fixes])
+        except JsonPatchError:
+            break
+        repairs.extend(fixes)
+        errors = list(validator.iter_errors(config))
+    if errors:
+        raise jsonschema.exceptions.best_match(errors)
+    return config, repairs
+
+
+def summarize_repairs(repairs):
+    """Returns a one-line summary of the repairs made to a configuration."""
+    listed = [repair.describe() for repair in repairs[:MAX_LISTED]]
+    if len(repairs) > MAX_LISTED:
+        listed.append(f"{len(repairs) - MAX_LISTED} more")
+    return f"Repaired {len(repairs)} problem{'s' if len(repairs) != 1 else ''} locally: " + "; ".join(listed)
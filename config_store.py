@@ -0,0 +1,322 @@
+import json
+import os
+import time
+from config import SESSION_DIR, SESSION_HISTORY, SESSION_SEGMENT_BYTES
+from json_patch import apply_patch
+from tracing import span
+
+KEEP_SEGMENTS = 2  # Journal segments kept on disk; undo after a resume reaches back to the oldest
+SYNC_RECORDS = 8  # Records written between fsyncs
+SYNC_SECONDS = 1.0  # Maximum seconds between fsyncs while records are written
+SEGMENT_PREFIX = "segment-"
+
+
+def _escape(key):
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+def make_patch(before, after, pointer=""):
+    """Returns an RFC 6902 JSON Patch that turns one document into another.
+
+    Subtrees that are the same object are skipped without comparing them, so a patch between
+    two snapshots that share structure (see share_structure) costs as much as the change.
+
+    Args:
+        before: The original document.
+        after: The changed document.
+        pointer: The JSON Pointer of the documents within a larger document.
+
+    Returns:
+        A list of patch operations, empty if the documents are equal.
+    """
+    if before is after:
+        return []
+    if isinstance(before, dict) and isinstance(after, dict):
+        patch = [{"op": "remove", "path": f"{pointer}/{_escape(key)}"} for key in before if key not in after]
+        for key, value in after.items():
+            path = f"{pointer}/{_escape(key)}"
+            if key in before:
+                patch.extend(make_patch(before[key], value, path))
+            else:
+                patch.append({"op": "add", "path": path, "value": value})
+        return patch
+    if isinstance(before, list) and isinstance(after, list):
+        patch = []
+        for index in range(min(len(before), len(after))):
+            patch.extend(make_patch(before[index], after[index], f"{pointer}/{index}"))
+        patch.extend({"op": "add", "path": f"{pointer}/-", "value": value} for value in after[len(before):])
+        patch.extend({"op": "remove", "path": f"{pointer}/{index}"} for index in reversed(range(len(after), len(before))))
+        return patch
+    if type(before) is type(after) and before == after:
+        return []
+    return [{"op": "replace", "path": pointer, "value": after}]
+
+
+def _item_name(item):
+    """Returns the name that identifies a board or phase in its list, or None."""
+    if isinstance(item, dict):
+        name = item.get("board_name", item.get("name"))
+        return name if isinstance(name, str) else None
+    return None
+
+
+def share_structure(previous, current):
+    """Returns current, reusing the objects of previous for every part that is unchanged.
+
+    Dictionaries are matched by key, and lists of named items (boards, phases) by name, so
+    an unchanged board or account is kept once in memory however many snapshots refer to it.
+    Neither document is modified.
+    """
+    if previous is current or type(previous) is not type(current):
+        return current
+    if isinstance(current, dict):
+        shared = {key: share_structure(previous.get(key), value) for key, value in current.items()}
+        if len(shared) == len(previous) and all(key in previous and previous[key] is value for key, value in shared.items()):
+            return previous
+        return shared
+    if isinstance(current, list):
+        named = {_item_name(item): item for item in previous if _item_name(item) is not None}
+        shared = [
+            share_structure(named.get(_item_name(item)) if _item_name(item) is not None else
+                            (previous[index] if index < len(previous) else None), item)
+            for index, item in enumerate(current)
+        ]
+        if len(shared) == len(previous) and all(a is b for a, b in zip(shared, previous)):
+            return previous
+        return shared
+    return previous if previous == current else current
+
+
+class Journal:
+    def __init__(self, directory, segment_bytes=SESSION_SEGMENT_BYTES, keep_segments=KEEP_SEGMENTS,
+                 sync_records=SYNC_RECORDS, sync_seconds=SYNC_SECONDS):
+        """Initializes the Journal, an append-only log of a session in numbered segment files.
+
+        Every record is flushed to the operating system when it is written, so it survives a
+        crash of the designer; fsyncs, which protect against power loss, are batched. Each
+        segment starts with a snapshot, so old segments can be deleted without replaying them.
+
+        Args:
+            directory: The directory of the session's segments, created if needed.
+            segment_bytes: The size after which the next record starts a new segment.
+            keep_segments: The number of segments kept on disk.
+            sync_records: The records written between fsyncs.
+            sync_seconds: The maximum seconds between fsyncs while records are written.
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self.sync_records = sync_records
+        self.sync_seconds = sync_seconds
+        self.file = None
+        self.tail = None  # (path, bytes) of the complete records of the last segment read
+        self.pending = 0  # Records written since the last fsync
+        self.synced_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+
+    def segments(self):
+        """Returns the paths of the segments, oldest first."""
+        names = sorted(name for name in os.listdir(self.directory) if name.startswith(SEGMENT_PREFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def read(self):
+        """Yields the records of all segments in order.
+
+        A segment that does not start with a snapshot is skipped, and a segment's last line is
+        ignored if a crash left it incomplete.
+        """
+        for path in self.segments():
+            offset = 0
+            with open(path, "rb") as f:
+                for number, line in enumerate(f):
+                    try:
+                        record = json.loads(line) if line.endswith(b"\n") else None
+                    except json.decoder.JSONDecodeError:
+                        record = None
+                    if record is None or (number == 0 and record.get("op") != "snapshot"):
+                        break
+                    offset += len(line)
+                    yield record
+            self.tail = (path, offset) if offset else None
+
+    def reopen(self):
+        """Continues writing the last segment read, dropping a record left incomplete by a crash."""
+        self.close()
+        path, offset = self.tail
+        os.truncate(path, offset)
+        self.file = open(path, "a")
+
+    @property
+    def size(self):
+        """The size in bytes of the segment being written."""
+        return self.file.tell() if self.file is not None else 0
+
+    def start_segment(self, snapshot):
+        """Starts a new segment with a snapshot record, then deletes the oldest segments."""
+        self.close()
+        segments = self.segments()
+        number = int(os.path.basename(segments[-1])[len(SEGMENT_PREFIX):-len(".jsonl")]) + 1 if segments else 1
+        self.file = open(os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}.jsonl"), "a")
+        self.append(snapshot)
+        self.sync()
+        for path in self.segments()[:-self.keep_segments]:
+            os.remove(path)
+
+    def append(self, record):
+        """Writes a record, syncing it to disk with the records before it when a batch is due."""
+        self.file.write(json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= self.sync_records or time.monotonic() - self.synced_at >= self.sync_seconds:
+            self.sync()
+
+    def sync(self):
+        if self.file is not None and self.pending:
+            os.fsync(self.file.fileno())
+        self.pending = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+class ConfigStore:
+    def __init__(self, config, journal=None, max_history=SESSION_HISTORY):
+        """Initializes the ConfigStore, the versioned configurations of a session.
+
+        Each committed configuration is kept as a snapshot that shares its unchanged parts with
+        the one before it, and is appended to the journal as a JSON Patch against its parent.
+        Snapshots must not be modified; apply_patch and ClassroomLayout.apply return new
+        configurations rather than changing them.
+
+        Args:
+            config: The first configuration.
+            journal: Optional Journal to write the session to; the store writes its first snapshot.
+            max_history: The number of versions kept for undo.
+        """
+        self.versions = [config]
+        self.first_version = 0  # Version number of versions[0]
+        self.head = 0  # Version number of the current configuration
+        self.max_history = max_history
+        self.journal = journal
+        if journal is not None:
+            journal.start_segment(self._snapshot())
+
+    @classmethod
+    def create(cls, config, root=SESSION_DIR, **options):
+        """Creates a store for a new session, journaled in a new directory under root (if given)."""
+        if not root:
+            return cls(config, **options)
+        directory = os.path.join(root, time.strftime("session-%Y%m%d-%H%M%S") + f"-{os.getpid()}")
+        return cls(config, journal=Journal(directory), **options)
+
+    @classmethod
+    def resume(cls, root=SESSION_DIR, **options):
+        """Restores the latest session under root by replaying its journal.
+
+        Returns:
+            The ConfigStore, positioned at the version the session ended on, or None if there
+            is no session to resume.
+        """
+        sessions = sorted(name for name in os.listdir(root) if name.startswith("session-")) if root and os.path.isdir(root) else []
+        for name in reversed(sessions):
+            journal = Journal(os.path.join(root, name))
+            with span("resume", session=name) as resume:
+                store = cls._replay(journal.read(), **options)
+                if store is None:
+                    continue
+                resume.set(versions=len(store.versions))
+            store.journal = journal
+            if journal.tail is not None:
+                journal.reopen()
+            else:
+                journal.start_segment(store._snapshot())  # The last segment has no complete records
+            return store
+        return None
+
+    @classmethod
+    def _replay(cls, records, **options):
+        store = None
+        for record in records:
+            op = record["op"]
+            if op == "snapshot":
+                if store is not None and store.first_version <= record["version"] <= store.last_version:
+                    store.head = record["version"]  # The state at the start of a later segment
+                    continue
+                store = cls(record["config"], **options)
+                store.first_version = store.head = record["version"]
+            elif store is None:
+                continue
+            elif op == "commit":
+                store.head = record["parent"]
+                store._add(apply_patch(store.config, record["patch"]))
+            elif op == "head" and store.first_version <= record["version"] <= store.last_version:
+                store.head = record["version"]
+        return store
+
+    @property
+    def config(self):
+        """The current configuration."""
+        return self.versions[self.head - self.first_version]
+
+    @property
+    def last_version(self):
+        return self.first_version + len(self.versions) - 1
+
+    def commit(self, config):
+        """Adds a configuration as the new current version, dropping the versions that could be redone.
+
+        Returns:
+            The version number of the configuration.
+        """
+        parent = self.config
+        with span("commit") as commit:
+            config = share_structure(parent, config)
+            if config is parent:
+                commit.set(changed=False)
+                return self.head
+            patch = make_patch(parent, config)
+            if self.journal is not None:
+                if self.journal.size >= self.journal.segment_bytes:
+                    self.journal.start_segment(self._snapshot())  # Compacts the journal
+                self.journal.append({"op": "commit", "parent": self.head, "patch": patch})
+            self._add(config)
+            commit.set(changed=True, operations=len(patch))
+        return self.head
+
+    def _add(self, config):
+        del self.versions[self.head - self.first_version + 1:]
+        self.versions.append(config)
+        self.head += 1
+        if len(self.versions) > self.max_history:
+            drop = len(self.versions) - self.max_history
+            del self.versions[:drop]
+            self.first_version += drop
+
+    def undo(self):
+        """Moves back to the previous version; returns its configuration, or None at the oldest."""
+        if self.head == self.first_version:
+            return None
+        return self._move(self.head - 1)
+
+    def redo(self):
+        """Moves forward to the version that was undone; returns its configuration, or None."""
+        if self.head == self.last_version:
+            return None
+        return self._move(self.head + 1)
+
+    def _move(self, version):
+        self.head = version
+        if self.journal is not None:
+            self.journal.append({"op": "head", "version": version})
+        return self.config
+
+    def _snapshot(self):
+        return {"op": "snapshot", "version": self.head, "config": self.config}
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
@@ -0,0 +1,206 @@
+import copy
+import functools
+from collections import deque
+from config import activity_config_schema
+from visibility import RESOURCES, ACCOUNT_TYPES, resource_grants
+
+
+@functools.lru_cache(maxsize=None)
+def compiled_schema():
+    """Checks and compiles the activity configuration schema once per process.
+
+    The schema is split into a shell validator for the top-level structure and subtree
+    validators for a single board and a single account of each type, so that only the
+    parts of a configuration that changed need to be validated again.
+
+    Returns:
+        A tuple of (shell validator, board validator, {account type: account validator}).
+    """
+    import jsonschema  # Deferred: importing jsonschema is a large part of startup time
+
+    schema = activity_config_schema()
+    validator_class = jsonschema.validators.validator_for(schema)
+    validator_class.check_schema(schema)
+
+    shell = copy.deepcopy(schema)
+    # The shell does not descend into boards or accounts, which are validated separately
+    board_schema = shell["properties"]["boards"].pop("items")
+    account_schemas = {}
+    for account_type in ACCOUNT_TYPES:
+        account_property = shell["properties"]["accounts"]["properties"][account_type]
+        account_schemas[account_type] = account_property.pop("additionalProperties")
+
+    return (
+        validator_class(shell),
+        validator_class(board_schema),
+        {account_type: validator_class(subschema) for account_type, subschema in account_schemas.items()}
+    )
+
+
+def _reference_error(message, path, validator, instance):
+    """Creates a ValidationError for a semantic rule the schema only states in a description."""
+    import jsonschema
+
+    return jsonschema.exceptions.ValidationError(message, path=deque(path), validator=validator, instance=instance)
+
+
+def _names(items, key=None):
+    """Returns the names of a list of named objects (or strings), ignoring malformed entries."""
+    names = [item.get(key) if isinstance(item, dict) and key else item for item in items]
+    return [name for name in names if isinstance(name, str)]
+
+
+class ConfigValidator:
+    def __init__(self):
+        """Initializes the ConfigValidator with the compiled activity configuration schema."""
+        self.shell_validator, self.board_validator, self.account_validators = compiled_schema()
+        # {container key: (container, {name: member that passed validation})} for the boards and each account type
+        self._valid_subtrees = {}
+        self._reference_sets = None
+
+    def _subtrees(self, config):
+        """Yields (key, container, path, validator) for the board list and the account dict of each type."""
+        boards = config.get("boards")
+        if isinstance(boards, list):
+            yield ("boards",), boards, ("boards",), self.board_validator
+
+        accounts = config.get("accounts")
+        if isinstance(accounts, dict):
+            for account_type, validator in self.account_validators.items():
+                members = accounts.get(account_type)
+                if isinstance(members, dict):
+                    yield ("accounts", account_type), members, ("accounts", account_type), validator
+
+    def iter_errors(self, config):
+        """Yields the schema and cross-reference errors of a configuration.
+
+        Boards and accounts that are unchanged since they last passed validation are not
+        validated against the schema again; cross-references are checked against name sets,
+        and only for changed subtrees unless the phase, board, or group names changed.
+        Configurations are treated as immutable, as ConfigStore versions are: a subtree that is
+        the same object as one that passed is skipped without being compared, since
+        apply_patch and share_structure keep the objects of unchanged subtrees.
+
+        Args:
+            config: The configuration to validate.
+
+        Yields:
+            jsonschema.exceptions.ValidationError for each problem found.
+        """
+        yield from self.shell_validator.iter_errors(config)
+        if not isinstance(config, dict):
+            return
+
+        phases = config.get("phases") if isinstance(config.get("phases"), list) else []
+        boards = config.get("boards") if isinstance(config.get("boards"), list) else []
+        groups = config.get("groups") if isinstance(config.get("groups"), list) else []
+        phase_names = _names(phases, "name")
+        board_names = _names(boards, "board_name")
+        reference_sets = (frozenset(phase_names), frozenset(board_names), frozenset(_names(groups)))
+        recheck_references = reference_sets != self._reference_sets
+        phase_set, board_set, group_set = reference_sets
+
+        # Phase and board names must be unique, and each phase must refer to a defined board
+        for label, names, path in (("phase", phase_names, "phases"), ("board", board_names, "boards")):
+            seen = set()
+            for index, name in enumerate(names):
+                if name in seen:
+                    yield _reference_error(f"Duplicate {label} name {name!r}", (path, index), "uniqueName", name)
+                seen.add(name)
+        for index, phase in enumerate(phases):
+            if isinstance(phase, dict) and "board" in phase and phase["board"] not in board_set:
+                yield _reference_error(
+                    f"Phase {phase.get('name')!r} refers to undefined board {phase['board']!r}",
+                    ("phases", index, "board"), "boardReference", phase["board"]
+                )
+
+        valid_subtrees = {}
+        for key, container, path, validator in self._subtrees(config):
+            previous_container, previous = self._valid_subtrees.get(key, (None, {}))
+            if container is previous_container and not recheck_references and len(previous) == len(container):
+                valid_subtrees[key] = (container, previous)  # Unchanged, and every member was valid
+                continue
+            # Members as (name, key in the container, value); of an account dict, only the ones that are new objects
+            if isinstance(container, list):
+                valid = {}
+                members = [(board.get("board_name") if isinstance(board, dict) else None, index, board)
+                           for index, board in enumerate(container)]
+            elif recheck_references:
+                valid = {}
+                members = [(name, name, account) for name, account in container.items()]
+            else:
+                valid = {name: account for name, account in container.items() if previous.get(name) is account}
+                members = [(name, name, account) for name, account in container.items() if previous.get(name) is not account]
+
+            for name, index, value in members:
+                cached = previous.get(name)
+                # An equal copy (e.g. from a regenerated configuration) is compared rather than validated again
+                changed = cached is not value and (cached is None or cached != value)
+                if changed:
+                    errors = list(validator.iter_errors(value))
+                    for error in errors:
+                        error.path.extendleft(reversed(path + (index,)))
+                        yield error
+                    if errors:
+                        continue
+                if changed or recheck_references:
+                    reference_errors = list(self._check_references(path + (index,), value, phase_set, group_set))
+                    if reference_errors:
+                        # Keep checking this member's references until they are fixed
+                        yield from reference_errors
+                        continue
+                valid[name] = value
+            valid_subtrees[key] = (container, valid)
+
+        self._valid_subtrees = valid_subtrees
+        self._reference_sets = reference_sets
+
+    def _check_references(self, path, value, phase_set, group_set):
+        """Yields errors for phase and group names in a board or account that are not defined."""
+        if not isinstance(value, dict):
+            return
+        if path[0] == "boards":
+            # Compiling the board's visibility resolves every reference, and reports the rest
+            phase_index = {phase: row for row, phase in enumerate(phase_set)}
+            group_index = {group: column for column, group in enumerate(group_set)}
+            for resource in RESOURCES:
+                for phase, index, group in resource_grants(value.get(resource), phase_index, group_index)[1]:
+                    if index is None:
+                        yield _reference_error(
+                            f"{resource} refers to undefined phase {phase!r}",
+                            path + (resource, phase), "phaseReference", phase
+                        )
+                    else:
+                        yield _reference_error(
+                            f"{resource} refers to undefined group {group!r}",
+                            path + (resource, phase, index), "groupReference", group
+                        )
+        else:
+            for index, group in enumerate(value.get("groups") if isinstance(value.get("groups"), list) else []):
+                if group not in group_set:
+                    yield _reference_error(
+                        f"Account {path[-1]!r} refers to undefined group {group!r}",
+                        path + ("groups", index), "groupReference", group
+                    )
+            locations = value.get("locations")
+            for phase in locations if isinstance(locations, dict) else []:
+                if phase not in phase_set:
+                    yield _reference_error(
+                        f"Account {path[-1]!r} has a location for undefined phase {phase!r}",
+                        path + ("locations", phase), "phaseReference", phase
+                    )
+
+    def validate(self, config):
+        """Validates a configuration, raising its most relevant error.
+
+        Args:
+            config: The configuration to validate.
+
+        Raises:
+            jsonschema.exceptions.ValidationError: If the configuration is invalid.
+        """
+        import jsonschema
+
+        error = jsonschema.exceptions.best_match(self.iter_errors(config))
+        if error is not None:
+            raise error
@@ -1,92 +1,377 @@
 import os
 import json
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from config import *
-import vertexai
-from vertexai.generative_models import GenerativeModel
-import vertexai.preview.generative_models as generative_models
-import jsonschema
-import utils
+from response_cache import get_response_cache, make_key
+from model_backends import create_backend, rule_based_extraction
+from resilient_call import get_model_caller
+from json_patch import apply_patch, JsonPatchError
+from stream_json import IncrementalJSONParser
+from prompt_builder import PromptBuilder
+from config_validator import ConfigValidator
+from config_repair import repair_config, summarize_repairs
+from layout_engine import ClassroomLayout
+from intent_router import affected_sections
+from section_merge import merge_sections, section_names
+from tracing import span, usage_attributes
+
+PATCH_INSTRUCTIONS = (
+    "You will be given a JSON object containing the user input text and the current configuration.\n"
+    "1. Extract the relevant information from the user input text, given in response to the 'prev_system_response' text.\n"
+    "2. Return only the changes to 'current_config' as an RFC 6902 JSON Patch (a JSON array of operations), e.g.:\n"
+    '   - [{"op": "replace", "path": "/project_name", "value": "Awesome Project"}, {"op": "add", "path": "/groups/-", "value": "Developers"}]\n'
+    "   - Paths are JSON Pointers into 'current_config'; use '-' to append to an array and '~1' to escape '/' in names.\n"
+    "   - Do not compute x and y locations: give new accounts empty 'locations' ({}), they are placed locally; only set a location the user states exactly.\n"
+    "   - Resource changes requested for a phase should be made to the board associated with that phase).\n"
+    "   - If no changes were proposed, return an empty array: [].\n"
+    "3. Ensure the JSON is valid and does not contain any extra characters or formatting."
+)
+
+FULL_INSTRUCTIONS = (
+    "You will be given a JSON object containing the user input text and the current configuration.\n"
+    "1. Extract the relevant information from the user input text, given in response to the 'prev_system_response' text.\n"
+    "2. If changes were proposed, update the current configuration using the extracted values, otherwise, keep the current config 'as is'.\n"
+    "   - Do not compute x and y locations: give new accounts empty 'locations' ({}), they are placed locally; only set a location the user states exactly.\n"
+    "   - Resource changes requested for a phase should be made to the board associated with that phase).\n"
+    "3. Return the configuration as a JSON object, ensuring the JSON is valid, e.g.:\n"
+    "   - Close the opening curly brace by ensuring final curly brace is added.\n"
+    "   - Ensure it does not contain any extra characters or formatting."
+)
+
+SECTION_INSTRUCTIONS = (
+    "You will be given a JSON object containing the user input text, the name of one top-level section of the configuration ('section'), its current value ('current_value'), and the names defined in other sections ('references').\n"
+    "1. Extract the information relevant to this section from the user input text, given in response to the 'prev_system_response' text.\n"
+    "2. Return a JSON object with the section as its only key and its updated value, e.g. {\"groups\": [\"Managers\", \"Developers\"]}; if the section does not change, return its current value.\n"
+    "   - Only refer to phases, boards and groups listed in 'references' or named in the user input text.\n"
+    "   - Do not compute x and y locations: give new accounts empty 'locations' ({}), they are placed locally; only set a location the user states exactly.\n"
+    "3. Ensure the JSON is valid and does not contain any extra characters or formatting."
+)
+
+# The sections whose names each section refers to, and the output tokens of a call for each section
+SECTION_REFERENCES = {"project_name": (), "phases": ("boards",), "boards": ("phases", "groups"), "groups": (),
+                      "accounts": ("phases", "groups")}
+SECTION_OUTPUT_TOKENS = {"project_name": 256, "phases": 1024, "boards": 4096, "groups": 1024, "accounts": 4096}
+
+SYSTEM_INSTRUCTION = """You are an expert in extracting configuration details for an e-learning platform from text. You will be given a JSON configuration schema, text input from an educator containing data to extract, and the current JSON configuration to be modified."""
 
 class ExtractConfigClient:
-    def __init__(self):
-        """Initializes the ExtractConfigClient with the Gemini model."""
-        self.schema = load_activity_config_schema()
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-        self.model = GenerativeModel(os.getenv("GEMINI_MODEL"),
-            system_instruction="""You are an expert in extracting configuration details for an e-learning platform from text. You will be given a JSON configuration schema, text input from an educator containing data to extract, and the current JSON configuration to be modified."""
-        )
-
-    def extract_values(self, prev_system_response, user_input, current_config):
+    def __init__(self, delta_mode=True, backend=None, caller=None, sectioned=EXTRACTION_SECTIONED, repair=EXTRACTION_REPAIR):
+        """Initializes the ExtractConfigClient with the Gemini model.
+
+        Args:
+            delta_mode: Whether to request JSON Patch deltas instead of the full configuration.
+            sectioned: Whether to regenerate only the affected sections, concurrently, before
+                regenerating the full configuration.
+            repair: Whether to repair invalid configurations locally (e.g. clamping locations
+                or declaring groups), asking the model again only if there is no safe repair.
+            backend: The model backend to use; defaults to the one selected by MODEL_BACKEND.
+            caller: The ResilientCaller that makes the model calls; defaults to the shared one.
+        """
+        self.delta_mode = delta_mode
+        self.sectioned = sectioned
+        self.repair = repair
+        self.schema = activity_config_schema()
+        self.validator = ConfigValidator()
+        self.layout = ClassroomLayout()
+        self.patch_prompt = PromptBuilder(PATCH_INSTRUCTIONS)
+        self.full_prompt = PromptBuilder(FULL_INSTRUCTIONS)
+        self.section_prompts = {}  # Built on first use, each with the schema of its section only
+        self.last_prompt_report = None
+        self.cache = get_response_cache()
+        self.backend = backend or create_backend(SYSTEM_INSTRUCTION, local_responder=rule_based_extraction)
+        self.caller = caller or get_model_caller()
+
+    def warm_up(self):
+        """Prepares the model connection ahead of the first turn (e.g. on a background thread)."""
+        self.backend.warm_up()
+
+    def extract_values(self, prev_system_response, user_input, current_config, on_section=None):
         """Extracts configuration values from the given text based on the structure.
 
+        In delta mode the model returns a JSON Patch against the current configuration,
+        which is applied and validated locally; the configuration is only regenerated if the
+        patch cannot be used. In sectioned mode, only the sections the text affects are
+        regenerated, and the full configuration only if their merge is invalid. Invalid
+        configurations are first repaired locally where a safe repair exists (see
+        config_repair), so that a trivial mistake does not cost another model call. Account
+        locations are then assigned locally, following placement requests in the text such as
+        'Developers near the front'.
+
         Args:
             text: The text input describing the configuration.
             current_config: The current configuration structure.
+            on_section: Optional callable (key, value) called while the response is streamed,
+                as soon as a top-level section of the new configuration is known.
 
         Returns:
             The extracted configuration as a JSON object.
         """
 
+        import jsonschema
+
         print(f"Processing, please wait...")
 
-        payload = {
-            "config_schema": self.schema,
-            "prev_system_response": prev_system_response,
-            "user_input": user_input,
-            "current_config": current_config
-        }
+        extracted_config = None
+        if self.delta_mode:
+            try:
+                extracted_config = self.extract_patch(prev_system_response, user_input, current_config, on_section)
+            except (json.decoder.JSONDecodeError, JsonPatchError, jsonschema.exceptions.ValidationError) as e:
+                # A ValidationError's str() includes the whole schema and configuration
+                print(f"Could not apply configuration patch ({getattr(e, 'message', e)}), regenerating configuration...")
+
+        if extracted_config is None and self.sectioned:
+            try:
+                extracted_config = self.extract_sections(prev_system_response, user_input, current_config, on_section)
+            except (ValueError, jsonschema.exceptions.ValidationError) as e:
+                print(f"Could not merge configuration sections ({getattr(e, 'message', e)}), regenerating full configuration...")
+
+        if extracted_config is None:
+            try:
+                extracted_config = self.extract_full(prev_system_response, user_input, current_config, on_section)
+            except ValueError as e:
+                # The invalid response was dropped from the cache, so this calls the model again
+                print(f"{e}, trying once more...")
+                extracted_config = self.extract_full(prev_system_response, user_input, current_config, on_section)
+        with span("layout"):
+            return self.layout.apply(extracted_config, user_input)
+
+    def generate(self, prompt, max_output_tokens, parse, on_member=None, repair=True):
+        """Streams the model response (or replays it from the cache) through a tolerant JSON parser.
+
+        Args:
+            prompt: The prompt text.
+            max_output_tokens: The maximum number of tokens to generate.
+            parse: Callable applied to the parsed JSON document; if it raises, the response is
+                removed from the cache so that the next attempt calls the model again.
+            on_member: Optional callable (key, value) called as soon as a top-level member of
+                the response is complete.
+            repair: Whether to repair a truncated response or one with trailing commas.
+
+        Returns:
+            The result of parse.
 
-        json_payload = json.dumps(payload, indent=2)
-        prompt = (
-            "The following is a JSON object containing the schema, the user input text, and the current configuration:\n\n"
-            f"{json_payload}\n\n"
-            "1. Extract the relevant information from the user input text, given in response to the 'prev_system_response' text.\n"
-            f"2. If changes were proposed, update the current configuration using the extracted values, otherwise, keep the current config 'as is'.\n"
-            "   - Slightly spread out accounts in the same phase, but ensure x and y locations remain within clamped ranges.\n"
-            "   - Resource changes requested for a phase should be made to the board associated with that phase).\n"
-            "3. Return the configuration as a JSON object, ensuring the JSON is valid, e.g.:\n"
-            "   - Close the opening curly brace by ensuring final curly brace is added.\n"
-            "   - Ensure it does not contain any extra characters or formatting.\n"
-        )
-
-        # Call the model and process response
+        Raises:
+            json.decoder.JSONDecodeError: If the response cannot be parsed (even after repair).
+        """
         generation_config = {
-            "max_output_tokens": 4096,
+            "max_output_tokens": max_output_tokens,
             "temperature": 0.2,
             "top_p": 0.95,
             "top_k": 40
         }
 
-        safety_settings = {
-            generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-        }
-        
-        # Call the model to predict and get results in string format
-        response = self.model.generate_content(prompt, generation_config=generation_config, safety_settings=safety_settings).text
-        clean_response = utils.remove_json_markdown(response)
+        parser = IncrementalJSONParser(on_member)
+        key = make_key(self.backend.model_name, self.backend.system_instruction, generation_config, prompt)
+        with span("model_call", model=self.backend.model_name, max_output_tokens=max_output_tokens) as call:
+            response = self.cache.get(key)
+            call.set(cached=response is not None)
+            if response is None:
+                # Call the model and parse the response as it streams in
+                chunks = []
+                stream = self.caller.stream(f"extraction:{max_output_tokens}", self.backend.generate_content_stream,
+                                            prompt, span=call, generation_config=generation_config)
+                for chunk in stream:
+                    call.mark("ttft")
+                    chunks.append(chunk)
+                    parser.feed(chunk)
+                response = "".join(chunks)
+                self.cache.put(key, response)
+                call.set(**usage_attributes(self.backend.last_usage))
+            else:
+                parser.feed(response)
+            call.set(response_bytes=len(response.encode("utf-8")))
+
+        try:
+            with span("parse"):
+                document = parser.finish(repair)
+            return parse(document)
+        except Exception:
+            self.cache.discard(key)
+            raise
+
+    def extract_patch(self, prev_system_response, user_input, current_config, on_section=None):
+        """Extracts the changes requested in the text as an RFC 6902 JSON Patch.
+
+        Args:
+            prev_system_response: The last message shown to the user.
+            user_input: The text input describing the configuration changes.
+            current_config: The current configuration structure.
+            on_section: Optional callable (key, value) called with each top-level section
+                changed by an operation as soon as the operation has streamed in.
+
+        Returns:
+            The current configuration with the patch applied.
+
+        Raises:
+            json.decoder.JSONDecodeError: If the model output is not valid JSON; a patch cut off
+                (e.g. at the output token limit) is not repaired, as it could be incomplete.
+            JsonPatchError: If the patch is malformed or cannot be applied.
+            jsonschema.exceptions.ValidationError: If the patched configuration is invalid and
+                cannot be repaired.
+        """
+        with span("prompt_build", mode="patch") as build:
+            prompt = self.patch_prompt.build({
+                "prev_system_response": prev_system_response,
+                "user_input": user_input,
+                "current_config": current_config
+            })
+            self.last_prompt_report = prompt.report()
+            build.set(prompt_bytes=self.last_prompt_report["total_bytes"], prompt_tokens=self.last_prompt_report["total_tokens"])
+
+        partial_config = current_config
+
+        def apply_operation(index, operation):
+            # Apply each operation as it arrives to report the sections it changes early
+            nonlocal partial_config
+            try:
+                partial_config = apply_patch(partial_config, [operation])
+            except JsonPatchError:
+                return
+            key = operation["path"].split("/")[1] if operation["path"].count("/") else None
+            if key in partial_config:
+                on_section(key, partial_config[key])
+
+        def apply_response(patch):
+            return self.validated(apply_patch(current_config, patch))
+
+        return self.generate(prompt.text, max_output_tokens=1024, parse=apply_response,
+                             on_member=apply_operation if on_section else None, repair=False)
+
+    def extract_full(self, prev_system_response, user_input, current_config, on_section=None):
+        """Regenerates the full configuration from the text.
+
+        Args:
+            prev_system_response: The last message shown to the user.
+            user_input: The text input describing the configuration.
+            current_config: The current configuration structure.
+            on_section: Optional callable (key, value) called as soon as a top-level section of
+                the configuration has streamed in.
+
+        Returns:
+            The extracted configuration as a JSON object.
+        """
+        with span("prompt_build", mode="full") as build:
+            prompt = self.full_prompt.build({
+                "prev_system_response": prev_system_response,
+                "user_input": user_input,
+                "current_config": current_config
+            })
+            self.last_prompt_report = prompt.report()
+            build.set(prompt_bytes=self.last_prompt_report["total_bytes"], prompt_tokens=self.last_prompt_report["total_tokens"])
+
+        def report_section(key, value):
+            if isinstance(key, str):
+                on_section(key, value)
 
         try:
-            extracted_config = json.loads(clean_response)
-            jsonschema.validate(instance=extracted_config, schema=self.schema)
+            return self.generate(prompt.text, max_output_tokens=4096, parse=self.parse_config,
+                                 on_member=report_section if on_section else None)
         except json.decoder.JSONDecodeError as e:
-            if "Expecting ',' delimiter" in str(e):
-                # Attempt to fix missing comma error by adding closing curly brace
-                clean_response += "}"
-                print(f"Attempting to fix missing closing curly brace:\n{clean_response}")
-
-                try:
-                    extracted_config = json.loads(clean_response)
-                    jsonschema.validate(instance=extracted_config, schema=self.schema)
-                except json.decoder.JSONDecodeError as e2:
-                    print(f"Error parsing LLM output as JSON after fix attempt: {e2}")
-                    return {}  # Or some other default value
-                except jsonschema.exceptions.ValidationError as e2:
-                    # If still invalid after the fix attempt, raise the original error
-                    raise ValueError(f"Invalid configuration generated by LLM: {e}")
-            else:
-                raise ValueError(f"Invalid configuration generated by LLM: {e}")
+            print(f"Error parsing LLM output as JSON: {e}")
+            raise ValueError(f"Invalid configuration generated by LLM: {e}")
+
+    def extract_sections(self, prev_system_response, user_input, current_config, on_section=None, sections=None):
+        """Regenerates the sections of the configuration the text affects, with one concurrent call each.
+
+        Each call is given only its section, with the schema of that section and the names
+        it may refer to, so the time taken is that of the slowest section rather than of the
+        whole configuration. The sections are merged in a fixed order, and the merge is validated
+        to catch conflicting references between them.
 
-        return extracted_config
+        Args:
+            prev_system_response: The last message shown to the user.
+            user_input: The text input describing the configuration changes.
+            current_config: The current configuration structure.
+            on_section: Optional callable (key, value) called as soon as a section has streamed in.
+            sections: The top-level sections to regenerate; defaults to those the text affects.
+
+        Returns:
+            The current configuration with the regenerated sections merged in.
+
+        Raises:
+            ValueError: If a section response is not valid JSON or does not contain the section.
+            jsonschema.exceptions.ValidationError: If the merged configuration is invalid, e.g.
+                because a section refers to a phase or group that no section defines.
+        """
+        sections = sections or affected_sections(user_input, current_config)
+        with span("sections", sections=",".join(sections)):
+            with ThreadPoolExecutor(max_workers=len(sections), thread_name_prefix="section") as pool:
+                futures = {
+                    section: pool.submit(contextvars.copy_context().run, self.extract_section, section,
+                                         prev_system_response, user_input, current_config, on_section)
+                    for section in sections
+                }
+                extracted = {section: future.result() for section, future in futures.items()}
+
+        return self.validated(merge_sections(current_config, extracted))
+
+    def extract_section(self, section, prev_system_response, user_input, current_config, on_section=None):
+        """Regenerates one top-level section of the configuration from the text.
+
+        Returns:
+            The new value of the section.
+        """
+        prompt_builder = self.section_prompts.get(section)
+        if prompt_builder is None:
+            prompt_builder = self.section_prompts[section] = PromptBuilder(SECTION_INSTRUCTIONS, section=section)
+        with span("prompt_build", mode=f"section:{section}") as build:
+            prompt = prompt_builder.build({
+                "prev_system_response": prev_system_response,
+                "user_input": user_input,
+                "section": section,
+                "current_value": current_config.get(section),
+                "references": {name: section_names(current_config, name) for name in SECTION_REFERENCES[section]}
+            })
+            report = prompt.report()
+            build.set(prompt_bytes=report["total_bytes"], prompt_tokens=report["total_tokens"])
+
+        def parse_section(document):
+            if not isinstance(document, dict) or section not in document:
+                raise ValueError(f"The response for the {section!r} section does not contain it")
+            return document[section]
+
+        def report_section(key, value):
+            if key == section:
+                on_section(key, value)
+
+        return self.generate(prompt.text, max_output_tokens=SECTION_OUTPUT_TOKENS[section], parse=parse_section,
+                             on_member=report_section if on_section else None)
+
+    def parse_config(self, extracted_config):
+        """Validates a full configuration generated by the model.
+
+        Args:
+            extracted_config: The parsed model response.
+
+        Returns:
+            The extracted configuration as a JSON object, repaired if needed.
+        """
+        import jsonschema
+
+        try:
+            return self.validated(extracted_config)
+        except jsonschema.exceptions.ValidationError as e:
+            raise ValueError(f"Invalid configuration generated by LLM: {e.message}")
+
+    def validated(self, config):
+        """Validates a configuration, repairing it locally if it is invalid and a safe repair exists.
+
+        Args:
+            config: The configuration to validate; it is not modified.
+
+        Returns:
+            The configuration, or its repaired copy.
+
+        Raises:
+            jsonschema.exceptions.ValidationError: If the configuration is invalid and cannot be repaired.
+        """
+        with span("validate") as validate:
+            if not self.repair:
+                self.validator.validate(config)
+                return config
+            config, repairs = repair_config(config, self.validator)
+            validate.set(repairs=len(repairs))
+        if repairs:
+            print(summarize_repairs(repairs))
+        return config
@@ -0,0 +1,239 @@
+import functools
+import math
+import re
+from collections import defaultdict, namedtuple
+from config import activity_config_schema
+from layout_engine import INTENT_PATTERN
+
+QUESTION_PATTERN = re.compile(
+    r"\?|^\s*(what|how|why|when|where|which|who|can|could|should|would|is|are|does|will)\b", re.IGNORECASE
+)
+# Questions that ask for a change rather than about the configuration
+REQUEST_PATTERN = re.compile(
+    r"^\s*(?:please\s+)?(?:can|could|would|will|should|shall)\s+(?:you|we)\b|^\s*(?:what|how)\s+about\b|"
+    r"^\s*what\s+if\b|^\s*why\s+(?:not|don'?t\s+(?:we|you))\b|^\s*(?:is|would)\s+it\s+(?:be\s+)?possible\s+to\b",
+    re.IGNORECASE
+)
+# Edit verbs in any form, e.g. 'adding', 'moved', 'sets' (stems ending in e, or doubling their consonant, are spelled out)
+EDIT_PATTERN = re.compile(
+    r"\b(?:(?:add|assign|call|allow|seat|swap|drop|set|put|let)(?:s|ed|ing)?|(?:dropp|swapp|sett|putt|lett)(?:ed|ing)|"
+    r"(?:remov|delet|renam|chang|mov|plac|mak|creat|nam|replac|includ|giv|hid|updat|us)(?:e|es|ed|ing)|"
+    r"made|gave|given|hid|hidden)\b", re.IGNORECASE
+)
+ACKNOWLEDGEMENT_PATTERN = re.compile(
+    r"^(?:\s*(?:ok(?:ay)?|thanks?(?:\s+you)?|thank\s+you|great|perfect|good|nice|cool|awesome|yes|yep|sure|alright|"
+    r"all\s+right|got\s+it|sounds\s+(?:good|great|right)|(?:that\s+)?looks?\s+(?:good|great|right|fine)|"
+    r"that'?s\s+(?:good|great|right|fine|it))[\s,.!]*)+$", re.IGNORECASE
+)
+# Statements that offer a change, e.g. 'I suggest adding a Share phase.'
+PROPOSAL_PATTERN = re.compile(
+    r"\b(?:i|we)\s+(?:suggest|recommend|propose|could|can)\b|\byou\s+(?:could|might|may)\b|"
+    r"^\s*(?:consider|how\s+about|what\s+about)\b", re.IGNORECASE
+)
+NAVIGATION_PATTERN = re.compile(
+    r"^\s*(?:please\s+)?(?:show|display|view|open|go\s+to|switch\s+to)\s+(?:me\s+)?(?:the\s+)?(.+?)(?:\s+phase)?[\s.!]*$",
+    re.IGNORECASE
+)
+STEP_PATTERN = re.compile(r"^\s*(next|previous)(?:\s+phase)?[\s.!]*$", re.IGNORECASE)
+SENTENCE_PATTERN = re.compile(r"[^.!?]+[.!?]*")
+
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how in is it its of on or that the their them this to what when "
+    "where which who why will with you your we our i me my should would could each may one only such".split()
+)
+NAME_WEIGHT = 3.0  # Weight of a word of a property's name relative to a word of its description
+MIN_TOPIC_SHARE = 0.5  # Topics scoring less than this share of the best topic are dropped
+# Top-level sections of a configuration, in the order they are merged
+SECTIONS = ("project_name", "phases", "boards", "groups", "accounts")
+
+
+class Intent(namedtuple("Intent", ["kind", "phase"])):
+    """The intent of a teacher's response.
+
+    kind is 'edit' (the configuration must be extracted), 'question', 'acknowledge' or
+    'navigate' (show the phase named by phase).
+    """
+
+
+def is_question(text):
+    """Returns whether the user input asks something, and so needs an answer from the model."""
+    return bool(QUESTION_PATTERN.search(text or ""))
+
+
+def invites_answer(text):
+    """Returns whether a system response asks the teacher something or proposes a change, so that 'yes' answers it."""
+    return any(is_question(sentence) or PROPOSAL_PATTERN.search(sentence) for sentence in SENTENCE_PATTERN.findall(text or ""))
+
+
+def _tokens(text):
+    """Returns the words of a text without stopwords, with plurals reduced to the singular."""
+    words = TOKEN_PATTERN.findall(text.lower().replace("_", " "))
+    return [word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+            for word in words if word not in STOPWORDS]
+
+
+def _described_properties(schema, path=""):
+    """Yields (path, name, description) for the properties of a schema that have a description."""
+    for name, child in (schema.get("properties") or {}).items():
+        child_path = f"{path}.{name}".lstrip(".")
+        nested = child.get("items") or child.get("additionalProperties")
+        description = child.get("description") or (nested.get("description") if isinstance(nested, dict) else None)
+        if description:
+            yield child_path, name, description
+        for node in (child, nested):
+            if isinstance(node, dict):
+                yield from _described_properties(node, child_path)
+
+
+class SchemaIndex:
+    def __init__(self, schema):
+        """Initializes the SchemaIndex, a keyword index over the property descriptions of a schema.
+
+        Words of a property's name weigh more than words of its description, and every word is
+        weighted by how few properties it describes, so 'bucket view' finds bucket_view first.
+
+        Args:
+            schema: The JSON schema to index.
+        """
+        self.descriptions = {}
+        weights = defaultdict(dict)  # word -> {path: weight}
+        section_words = defaultdict(set)  # top-level property -> words of the names of its properties
+        for path, name, description in _described_properties(schema):
+            self.descriptions.setdefault(path, description)
+            for word in _tokens(description):
+                weights[word][path] = max(weights[word].get(path, 0.0), 1.0)
+            for word in _tokens(name):
+                weights[word][path] = NAME_WEIGHT
+                section_words[path.split(".")[0]].add(word)
+        # Words naming properties of more than one section (e.g. 'name') do not point to a section
+        shared = {word for section, words in section_words.items() for word in words
+                  if any(word in others for other, others in section_words.items() if other != section)}
+        self.section_words = {section: words - shared for section, words in section_words.items()}
+        count = len(self.descriptions)
+        self.postings = {
+            word: {path: weight * math.log(1 + count / len(paths)) for path, weight in paths.items()}
+            for word, paths in weights.items()
+        }
+
+    def search(self, text, limit=2):
+        """Returns the paths of the properties a text is most likely about, best first."""
+        scores = defaultdict(float)
+        for word in set(_tokens(text)):
+            for path, weight in self.postings.get(word, {}).items():
+                scores[path] += weight
+        if not scores:
+            return []
+        best = max(scores.values())
+        ranked = sorted(scores, key=lambda path: (-scores[path], path))
+        return [path for path in ranked[:limit] if scores[path] >= MIN_TOPIC_SHARE * best]
+
+    def describe(self, text, limit=2):
+        """Returns {path: description} for the properties a text is most likely about."""
+        return {path: self.descriptions[path] for path in self.search(text, limit)}
+
+    def sections(self, text):
+        """Returns the top-level properties whose (nested) property names a text mentions."""
+        words = set(_tokens(text))
+        return [section for section, section_words in self.section_words.items() if words & section_words]
+
+
+@functools.lru_cache(maxsize=None)
+def schema_index():
+    """Returns the keyword index of the activity configuration schema, built once per process."""
+    return SchemaIndex(activity_config_schema())
+
+
+def affected_sections(text, config=None, index=None):
+    """Returns the top-level sections of a configuration that a teacher's edit may change.
+
+    A section is affected if the text names it or one of its properties (e.g. 'bucket view'
+    for boards), or, for accounts, if it names an account or asks for a placement such as
+    'near the front'. If no section is recognized, all sections are returned.
+
+    Args:
+        text: The teacher's response.
+        config: The current configuration, whose account names the text may mention.
+        index: The SchemaIndex to look up property names in; defaults to the shared one.
+
+    Returns:
+        A tuple of section names in the order of SECTIONS.
+    """
+    affected = set((index or schema_index()).sections(text))
+    if "accounts" not in affected:
+        accounts = (config or {}).get("accounts") or {}
+        lowered = text.lower()
+        names = (name for members in accounts.values() if isinstance(members, dict) for name in members)
+        if INTENT_PATTERN.search(text) or any(name.lower() in lowered for name in names):
+            affected.add("accounts")
+    return tuple(section for section in SECTIONS if section in affected) or SECTIONS
+
+
+class IntentRouter:
+    def __init__(self, index=None):
+        """Initializes the IntentRouter, which classifies a teacher's response without a model call.
+
+        Only responses that are clearly a question, an acknowledgement or a request to see a
+        phase are routed away from extraction; anything else is treated as an edit.
+
+        Args:
+            index: The SchemaIndex that finds what a question is about; defaults to the shared one.
+        """
+        self.index = index or schema_index()
+
+    def classify(self, text, config=None, prev_system_response=None):
+        """Classifies a teacher's response.
+
+        An acknowledgement such as 'Sure.' is an edit if the previous system response asked a
+        question or proposed a change ('Shall I add a Share phase?'), since it answers it.
+
+        Args:
+            text: The teacher's response.
+            config: The current configuration, whose phase names navigation may refer to.
+            prev_system_response: The last message spoken to the teacher, if any.
+
+        Returns:
+            An Intent.
+        """
+        text = text or ""
+        phase = self.phase_named(text, config)
+        if phase is not None:
+            return Intent("navigate", phase)
+        # Only a response made of acknowledgements and questions skips extraction
+        kind = "acknowledge"
+        answered = invites_answer(prev_system_response)
+        for sentence in SENTENCE_PATTERN.findall(text):
+            if ACKNOWLEDGEMENT_PATTERN.match(sentence):
+                if answered:
+                    return Intent("edit", None)
+                continue
+            if not is_question(sentence) or (REQUEST_PATTERN.search(sentence) and EDIT_PATTERN.search(sentence)):
+                # A statement, or a request such as 'Can you add a phase?' (not 'Can you explain the canvas?')
+                return Intent("edit", None)
+            kind = "question"
+        return Intent(kind, None)
+
+    def phase_named(self, text, config):
+        """Returns the phase a navigation command such as 'show me the Testing phase' asks for, or None.
+
+        'next' and 'previous' are resolved by the renderer and returned as given.
+        """
+        step = STEP_PATTERN.match(text)
+        if step is not None and "phase" in text.lower():
+            return step.group(1).lower()
+        match = NAVIGATION_PATTERN.match(text)
+        if match is None:
+            return None
+        target = match.group(1).strip().lower()
+        step = STEP_PATTERN.match(target)
+        if step is not None:
+            return step.group(1).lower()
+        for phase in (config or {}).get("phases") or []:
+            name = phase.get("name") if isinstance(phase, dict) else phase
+            if isinstance(name, str) and name.strip().lower() == target:
+                return name
+        return None
+
+    def topics(self, text):
+        """Returns {path: description} of the schema properties a question is about."""
+        return self.index.describe(text)
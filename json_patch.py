@@ -0,0 +1,181 @@
+import copy
+
+
+class JsonPatchError(ValueError):
+    """Raised when a JSON Patch is malformed or cannot be applied to a document."""
+
+
+def _parse_pointer(pointer):
+    """Splits an RFC 6901 JSON Pointer into unescaped reference tokens."""
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith("/")):
+        raise JsonPatchError(f"Invalid JSON pointer: {pointer!r}")
+    if pointer == "":
+        return []
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _array_index(container, token, allow_end=False):
+    """Converts a reference token to a list index, validating its range."""
+    if allow_end and token == "-":
+        return len(container)
+    if not token.isdigit() or (token != "0" and token.startswith("0")):
+        raise JsonPatchError(f"Invalid array index: {token!r}")
+    index = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if index > limit:
+        raise JsonPatchError(f"Array index out of range: {index}")
+    return index
+
+
+def _resolve_parent(document, tokens):
+    """Returns the container holding the target of a pointer."""
+    target = document
+    for token in tokens[:-1]:
+        if isinstance(target, dict):
+            if token not in target:
+                raise JsonPatchError(f"Path segment not found: {token!r}")
+            target = target[token]
+        elif isinstance(target, list):
+            target = target[_array_index(target, token)]
+        else:
+            raise JsonPatchError(f"Cannot traverse into a scalar at {token!r}")
+    return target
+
+
+def _get(document, pointer):
+    tokens = _parse_pointer(pointer)
+    if not tokens:
+        return document
+    parent = _resolve_parent(document, tokens)
+    token = tokens[-1]
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise JsonPatchError(f"Path not found: {pointer}")
+        return parent[token]
+    if isinstance(parent, list):
+        return parent[_array_index(parent, token)]
+    raise JsonPatchError(f"Path not found: {pointer}")
+
+
+def _add(document, pointer, value):
+    tokens = _parse_pointer(pointer)
+    if not tokens:
+        return value
+    parent = _resolve_parent(document, tokens)
+    token = tokens[-1]
+    if isinstance(parent, dict):
+        parent[token] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, token, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Cannot add to a scalar at {pointer}")
+    return document
+
+
+def _remove(document, pointer):
+    tokens = _parse_pointer(pointer)
+    if not tokens:
+        raise JsonPatchError("Cannot remove the whole document")
+    parent = _resolve_parent(document, tokens)
+    token = tokens[-1]
+    if isinstance(parent, dict):
+        if token not in parent:
+            raise JsonPatchError(f"Path not found: {pointer}")
+        return parent.pop(token)
+    if isinstance(parent, list):
+        return parent.pop(_array_index(parent, token))
+    raise JsonPatchError(f"Path not found: {pointer}")
+
+
+def _copy_path(document, pointer, copied):
+    """Replaces the containers on the path to a pointer's parent with shallow copies.
+
+    Containers are copied once per patch (copied holds the ids of the copies), so the
+    patched document shares every part the patch does not touch with the original.
+
+    Returns:
+        The root of the document, copied.
+    """
+    def fresh(container):
+        if id(container) in copied:
+            return container
+        clone = container.copy()
+        copied.add(id(clone))
+        return clone
+
+    tokens = _parse_pointer(pointer)
+    if not tokens or not isinstance(document, (dict, list)):
+        return document
+    root = target = fresh(document)
+    for token in tokens[:-1]:
+        if isinstance(target, dict) and token in target:
+            key = token
+        elif isinstance(target, list) and token.isdigit() and int(token) < len(target):
+            key = int(token)
+        else:
+            break  # Reported by the operation itself
+        if not isinstance(target[key], (dict, list)):
+            break
+        target[key] = target = fresh(target[key])
+    return root
+
+
+def apply_patch(document, patch):
+    """Applies an RFC 6902 JSON Patch to a document.
+
+    The document is not modified: the containers an operation changes are copied first
+    (copy-on-write), so a failing operation leaves the caller's configuration untouched and
+    the result shares its unchanged parts, such as other boards and accounts, with it.
+
+    Args:
+        document: The JSON document (e.g., the current configuration).
+        patch: A list of patch operations.
+
+    Returns:
+        The patched document.
+
+    Raises:
+        JsonPatchError: If the patch is malformed or an operation fails.
+    """
+    if not isinstance(patch, list):
+        raise JsonPatchError("A JSON Patch must be an array of operations")
+
+    result = document
+    copied = set()
+    for operation in patch:
+        if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+            raise JsonPatchError(f"Invalid patch operation: {operation!r}")
+
+        op, path = operation["op"], operation["path"]
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise JsonPatchError(f"Missing 'value' in {op} operation")
+        if op in ("move", "copy") and "from" not in operation:
+            raise JsonPatchError(f"Missing 'from' in {op} operation")
+
+        if op in ("add", "remove", "replace", "move", "copy"):
+            result = _copy_path(result, path, copied)
+        if op == "move":
+            result = _copy_path(result, operation["from"], copied)
+
+        if op == "add":
+            result = _add(result, path, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            _remove(result, path)
+        elif op == "replace":
+            if _parse_pointer(path):
+                _remove(result, path)
+            result = _add(result, path, copy.deepcopy(operation["value"]))
+        elif op == "move":
+            if path.startswith(operation["from"] + "/"):
+                raise JsonPatchError(f"Cannot move {operation['from']} into one of its children")
+            value = _remove(result, operation["from"])
+            result = _add(result, path, value)
+        elif op == "copy":
+            result = _add(result, path, copy.deepcopy(_get(result, operation["from"])))
+        elif op == "test":
+            if _get(result, path) != operation["value"]:
+                raise JsonPatchError(f"Test operation failed at {path}")
+        else:
+            raise JsonPatchError(f"Unknown patch operation: {op!r}")
+
+    return result
@@ -0,0 +1,319 @@
+import re
+
+# Classroom coordinate bounds from the activity config schema; y=0 is the front
+ROOM_WIDTH = 200
+ROOM_HEIGHT = 100
+ICON_WIDTH = 2  # Terminal columns taken by an account icon
+LABEL_GAP = 1  # Free columns kept between neighbouring labels
+MAX_LABEL_WIDTH = 24  # Longer names are not given more room
+# Screen cells (columns, rows) an icon can take in the classroom of a 120x40 terminal; see classroom_cells
+DEFAULT_CELLS = (114, 30)
+ACCOUNT_TYPES = ("teachers", "students", "devices")
+
+# Zones as fractions (left, top, right, bottom) of the room
+ZONES = {
+    "front": (0.0, 0.0, 1.0, 1 / 3),
+    "back": (0.0, 2 / 3, 1.0, 1.0),
+    "rear": (0.0, 2 / 3, 1.0, 1.0),
+    "left": (0.0, 0.0, 1 / 3, 1.0),
+    "right": (2 / 3, 0.0, 1.0, 1.0),
+    "middle": (0.25, 1 / 3, 0.75, 2 / 3),
+    "center": (0.25, 1 / 3, 0.75, 2 / 3),
+    "centre": (0.25, 1 / 3, 0.75, 2 / 3),
+}
+# Where accounts go when no placement was requested for them
+DEFAULT_ZONES = {"teachers": (0.0, 0.0, 1.0, 0.15), "devices": (0.0, 0.85, 1.0, 1.0)}
+STUDENT_AREA = (0.0, 0.15, 1.0, 0.85)
+
+INTENT_PATTERN = re.compile(
+    r"\b(?:near|at|in|on|to|towards?|by)\s+the\s+((?:front|back|rear|left|right|middle|center|centre)(?:[\s-]+(?:left|right))?)\b",
+    re.IGNORECASE)
+SENTENCE_PATTERN = re.compile(r"[^.!?\n]+")
+
+
+class OccupancyGrid:
+    def __init__(self, width, height):
+        """Initializes the OccupancyGrid, one bytearray per row with 1 for occupied cells.
+
+        Args:
+            width: The number of columns.
+            height: The number of rows.
+        """
+        self.width = width
+        self.height = height
+        self.rows = [bytearray(width) for _ in range(height)]
+
+    def blocked(self, x, y, width, height=1):
+        """Returns the last occupied column in the rectangle, or -1 if it is free (or off the grid)."""
+        if x < 0 or y < 0 or x + width > self.width or y + height > self.height:
+            return x + width - 1
+        last = -1
+        for row in self.rows[y:y + height]:
+            index = row.rfind(1, x, x + width)
+            if index > last:
+                last = index
+        return last
+
+    def is_free(self, x, y, width, height=1):
+        return self.blocked(x, y, width, height) == -1
+
+    def occupy(self, x, y, width, height=1):
+        x0, x1 = max(0, x), min(self.width, x + width)
+        for row in self.rows[max(0, y):max(0, y + height)]:
+            if x1 > x0:
+                row[x0:x1] = b"\x01" * (x1 - x0)
+
+    def find_free(self, bounds, width, height, cursor=None):
+        """Finds the first free rectangle in bounds in row-major order.
+
+        Args:
+            bounds: (left, top, right, bottom) inclusive cell bounds to search.
+            width: The width of the rectangle.
+            height: The height of the rectangle.
+            cursor: Optional (x, y) to resume a previous search from.
+
+        Returns:
+            The (x, y) of the rectangle's top-left cell, or None if there is no room.
+        """
+        left, top, right, bottom = bounds
+        x, y = cursor if cursor else (left, top)
+        while y + height - 1 <= bottom:
+            while x + width - 1 <= right:
+                last = self.blocked(x, y, width, height)
+                if last == -1:
+                    return x, y
+                x = last + 1  # Skip past the occupied cell
+            x, y = left, y + 1
+        return None
+
+
+def to_cell(location, cells):
+    """Returns the (column, row) of the screen cell a location in room units is drawn at.
+
+    Args:
+        location: {"x", "y"} in room units.
+        cells: The (columns, rows) of screen cells an icon can take.
+    """
+    columns, rows = cells
+    return round(location["x"] * (columns - 1) / ROOM_WIDTH), round(location["y"] * (rows - 1) / ROOM_HEIGHT)
+
+
+def to_location(column, row, cells):
+    """Returns the location in room units drawn at a screen cell; to_cell of it gives the cell back."""
+    columns, rows = cells
+    return {"x": round(column * ROOM_WIDTH / max(1, columns - 1)), "y": round(row * ROOM_HEIGHT / max(1, rows - 1))}
+
+
+def zone_bounds(zone, width=ROOM_WIDTH, height=ROOM_HEIGHT):
+    """Converts a zone in room fractions to inclusive cell bounds."""
+    left, top, right, bottom = zone
+    return (round(left * width), round(top * height), max(round(left * width), round(right * width) - 1),
+            max(round(top * height), round(bottom * height) - 1))
+
+
+def parse_intents(text, targets, phases=()):
+    """Finds placement requests such as 'group Developers near the front' in text.
+
+    Args:
+        text: The user input.
+        targets: Group names and account types that can be placed.
+        phases: Phase names; a request mentioning a phase only applies to that phase.
+
+    Returns:
+        A list of (target, phase or None, zone) tuples, where zone is in room fractions.
+    """
+    intents = []
+    for sentence in SENTENCE_PATTERN.findall(text or ""):
+        match = INTENT_PATTERN.search(sentence)
+        if not match:
+            continue
+        zone = (0.0, 0.0, 1.0, 1.0)
+        for word in re.split(r"[\s-]+", match.group(1).lower()):
+            left, top, right, bottom = ZONES[word]
+            zone = (max(zone[0], left), max(zone[1], top), min(zone[2], right), min(zone[3], bottom))
+
+        lowered = sentence.lower()
+        mentioned = [phase for phase in phases if re.search(rf"\b{re.escape(phase.lower())}\b", lowered)]
+        for target in targets:
+            if re.search(rf"\b{re.escape(target.lower())}\b", lowered):
+                for phase in mentioned or [None]:
+                    intents.append((target, phase, zone))
+    return intents
+
+
+def _footprint(name, max_label_width=MAX_LABEL_WIDTH):
+    """Returns (offset of the icon within the footprint, footprint width) for an account label."""
+    label = min(len(name), max_label_width)
+    offset = label // 2 if label > ICON_WIDTH else 0
+    return offset, max(label, ICON_WIDTH) + LABEL_GAP
+
+
+class ClassroomLayout:
+    def __init__(self, cells=DEFAULT_CELLS):
+        """Initializes the ClassroomLayout, which places accounts in the classroom locally.
+
+        Accounts are placed on the screen cells the classroom is drawn on, and their locations
+        converted to room units (see to_location). Each account takes a footprint of its icon
+        and its name label above it, so accounts placed by the layout never overlap on that
+        screen, labels included, as long as the room has space for them. Placement requests
+        found in the user input are remembered for later turns.
+
+        Args:
+            cells: The (columns, rows) of screen cells an icon can take in the classroom, e.g.
+                classroom_cells of the terminal. A screen finer than the room units is laid
+                out on one cell per unit.
+        """
+        self.cells = (max(2, min(cells[0], ROOM_WIDTH + 1)), max(2, min(cells[1], ROOM_HEIGHT + 1)))
+        self.intents = {}  # (target, phase or None) -> zone
+
+    def zone_for(self, account_type, group, phase, default):
+        for target in (account_type, group):
+            for key in ((target, phase), (target, None)):
+                if key in self.intents:
+                    return self.intents[key]
+        return default
+
+    def default_zones(self, groups):
+        """Splits the student area into one zone per group, in a near-square grid."""
+        if not groups:
+            return {}
+        columns = 1
+        while columns * columns < len(groups):
+            columns += 1
+        rows = -(-len(groups) // columns)
+        left, top, right, bottom = STUDENT_AREA
+        cell_width, cell_height = (right - left) / columns, (bottom - top) / rows
+        return {
+            group: (left + (i % columns) * cell_width, top + (i // columns) * cell_height,
+                    left + (i % columns + 1) * cell_width, top + (i // columns + 1) * cell_height)
+            for i, group in enumerate(groups)
+        }
+
+    def apply(self, config, user_input=""):
+        """Assigns every account a location in every phase, keeping valid existing locations.
+
+        Existing locations are kept unless they collide with an account placed before them or
+        lie outside a zone requested for the account; all other accounts are clustered by group.
+
+        Args:
+            config: The configuration to lay out; it is not modified.
+            user_input: The user input, searched for placement requests.
+
+        Returns:
+            The configuration with new account locations.
+        """
+        phases = [phase.get("name") for phase in config.get("phases", []) if isinstance(phase, dict)]
+        phases = [phase for phase in phases if isinstance(phase, str)]
+        groups = [group for group in config.get("groups", []) if isinstance(group, str)]
+        for target, phase, zone in parse_intents(user_input, groups + list(ACCOUNT_TYPES), phases):
+            self.intents[(target, phase)] = zone
+
+        accounts = {
+            account_type: {name: {**details, "locations": dict(details.get("locations") or {})}
+                           for name, details in (config.get("accounts", {}).get(account_type) or {}).items()
+                           if isinstance(details, dict)}
+            for account_type in ACCOUNT_TYPES
+        }
+        if not any(accounts.values()):
+            return config
+
+        group_zones = self.default_zones(groups)
+        for phase in phases:
+            self.place_phase(phase, phases, accounts, group_zones)
+
+        return {**config, "accounts": {**config.get("accounts", {}), **accounts}}
+
+    def place_phase(self, phase, phases, accounts, group_zones):
+        """Places the accounts of one phase, updating their locations in place."""
+        # The icon of the last column reaches one cell further, as may labels
+        grid = OccupancyGrid(self.cells[0] + ICON_WIDTH - 1, self.cells[1])
+        pending = {}  # zone -> [(locations, name)]
+
+        # Give labels less room in crowded classrooms, leaving a quarter of the room as slack
+        count = sum(len(members) for members in accounts.values())
+        label_width = max(ICON_WIDTH, min(MAX_LABEL_WIDTH, grid.width * grid.height * 3 // (4 * 2 * count) - LABEL_GAP))
+
+        for account_type in ACCOUNT_TYPES:
+            for name, details in accounts[account_type].items():
+                group = (details.get("groups") or [None])[0]
+                default = DEFAULT_ZONES.get(account_type) or group_zones.get(group, STUDENT_AREA)
+                zone = self.zone_for(account_type, group, phase, default)
+                locations = details["locations"]
+                offset, width = _footprint(name, label_width)
+
+                # Prefer the account's location in this phase, then its location in another phase
+                preferred = locations.get(phase) or next((locations[other] for other in phases if other in locations), None)
+                if preferred and (zone is default or self.in_zone(preferred, zone)):
+                    x, y = preferred.get("x"), preferred.get("y")
+                    if isinstance(x, int) and isinstance(y, int) and self.keep(grid, *to_cell(preferred, self.cells), offset, width):
+                        locations[phase] = {"x": x, "y": y}
+                        continue
+                pending.setdefault(zone, []).append((locations, name))
+
+        # Search cursors, or False once there is no room left for the search
+        room = (0, 0, grid.width - 1, grid.height - 1)
+        room_cursors = {"labelled": None, "icon": None}
+        for zone, members in pending.items():
+            bounds = zone_bounds(zone, grid.width, grid.height)
+            cursor = None
+            for locations, name in members:
+                offset, width = _footprint(name, label_width)
+                position = None
+                if cursor is not False:
+                    position = cursor = grid.find_free(bounds, width, 2, cursor) or False
+                if not position and room_cursors["labelled"] is not False:
+                    # The zone is full; use the next free space in the room
+                    position = room_cursors["labelled"] = grid.find_free(room, width, 2, room_cursors["labelled"]) or False
+                if position:
+                    x, y = position
+                    grid.occupy(x, y, width, 2)
+                    locations[phase] = to_location(min(self.cells[0] - 1, x + offset), y + 1, self.cells)
+                    continue
+
+                # No room for the label; place the icon alone, or anywhere in the zone as a last resort
+                if room_cursors["icon"] is not False:
+                    position = room_cursors["icon"] = grid.find_free(room, ICON_WIDTH, 1, room_cursors["icon"]) or False
+                x, y = position or (bounds[0], bounds[1])
+                grid.occupy(x, y, ICON_WIDTH, 1)
+                locations[phase] = to_location(min(self.cells[0] - 1, x), y, self.cells)
+
+    def keep(self, grid, x, y, offset, width):
+        """Occupies an existing location with its label above or below it (as place_label tries), or without it if only the icon fits."""
+        for left, top, size, rows in ((x - offset, y - 1, width, 2), (x - offset, y, width, 2), (x, y, ICON_WIDTH, 1)):
+            if grid.is_free(left, top, size, rows):
+                grid.occupy(left, top, size, rows)
+                return True
+        return False
+
+    def in_zone(self, location, zone):
+        left, top, right, bottom = zone_bounds(zone)
+        x, y = location.get("x"), location.get("y")
+        return isinstance(x, int) and isinstance(y, int) and left <= x <= right and top <= y <= bottom
+
+
+def place_label(grid, x, y, label, bounds):
+    """Finds a free spot for an icon's name label on screen and marks it as occupied.
+
+    The label goes above the icon, then below it, then shifted left or right along those rows.
+
+    Args:
+        grid: The OccupancyGrid of the screen, with the icons already occupied.
+        x: The icon's column.
+        y: The icon's row.
+        label: The label text.
+        bounds: (left, top, right, bottom) inclusive cell bounds for labels.
+
+    Returns:
+        The (x, y) of the label, or None if there is no room for it near the icon.
+    """
+    left, top, right, bottom = bounds
+    centered = x - len(label) // 2
+    for row in (y - 1, y + 1):
+        if not top <= row <= bottom:
+            continue
+        for start in (centered, x, x + ICON_WIDTH - len(label)):
+            start = max(left, min(start, right - len(label) + 1))
+            if grid.is_free(start, row, len(label)):
+                grid.occupy(start, row, len(label))
+                return start, row
+    return None
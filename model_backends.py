@@ -0,0 +1,292 @@
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from config import PROJECT_ID, LOCATION, GEMINI_MODEL, MODEL_BACKEND, LOCAL_MODEL_LATENCY, LOCAL_MODEL_TOKENS_PER_SECOND, LOCAL_MODEL_REPLAY_DIR
+from config import LOCAL_MODEL_FAULT_RATE, LOCAL_MODEL_SLOW_RATE, LOCAL_MODEL_SLOW_SECONDS
+from prompt_builder import PAYLOAD_HEADER, CHARS_PER_TOKEN, estimate_tokens
+from resilient_call import RetryableError
+
+
+class ModelBackend:
+    """Interface shared by the model backends used by ExtractConfigClient and UserFeedbackClient.
+
+    A backend is created for one system instruction and exposes generate_content with the same
+    shape as the Gemini model: the returned response has a 'text' attribute and a
+    'usage_metadata' attribute with prompt, candidates, and total token counts.
+    """
+
+    def __init__(self, model_name, system_instruction):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        # Usage metadata of the last streamed response, if the backend reports it
+        self.last_usage = None
+
+    def warm_up(self):
+        """Does the one-time setup of the backend ahead of the first call."""
+
+    def generate_content(self, prompt, generation_config=None):
+        raise NotImplementedError
+
+    def generate_content_stream(self, prompt, generation_config=None):
+        """Yields the response text in chunks as it is generated."""
+        yield self.generate_content(prompt, generation_config).text
+
+
+_vertex_lock = threading.Lock()
+_vertex_session = None
+
+
+def vertex_session():
+    """Initializes Vertex AI once per process, shared by all Vertex backends.
+
+    Returns:
+        A tuple of the GenerativeModel class and the safety settings.
+    """
+    global _vertex_session
+    with _vertex_lock:
+        if _vertex_session is None:
+            import vertexai
+            from vertexai.generative_models import GenerativeModel
+            import vertexai.preview.generative_models as generative_models
+
+            vertexai.init(project=PROJECT_ID, location=LOCATION)
+            safety_settings = {
+                generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+                generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+                generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+                generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
+            }
+            _vertex_session = (GenerativeModel, safety_settings)
+        return _vertex_session
+
+
+class VertexBackend(ModelBackend):
+    def __init__(self, system_instruction, model_name=GEMINI_MODEL):
+        """Initializes the VertexBackend; the Gemini model is created on first use.
+
+        Args:
+            system_instruction: The system instruction for the model.
+            model_name: The name of the Gemini model.
+        """
+        super().__init__(model_name, system_instruction)
+        self._model = None
+        self._safety_settings = None
+
+    @property
+    def model(self):
+        """The Gemini model, created on first use so that cached responses need no connection."""
+        if self._model is None:
+            GenerativeModel, self._safety_settings = vertex_session()
+            self._model = GenerativeModel(self.model_name, system_instruction=self.system_instruction)
+        return self._model
+
+    def warm_up(self):
+        self.model
+
+    def generate_content(self, prompt, generation_config=None):
+        model = self.model
+        return model.generate_content(prompt, generation_config=generation_config, safety_settings=self._safety_settings)
+
+    def generate_content_stream(self, prompt, generation_config=None):
+        model = self.model
+        self.last_usage = None
+        for response in model.generate_content(prompt, generation_config=generation_config,
+                                               safety_settings=self._safety_settings, stream=True):
+            # The final chunk carries the usage of the whole response
+            self.last_usage = getattr(response, "usage_metadata", None) or self.last_usage
+            try:
+                text = response.text
+            except ValueError:
+                continue  # A chunk without text, e.g. the final chunk carrying only the finish reason
+            if text:
+                yield text
+
+
+class LocalBackend(ModelBackend):
+    def __init__(self, system_instruction, responder, replay_dir=LOCAL_MODEL_REPLAY_DIR, latency=LOCAL_MODEL_LATENCY,
+                 tokens_per_second=LOCAL_MODEL_TOKENS_PER_SECOND, fault_rate=LOCAL_MODEL_FAULT_RATE,
+                 slow_rate=LOCAL_MODEL_SLOW_RATE, slow_seconds=LOCAL_MODEL_SLOW_SECONDS, seed=None):
+        """Initializes the LocalBackend, a deterministic stand-in for the Gemini model.
+
+        Responses are replayed from a response cache directory recorded with the Vertex backend
+        when one is given and contains the call; otherwise they are generated by the responder.
+
+        Args:
+            system_instruction: The system instruction the calls are made with.
+            responder: Callable (prompt) returning the response text for calls that were not recorded.
+            replay_dir: Optional response cache directory (see RESPONSE_CACHE_DIR) to replay from.
+            latency: Simulated seconds before the first token.
+            tokens_per_second: Simulated output token rate, or None for instant output.
+            fault_rate: Share of calls that fail with a RetryableError before responding.
+            slow_rate: Share of calls whose first token is delayed by slow_seconds (tail latency).
+            slow_seconds: The extra delay of slow calls.
+            seed: Optional seed of the injected faults and delays, for repeatable runs.
+        """
+        super().__init__(f"local:{GEMINI_MODEL}", system_instruction)
+        self.responder = responder
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.fault_rate = fault_rate
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.replay = None
+        if replay_dir:
+            from response_cache import ResponseCache
+            self.replay = ResponseCache(directory=replay_dir)
+
+    def _respond(self, prompt, generation_config):
+        text = None
+        if self.replay is not None:
+            from response_cache import make_key
+            text = self.replay.get(make_key(GEMINI_MODEL, self.system_instruction, generation_config, prompt))
+        if text is None:
+            text = self.responder(prompt)
+        return text
+
+    def _first_token_delay(self):
+        """Returns the simulated latency of a call, raising the injected faults."""
+        with self._lock:
+            self.calls += 1
+            fault = self._random.random() < self.fault_rate
+            slow = self._random.random() < self.slow_rate
+        if fault:
+            raise RetryableError("Injected fault: the local model is temporarily unavailable")
+        return self.latency + (self.slow_seconds if slow else 0)
+
+    def generate_content(self, prompt, generation_config=None):
+        latency = self._first_token_delay()
+        text = self._respond(prompt, generation_config)
+
+        output_tokens = estimate_tokens(text)
+        delay = latency + (output_tokens / self.tokens_per_second if self.tokens_per_second else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        return SimpleNamespace(text=text, usage_metadata=self._usage(prompt, text))
+
+    def _usage(self, prompt, text):
+        prompt_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        return SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens,
+                               total_token_count=prompt_tokens + output_tokens)
+
+    def generate_content_stream(self, prompt, generation_config=None, chunk_tokens=16):
+        latency = self._first_token_delay()
+        text = self._respond(prompt, generation_config)
+        self.last_usage = self._usage(prompt, text)
+        if latency > 0:
+            time.sleep(latency)
+
+        chunk_size = chunk_tokens * CHARS_PER_TOKEN
+        for start in range(0, len(text), chunk_size):
+            chunk = text[start:start + chunk_size]
+            if self.tokens_per_second:
+                time.sleep(estimate_tokens(chunk) / self.tokens_per_second)
+            yield chunk
+
+
+def create_backend(system_instruction, local_responder):
+    """Creates the backend selected by the MODEL_BACKEND environment variable.
+
+    Args:
+        system_instruction: The system instruction for the model.
+        local_responder: The rule-based responder used by the local backend.
+
+    Returns:
+        A VertexBackend ('vertex', the default) or a LocalBackend ('local').
+    """
+    if MODEL_BACKEND == "local":
+        return LocalBackend(system_instruction, local_responder)
+    if MODEL_BACKEND != "vertex":
+        raise ValueError(f"Unknown MODEL_BACKEND: {MODEL_BACKEND!r}")
+    return VertexBackend(system_instruction)
+
+
+def _payload(prompt):
+    """Returns the JSON payload of a prompt built by PromptBuilder."""
+    return json.loads(prompt.split(PAYLOAD_HEADER, 1)[1])
+
+
+def _split_names(text):
+    """Splits a list such as 'Planning, Development, and Testing' into names."""
+    names = re.split(r",\s*(?:and\s+)?|\s+and\s+", text.strip().rstrip("."))
+    return [name.strip(" '\"") for name in names if name.strip(" '\"")]
+
+
+def rule_based_extraction(prompt):
+    """Extracts a few common statements (project name, phases, board, groups) with rules.
+
+    Returns a JSON Patch when the prompt asks for one, a single section when the prompt is for
+    a section, and the full configuration otherwise.
+    """
+    payload = _payload(prompt)
+    text = payload.get("user_input", "")
+    section = payload.get("section")
+    if section:
+        # The other sections are only known by the names in 'references'
+        references = payload.get("references", {})
+        current = {"phases": [{"name": name} for name in references.get("phases", [])],
+                   "boards": [{"board_name": name} for name in references.get("boards", [])],
+                   "groups": list(references.get("groups", []))}
+        if payload.get("current_value") is not None:
+            current[section] = payload["current_value"]
+    else:
+        current = payload.get("current_config", {})
+    config = json.loads(json.dumps(current))
+
+    match = re.search(r"project(?: name)? is (?:called |named )?['\"]?([^'\".\n]+)", text, re.IGNORECASE)
+    if match:
+        config["project_name"] = match.group(1).strip()
+
+    match = re.search(r"board is (?:called |named )?['\"]?([^'\".\n]+)", text, re.IGNORECASE)
+    if match:
+        board_name = match.group(1).strip()
+        if board_name not in [board.get("board_name") for board in config.get("boards", [])]:
+            config.setdefault("boards", []).append({"board_name": board_name})
+
+    match = re.search(r"phases?(?: are|:)\s+([^.\n]+)", text, re.IGNORECASE)
+    if match:
+        boards = config.setdefault("boards", [])
+        if not boards:
+            boards.append({"board_name": "Main Board"})
+        existing = [phase.get("name") for phase in config.get("phases", [])]
+        for name in _split_names(match.group(1)):
+            if name not in existing:
+                config.setdefault("phases", []).append({"name": name, "board": boards[0]["board_name"]})
+
+    match = re.search(r"groups?(?: are|:)\s+([^.\n]+)", text, re.IGNORECASE)
+    if match:
+        for name in _split_names(match.group(1)):
+            if name not in config.setdefault("groups", []):
+                config["groups"].append(name)
+
+    if section:
+        return json.dumps({section: config.get(section)})
+    if "RFC 6902" not in prompt:
+        return json.dumps(config)
+
+    return json.dumps([
+        {"op": "replace" if key in current else "add", "path": f"/{key}", "value": value}
+        for key, value in config.items() if current.get(key) != value
+    ])
+
+
+def rule_based_feedback(prompt):
+    """Reports whether the configuration changed and which required items are still missing.
+
+    Questions are answered with the description of the configuration item they are about.
+    """
+    payload = _payload(prompt)
+
+    topics = payload.get("topics") or {}
+    response = next(iter(topics.values())) + " " if topics else ""
+    response += f"We made {len(payload['changes'])} change(s) to the configuration. " if payload.get("changes") else ""
+    missing = payload.get("missing", [])
+    if missing:
+        return response + f"To complete the configuration, please tell me about at least one {missing[0]}."
+    return response + "Everything looks good!"
@@ -0,0 +1,281 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from config import PLAYBACK_BACKEND
+from tracing import get_tracer
+
+try:
+    import select
+    import termios
+    import tty
+except ImportError:  # Windows; barge-in is not available
+    termios = None
+
+POLL_SECONDS = 0.02  # How often playback checks for a stop request
+# Escape sequences sent by keys such as the arrows, possibly cut short by the read
+ESCAPE_SEQUENCE = re.compile(r"\x1b(?:\[[0-9;]*[A-Za-z~]?|O[A-Za-z]?)?")
+
+
+class NullSink:
+    """Plays nothing, waiting for the length of each clip as if it were playing (headless use and tests)."""
+
+    name = "null"
+
+    def play(self, clip, stop_event):
+        stop_event.wait(clip.duration)
+
+
+class SimpleaudioSink:
+    name = "simpleaudio"
+
+    def __init__(self):
+        import simpleaudio
+
+        self._simpleaudio = simpleaudio
+
+    def play(self, clip, stop_event):
+        play_object = self._simpleaudio.play_buffer(clip.data, clip.channels, clip.sample_width, clip.frame_rate)
+        while play_object.is_playing():
+            if stop_event.wait(POLL_SECONDS):
+                play_object.stop()
+                break
+
+
+class PyAudioSink:
+    name = "pyaudio"
+
+    def __init__(self):
+        import pyaudio
+
+        self._audio = pyaudio.PyAudio()
+
+    def play(self, clip, stop_event):
+        stream = self._audio.open(format=self._audio.get_format_from_width(clip.sample_width),
+                                  channels=clip.channels, rate=clip.frame_rate, output=True)
+        # Write short chunks so that a stop request takes effect quickly
+        chunk = max(1, int(clip.frame_rate * POLL_SECONDS)) * clip.channels * clip.sample_width
+        try:
+            for start in range(0, len(clip.data), chunk):
+                if stop_event.is_set():
+                    break
+                stream.write(clip.data[start:start + chunk])
+        finally:
+            stream.stop_stream()
+            stream.close()
+
+
+class CommandSink:
+    name = "command"
+
+    def __init__(self, command):
+        """Initializes the CommandSink, which plays clips with an external player (e.g. afplay, aplay).
+
+        Args:
+            command: The player command, without the file argument.
+        """
+        self.command = list(command)
+
+    def play(self, clip, stop_event):
+        handle, path = tempfile.mkstemp(suffix=".wav")
+        with os.fdopen(handle, "wb") as f:
+            f.write(clip.to_wav())
+        try:
+            process = subprocess.Popen([*self.command, path])
+            while process.poll() is None:
+                if stop_event.wait(POLL_SECONDS):
+                    process.terminate()
+                    process.wait()
+                    break
+        finally:
+            os.remove(path)
+
+
+def create_sink(name=PLAYBACK_BACKEND):
+    """Creates the audio output selected by the PLAYBACK_BACKEND environment variable.
+
+    Args:
+        name: 'simpleaudio', 'pyaudio', 'command' (afplay or aplay), 'null', or 'auto' (the
+            default) for the first of those that is available.
+    """
+    if name in ("auto", "simpleaudio"):
+        try:
+            return SimpleaudioSink()
+        except ImportError:
+            if name != "auto":
+                raise
+    if name in ("auto", "pyaudio"):
+        try:
+            return PyAudioSink()
+        except ImportError:
+            if name != "auto":
+                raise
+    if name in ("auto", "command"):
+        for command in (["afplay"], ["aplay", "-q"]):
+            if shutil.which(command[0]):
+                return CommandSink(command)
+        if name != "auto":
+            raise ValueError("No audio player command (afplay or aplay) found")
+    if name in ("auto", "null"):
+        return NullSink()
+    raise ValueError(f"Unknown PLAYBACK_BACKEND: {name!r}")
+
+
+class PlaybackController:
+    def __init__(self, sink=None):
+        """Initializes the PlaybackController, which plays queued clips on a background thread.
+
+        Args:
+            sink: The audio output; defaults to the one selected by PLAYBACK_BACKEND.
+        """
+        self.sink = sink or create_sink()
+        self.state = "idle"  # 'idle' or 'playing'
+        self.interrupted = False  # Whether the current utterance was stopped before it finished
+        self.played_seconds = 0.0  # Audio played of the current utterance
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def play(self, clip):
+        """Stops any audio in progress and plays a clip, starting a new utterance."""
+        self.stop()
+        with self._condition:
+            self.interrupted = False
+            self.played_seconds = 0.0
+        self.queue(clip)
+
+    def queue(self, clip):
+        """Plays a clip after the clips already queued."""
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="playback", daemon=True)
+                self._thread.start()
+            self._queue.append(clip)
+            self._condition.notify_all()
+
+    def stop(self):
+        """Stops the clip being played and drops the queued ones; safe to call from any thread."""
+        with self._condition:
+            if self._queue or self.state == "playing":
+                self.interrupted = True
+            self._queue.clear()
+            self._stop.set()
+            self._condition.notify_all()
+
+    @property
+    def is_playing(self):
+        with self._condition:
+            return self.state == "playing" or bool(self._queue)
+
+    def wait(self, timeout=None):
+        """Waits until all queued clips have played; returns False on timeout."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.state == "idle" and not self._queue, timeout)
+
+    def status(self):
+        """Returns the playback state of the current utterance."""
+        with self._condition:
+            return {"state": self.state, "queued": len(self._queue), "interrupted": self.interrupted,
+                    "played_seconds": round(self.played_seconds, 3)}
+
+    def close(self):
+        self.stop()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        tracer = get_tracer()
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closed)
+                if self._closed:
+                    return
+                clip = self._queue.popleft()
+                self._stop.clear()
+                self.state = "playing"
+
+            with tracer.span("playback", sink=self.sink.name, seconds=round(clip.duration, 3)) as span:
+                try:
+                    self.sink.play(clip, self._stop)
+                finally:
+                    with self._condition:
+                        span.set(stopped=self._stop.is_set())
+                        self.played_seconds += min(clip.duration, time.perf_counter() - span.start)
+                        self.state = "idle"
+                        self._condition.notify_all()
+
+
+def first_keys(data):
+    """Returns the text typed in the first read from the terminal, and whether it ended the line.
+
+    A read can hold several keys, e.g. when a line is pasted. Keys that do not type text, such
+    as backspace or the arrows, are dropped; the text after a newline is dropped with it.
+    """
+    text = data.decode("utf-8", errors="ignore")
+    line = re.split(r"[\r\n]", text, maxsplit=1)
+    text = "".join(char for char in ESCAPE_SEQUENCE.sub("", line[0]) if char.isprintable())
+    return text, len(line) > 1
+
+
+def read_line(message, on_keypress=None):
+    """Reads a line like input(), calling on_keypress as soon as the first key is pressed.
+
+    The first key is read in cbreak mode and handed back to input(), through readline when
+    it is available so that it can still be edited. Without a terminal, input() is used as is.
+
+    Args:
+        message: The prompt.
+        on_keypress: Optional callable called (from the reading thread) on the first key press.
+
+    Returns:
+        The line, without the trailing newline.
+    """
+    if on_keypress is None or termios is None or not sys.stdin.isatty():
+        return input(message)
+
+    fd = sys.stdin.fileno()
+    sys.stdout.write(message)
+    sys.stdout.flush()
+
+    settings = termios.tcgetattr(fd)
+    try:
+        tty.setcbreak(fd)
+        select.select([fd], [], [])
+        data = os.read(fd, 4)
+    finally:
+        termios.tcsetattr(fd, termios.TCSADRAIN, settings)
+    on_keypress()
+
+    first, ended = first_keys(data)
+    if ended:
+        sys.stdout.write(first + "\n")
+        return first
+
+    try:
+        import readline
+    except ImportError:
+        sys.stdout.write(first)
+        sys.stdout.flush()
+        return first + input("")
+
+    def insert_first():
+        readline.insert_text(first)
+        readline.redisplay()
+
+    # Redraw the prompt in place, with the first key already typed
+    sys.stdout.write("\r")
+    readline.set_pre_input_hook(insert_first)
+    try:
+        return input(message)
+    finally:
+        readline.set_pre_input_hook(None)
@@ -0,0 +1,172 @@
+import functools
+import hashlib
+import json
+from config import activity_config_schema
+
+# Schema keywords that only document the schema; their text is condensed into notes
+DOCUMENTATION_KEYS = ("description", "$comment", "$schema")
+
+# Separates the static prefix of a prompt from its JSON payload
+PAYLOAD_HEADER = "The following is the JSON input for this request:\n"
+
+# Rough characters-per-token ratio used for local token estimates
+CHARS_PER_TOKEN = 4
+
+
+def dumps(value):
+    """Serializes a value to minified JSON for use in a prompt."""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def estimate_tokens(text):
+    """Estimates the number of model tokens in a text without a network call."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _condense(node, path, notes):
+    """Returns a copy of a schema node without documentation keys, collecting descriptions as notes."""
+    if isinstance(node, list):
+        return [_condense(item, path, notes) for item in node]
+    if not isinstance(node, dict):
+        return node
+
+    condensed = {}
+    for key, value in node.items():
+        if key in DOCUMENTATION_KEYS:
+            if key != "$schema" and path:
+                notes.setdefault(value, []).append(path)
+            continue
+        if key == "properties":
+            condensed[key] = {name: _condense(child, f"{path}.{name}".lstrip("."), notes) for name, child in value.items()}
+        elif key == "items":
+            condensed[key] = _condense(value, f"{path}[]", notes)
+        elif key == "additionalProperties":
+            condensed[key] = _condense(value, f"{path}.*", notes)
+        else:
+            condensed[key] = _condense(value, path, notes)
+    return condensed
+
+
+def _subschemas(schema):
+    """Yields the (keyword, name, subschema) triples nested directly in a schema node."""
+    for key, value in schema.items():
+        if key == "properties":
+            for name, child in value.items():
+                yield key, name, child
+        elif key in ("items", "additionalProperties") and isinstance(value, dict):
+            yield key, None, value
+
+
+def _hoist_repeated(schema, min_size=200):
+    """Replaces identical subschemas that occur more than once with references to shared definitions."""
+    counts = {}
+
+    def count(node, delta=1):
+        key = dumps(node)
+        counts[key] = counts.get(key, 0) + delta
+        for _, _, child in _subschemas(node):
+            count(child, delta)
+
+    def replace(node, top=False):
+        key = dumps(node)
+        if not top and counts[key] > 1 and len(key) >= min_size:
+            if key not in definitions:
+                # Descendants of a shared definition are only written out once
+                for _, _, child in _subschemas(node):
+                    count(child, 1 - counts[key])
+                name = f"d{len(definitions)}"
+                definitions[key] = name
+                hoisted[name] = replace(node, top=True)
+            return {"$ref": f"#/definitions/{definitions[key]}"}
+
+        replaced = dict(node)
+        for keyword, name, child in _subschemas(node):
+            if name is None:
+                replaced[keyword] = replace(child)
+            else:
+                replaced[keyword] = {**replaced[keyword], name: replace(child)}
+        return replaced
+
+    count(schema)
+    definitions, hoisted = {}, {}
+    result = replace(schema, top=True)
+    if hoisted:
+        result["definitions"] = hoisted
+    return result
+
+
+@functools.lru_cache(maxsize=None)
+def schema_digest(section=None):
+    """Returns a condensed form of the activity configuration schema, computed once per process.
+
+    The digest is the minified schema without descriptions or comments, with repeated
+    subschemas shared through definitions, followed by one note per distinct description
+    listing the schema paths it applies to.
+
+    Args:
+        section: Optional top-level property (e.g. 'boards') to limit the digest to.
+    """
+    schema = activity_config_schema()
+    if section is not None:
+        schema = {"type": "object", "properties": {section: schema["properties"][section]}}
+    notes = {}
+    condensed = _hoist_repeated(_condense(schema, "", notes))
+    lines = [f"- {', '.join(paths)}: {text}" for text, paths in notes.items()]
+    if schema.get("description"):
+        lines.insert(0, f"- (root): {schema['description']}")
+    return dumps(condensed) + "\nSchema notes:\n" + "\n".join(lines)
+
+
+class Prompt:
+    def __init__(self, prefix, body):
+        """Initializes a Prompt from its static prefix and per-call body.
+
+        Args:
+            prefix: The static part of the prompt (instructions and schema), identical across calls.
+            body: The per-call part of the prompt (user input and configurations).
+        """
+        self.prefix = prefix
+        self.body = body
+        self.text = prefix + body
+
+    def report(self):
+        """Returns the byte and estimated token counts of the prompt."""
+        return {
+            "prefix_sha256": hashlib.sha256(self.prefix.encode("utf-8")).hexdigest()[:16],
+            "prefix_bytes": len(self.prefix.encode("utf-8")),
+            "body_bytes": len(self.body.encode("utf-8")),
+            "total_bytes": len(self.text.encode("utf-8")),
+            "prefix_tokens": estimate_tokens(self.prefix),
+            "body_tokens": estimate_tokens(self.body),
+            "total_tokens": estimate_tokens(self.text)
+        }
+
+
+class PromptBuilder:
+    def __init__(self, instructions, include_schema=True, section=None):
+        """Initializes the PromptBuilder with the static instructions for a kind of call.
+
+        The static part of the prompt always comes first and never changes between calls, so
+        the model can reuse its cached context for the prefix and only process the body.
+
+        Args:
+            instructions: The task instructions, referring to the keys of the payload.
+            include_schema: Whether to include the schema digest in the prefix.
+            section: Optional top-level property of the configuration to limit the schema to.
+        """
+        sections = []
+        if include_schema:
+            sections.append("The configuration schema (minified, with descriptions condensed into notes):\n" + schema_digest(section))
+        sections.append(instructions)
+        self.prefix = "\n\n".join(sections) + "\n\n"
+
+    def build(self, payload):
+        """Builds a prompt for a call.
+
+        Args:
+            payload: A dictionary of the per-call values, serialized as minified JSON.
+
+        Returns:
+            A Prompt whose text is the static prefix followed by the payload.
+        """
+        return Prompt(self.prefix, PAYLOAD_HEADER + dumps(payload) + "\n")
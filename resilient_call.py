@@ -0,0 +1,318 @@
+import contextvars
+import queue
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from config import (MODEL_DEADLINE, MODEL_FIRST_CHUNK_TIMEOUT, MODEL_RETRIES, MODEL_HEDGE, MODEL_MAX_CONCURRENCY,
+                    MODEL_RATE_LIMIT, MODEL_RATE_BURST)
+
+POLL_SECONDS = 0.05  # How often an attempt waiting for a concurrency slot checks whether it was cancelled
+LATENCY_WINDOW = 100  # Latencies kept per call name for the hedging threshold
+HEDGE_MIN_SAMPLES = 20  # Latencies needed before hedging starts
+HEDGE_PERCENTILE = 0.95
+
+# Names of the error classes (e.g. in google.api_core.exceptions) of transient failures worth
+# retrying; matched by name so that the Google libraries are only imported by the Vertex backend
+RETRYABLE_ERRORS = {
+    "TooManyRequests", "ResourceExhausted", "ServiceUnavailable", "InternalServerError", "GatewayTimeout",
+    "DeadlineExceeded", "Aborted", "RetryableError", "TimeoutError", "ConnectionError"
+}
+
+
+class DeadlineExceeded(TimeoutError):
+    """The model call did not complete before its deadline; it is not retried."""
+
+
+class RetryableError(Exception):
+    """A transient model failure, such as the faults injected by the local backend."""
+
+
+def is_retryable(error):
+    """Returns whether a failed model call may succeed if it is made again."""
+    if isinstance(error, DeadlineExceeded):
+        return False  # The time for the whole call is used up
+    return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """Initializes the TokenBucket, which limits the rate at which calls start.
+
+        Args:
+            rate: The tokens added per second.
+            capacity: The maximum number of tokens, i.e. the burst size; defaults to max(1, rate).
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """Takes a token if one is available; otherwise returns the seconds until there is one."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def try_acquire(self):
+        """Takes a token without waiting; returns whether one was available."""
+        return self._take() == 0.0
+
+    def acquire(self, cancelled=None):
+        """Waits for a token; returns False if the cancelled event is set first."""
+        while True:
+            wait = self._take()
+            if wait == 0.0:
+                return True
+            if cancelled is None:
+                time.sleep(wait)
+            elif cancelled.wait(wait):
+                return False
+
+
+class ResilientCaller:
+    def __init__(self, deadline=MODEL_DEADLINE, first_chunk_timeout=MODEL_FIRST_CHUNK_TIMEOUT, retries=MODEL_RETRIES,
+                 backoff=0.5, max_backoff=8.0, hedge=MODEL_HEDGE, hedge_after=None,
+                 max_concurrency=MODEL_MAX_CONCURRENCY, rate_limit=MODEL_RATE_LIMIT, rate_burst=MODEL_RATE_BURST):
+        """Initializes the ResilientCaller, which makes model calls with deadlines, retries and limits.
+
+        A call is made in attempts on background threads. An attempt that fails with a transient
+        error, or sends nothing within first_chunk_timeout, is retried with exponential backoff
+        and jitter until the deadline of the call. With hedging, a duplicate attempt is started
+        when the first one is slower than the p95 of recent calls, and the first to respond wins.
+        Blocking model calls cannot be interrupted: abandoned attempts finish in the background
+        and keep their concurrency slot until they do.
+
+        Args:
+            deadline: Seconds for the whole call, including retries, or None for no deadline.
+            first_chunk_timeout: Seconds an attempt may take to send its first chunk, or None.
+            retries: The number of times a failed attempt is retried.
+            backoff: Seconds to wait before the first retry; doubled for each retry.
+            max_backoff: The maximum seconds to wait between retries.
+            hedge: Whether to start hedged duplicate attempts.
+            hedge_after: Fixed seconds after which to hedge, instead of the p95 of recent calls.
+            max_concurrency: The maximum number of attempts in flight, or None for no limit.
+            rate_limit: The maximum number of attempts started per second, or None for no limit.
+            rate_burst: The number of attempts that may start at once within the rate limit.
+        """
+        self.deadline = deadline
+        self.first_chunk_timeout = first_chunk_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_after = hedge_after
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.bucket = TokenBucket(rate_limit, rate_burst) if rate_limit else None
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self.counts = {"calls": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+        self._lock = threading.Lock()
+
+    def call(self, name, function, *args, span=None, **kwargs):
+        """Makes a model call that returns its response at once, e.g. generate_content.
+
+        Args:
+            name: The kind of call; calls with the same name share the latencies used for hedging.
+            function: The blocking model call, called with args and kwargs.
+            span: Optional tracing Span that receives the attempt counts of the call.
+
+        Returns:
+            The result of the first successful attempt.
+        """
+        def respond(*args, **kwargs):
+            return [function(*args, **kwargs)]
+
+        return list(self.stream(name, respond, *args, span=span, **kwargs))[0]
+
+    def stream(self, name, function, *args, span=None, **kwargs):
+        """Makes a streamed model call, e.g. generate_content_stream, yielding its chunks.
+
+        An attempt is only retried (or hedged) until its first chunk is yielded; later failures
+        are raised, since the chunks already consumed cannot be taken back.
+
+        Args:
+            name: The kind of call; calls with the same name share the latencies used for hedging.
+            function: The blocking model call returning an iterable of chunks.
+            span: Optional tracing Span that receives the attempt counts of the call.
+
+        Raises:
+            DeadlineExceeded: If the call did not complete before its deadline.
+            Exception: The error of the last attempt, if it failed with a non-retryable error or
+                the retries are used up.
+        """
+        deadline_at = time.monotonic() + self.deadline if self.deadline else None
+        counts = {"attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0}
+        started = False
+        try:
+            for retry in range(self.retries + 1):
+                try:
+                    for chunk in self._attempt(name, function, args, kwargs, deadline_at, counts):
+                        started = True
+                        yield chunk
+                    return
+                except Exception as error:
+                    if started or retry == self.retries or not is_retryable(error):
+                        self._count(failures=1)
+                        raise
+                    delay = min(self.max_backoff, self.backoff * 2 ** retry) * random.uniform(0.5, 1.0)
+                    if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+                        self._count(failures=1)
+                        raise DeadlineExceeded(f"No time left to retry the model call: {error}") from error
+                    counts["retries"] += 1
+                    time.sleep(delay)
+        finally:
+            self._count(calls=1, **counts)
+            if span is not None:
+                span.set(attempts=counts["attempts"], retries=counts["retries"], hedges=counts["hedges"])
+
+    def hedge_delay(self, name):
+        """Returns the seconds after which to start a hedged attempt for a kind of call, or None."""
+        if not self.hedge:
+            return None
+        if self.hedge_after is not None:
+            return self.hedge_after
+        with self._lock:
+            latencies = sorted(self.latencies[name])
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(HEDGE_PERCENTILE * len(latencies)))]
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _count(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counts[key] += value
+
+    def _attempt(self, name, function, args, kwargs, deadline_at, counts):
+        """Yields the chunks of one attempt, and of its hedged duplicate if that responds first."""
+        results = queue.Queue()  # (attempt index, 'chunk' | 'done' | 'error', value)
+        stops = []
+
+        def launch(hedged):
+            if hedged and not self._try_reserve():
+                return False  # Hedges never wait for the limits
+            stop = threading.Event()
+            stops.append(stop)
+            thread = threading.Thread(target=contextvars.copy_context().run, name=f"model-{name}", daemon=True,
+                                      args=(self._pump, len(stops) - 1, function, args, kwargs, results, stop, hedged))
+            thread.start()
+            counts["attempts"] += 1
+            return True
+
+        start = time.monotonic()
+        launch(False)
+        running = 1
+        hedge_delay = self.hedge_delay(name)
+        hedge_at = start + hedge_delay if hedge_delay is not None else None
+        first_chunk_at = start + self.first_chunk_timeout if self.first_chunk_timeout else None
+        winner = None
+
+        try:
+            while True:
+                waits = [deadline_at] + ([hedge_at, first_chunk_at] if winner is None else [])
+                waits = [t for t in waits if t is not None]
+                timeout = max(0.0, min(waits) - time.monotonic()) if waits else None
+                try:
+                    index, kind, value = results.get(timeout=timeout)
+                except queue.Empty:
+                    now = time.monotonic()
+                    if deadline_at is not None and now >= deadline_at:
+                        raise DeadlineExceeded(f"The model call did not complete within {self.deadline:g} seconds")
+                    if winner is None and first_chunk_at is not None and now >= first_chunk_at:
+                        raise TimeoutError(f"The model did not respond within {self.first_chunk_timeout:g} seconds")
+                    if hedge_at is not None and now >= hedge_at:
+                        hedge_at = None
+                        if launch(True):
+                            running += 1
+                            counts["hedges"] += 1
+                    continue
+
+                if winner is not None and index != winner:
+                    continue  # A late response of an attempt that lost
+                if kind == "error":
+                    running -= 1
+                    if winner is None and running:
+                        continue  # The other attempt may still succeed
+                    raise value
+                if winner is None:
+                    winner = index
+                    for other, stop in enumerate(stops):
+                        if other != winner:
+                            stop.set()
+                    with self._lock:
+                        self.latencies[name].append(time.monotonic() - start)
+                    counts["hedge_wins"] += index > 0
+                if kind == "done":
+                    return
+                yield value
+        finally:
+            for stop in stops:
+                stop.set()
+
+    def _pump(self, index, function, args, kwargs, results, stop, reserved):
+        """Runs one attempt on its own thread, passing its chunks to the caller until stopped."""
+        if not reserved and not self._reserve(stop):
+            return  # Cancelled while waiting for the limits
+        try:
+            chunks = iter(function(*args, **kwargs))
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        break
+                    results.put((index, "chunk", chunk))
+                else:
+                    results.put((index, "done", None))
+            finally:
+                close = getattr(chunks, "close", None)
+                if close is not None:
+                    close()
+        except Exception as error:
+            results.put((index, "error", error))
+        finally:
+            if self.semaphore is not None:
+                self.semaphore.release()
+
+    def _reserve(self, stop):
+        """Waits for the rate limit and a concurrency slot; returns False if stopped first."""
+        if self.bucket is not None and not self.bucket.acquire(stop):
+            return False
+        if self.semaphore is None:
+            return True
+        while not self.semaphore.acquire(timeout=POLL_SECONDS):
+            if stop.is_set():
+                return False
+        if stop.is_set():
+            self.semaphore.release()
+            return False
+        return True
+
+    def _try_reserve(self):
+        if self.semaphore is not None and not self.semaphore.acquire(blocking=False):
+            return False
+        if self.bucket is not None and not self.bucket.try_acquire():
+            if self.semaphore is not None:
+                self.semaphore.release()
+            return False
+        return True
+
+
+_shared_caller = None
+_shared_caller_lock = threading.Lock()
+
+
+def get_model_caller():
+    """Returns the call layer shared by both clients, so that its limits cover all model calls."""
+    global _shared_caller
+    with _shared_caller_lock:
+        if _shared_caller is None:
+            _shared_caller = ResilientCaller()
+        return _shared_caller
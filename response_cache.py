@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from config import RESPONSE_CACHE_DIR, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_DISK_BYTES
+
+
+def make_key(model_name, system_instruction, generation_config, prompt):
+    """Returns the content hash identifying a model call.
+
+    Args:
+        model_name: The name of the model.
+        system_instruction: The system instruction the model was created with.
+        generation_config: The generation parameters of the call.
+        prompt: The prompt text.
+
+    Returns:
+        A hex SHA-256 digest of the call inputs.
+    """
+    inputs = json.dumps([model_name, system_instruction, generation_config, prompt], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(inputs.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, directory=RESPONSE_CACHE_DIR, max_disk_bytes=RESPONSE_CACHE_DISK_BYTES):
+        """Initializes the ResponseCache with an in-memory LRU and an optional on-disk store.
+
+        Args:
+            max_entries: The maximum number of responses kept in memory.
+            directory: The directory of the on-disk store, or None to keep responses in memory only.
+            max_disk_bytes: The maximum total size of the on-disk store; the least recently used
+                files are removed when it is exceeded.
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # Sizes of the files in the on-disk store, from least to most recently used
+        self.disk_entries = OrderedDict()
+        self.disk_bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            files = [entry for entry in os.scandir(directory) if entry.name.endswith(".txt")]
+            for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+                self.disk_entries[entry.name[:-4]] = entry.stat().st_size
+                self.disk_bytes += entry.stat().st_size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".txt")
+
+    def get(self, key):
+        """Returns the cached response for a key, or None if it is not cached."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            if key in self.disk_entries:
+                try:
+                    with open(self._path(key), "r", encoding="utf-8") as f:
+                        response = f.read()
+                    os.utime(self._path(key))
+                except OSError:
+                    self._forget_file(key)
+                else:
+                    self.disk_entries.move_to_end(key)
+                    self._remember(key, response)
+                    self.hits += 1
+                    return response
+
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        """Caches the response for a key in memory and, if configured, on disk."""
+        with self.lock:
+            self._remember(key, response)
+            if not self.directory:
+                return
+
+            data = response.encode("utf-8")
+            try:
+                with open(self._path(key), "wb") as f:
+                    f.write(data)
+            except OSError as e:
+                print(f"Could not write response cache entry: {e}")
+                return
+
+            self._forget_file(key, remove=False)
+            self.disk_entries[key] = len(data)
+            self.disk_bytes += len(data)
+            while self.disk_bytes > self.max_disk_bytes and len(self.disk_entries) > 1:
+                self._forget_file(next(iter(self.disk_entries)))
+
+    def discard(self, key):
+        """Removes a response from the cache, e.g. when it turned out to be unusable."""
+        with self.lock:
+            self.entries.pop(key, None)
+            if key in self.disk_entries:
+                self._forget_file(key)
+
+    def _remember(self, key, response):
+        self.entries[key] = response
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _forget_file(self, key, remove=True):
+        size = self.disk_entries.pop(key, None)
+        if size is not None:
+            self.disk_bytes -= size
+        if remove:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """Returns the hit and miss counters and the current cache sizes."""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self.entries),
+                "disk_entries": len(self.disk_entries),
+                "disk_bytes": self.disk_bytes
+            }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Returns the response cache shared by both clients, configured from the environment."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache()
+        return _shared_cache
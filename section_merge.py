@@ -0,0 +1,99 @@
+from visibility import RESOURCES
+from intent_router import SECTIONS
+
+# The sections that define the names other sections refer to
+NAME_KEYS = {"phases": "name", "boards": "board_name", "groups": None}
+
+
+def section_names(config, section):
+    """Returns the names a section defines: the phase, board or group names of a configuration."""
+    key = NAME_KEYS[section]
+    items = (config or {}).get(section) or []
+    names = [item.get(key) if isinstance(item, dict) and key else item for item in items]
+    return [name for name in names if isinstance(name, str)]
+
+
+def name_changes(before, after):
+    """Returns the renames ({old: new}) and removals (a set) between two lists of names.
+
+    A name is taken as renamed if the lists have the same length and a new name took its
+    place; names that were reordered are neither renamed nor removed.
+    """
+    renames = {}
+    if len(before) == len(after):
+        renames = {old: new for old, new in zip(before, after) if old != new and old not in after and new not in before}
+    removed = {name for name in before if name not in after and name not in renames}
+    return renames, removed
+
+
+def _names(names, renames, removed):
+    return [renames.get(name, name) for name in names if name not in removed] if isinstance(names, list) else names
+
+
+def _keys(mapping, renames, removed):
+    return {renames.get(key, key): value for key, value in mapping.items() if key not in removed} if isinstance(mapping, dict) else mapping
+
+
+def _propagate(config, section, renames, removed):
+    """Returns config with the renames and removals of a section's names applied where they are referred to."""
+    config = dict(config)
+    if section == "boards":
+        config["phases"] = [
+            {**phase, "board": renames[phase["board"]]} if isinstance(phase, dict) and phase.get("board") in renames else phase
+            for phase in config.get("phases") or []
+        ]
+        return config
+
+    boards = []
+    for board in config.get("boards") or []:
+        if isinstance(board, dict):
+            board = dict(board)
+            for resource in RESOURCES:
+                if section == "phases" and resource in board:
+                    board[resource] = _keys(board[resource], renames, removed)
+                elif isinstance(board.get(resource), dict):
+                    board[resource] = {phase: _names(groups, renames, removed) for phase, groups in board[resource].items()}
+        boards.append(board)
+    if "boards" in config:
+        config["boards"] = boards
+
+    accounts = config.get("accounts")
+    if isinstance(accounts, dict):
+        key, rewrite = ("locations", _keys) if section == "phases" else ("groups", _names)
+        config["accounts"] = {
+            account_type: {
+                name: {**account, key: rewrite(account[key], renames, removed)} if isinstance(account, dict) and key in account
+                else account
+                for name, account in members.items()
+            } if isinstance(members, dict) else members
+            for account_type, members in accounts.items()
+        }
+    return config
+
+
+def merge_sections(config, extracted):
+    """Merges top-level sections extracted by separate model calls into a configuration.
+
+    Sections are merged in the order of SECTIONS, whatever order the calls finished in. The
+    extracted phases, boards and groups are authoritative for their names: a phase, board or
+    group they renamed or removed is renamed or removed wherever another section refers to it,
+    since the calls for the other sections could not know about the change. References that
+    remain undefined are conflicts for the validator to report.
+
+    Args:
+        config: The configuration the sections were extracted from; it is not modified.
+        extracted: A dictionary of the new values of the extracted sections.
+
+    Returns:
+        The merged configuration.
+    """
+    merged = dict(config)
+    for section in SECTIONS:
+        if section in extracted:
+            merged[section] = extracted[section]
+    for section in NAME_KEYS:
+        if section in extracted:
+            renames, removed = name_changes(section_names(config, section), section_names(merged, section))
+            if renames or removed:
+                merged = _propagate(merged, section, renames, removed)
+    return merged
@@ -0,0 +1,206 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import wave
+from collections import OrderedDict, namedtuple
+from config import SPEECH_BACKEND, SPEECH_SPEED, SPEECH_CACHE_SIZE
+from tracing import span
+
+
+class SpeechClip(namedtuple("SpeechClip", ["data", "frame_rate", "channels", "sample_width"])):
+    """Synthesized speech as raw PCM audio."""
+
+    @property
+    def duration(self):
+        """The length of the clip in seconds."""
+        frame_size = self.channels * self.sample_width
+        return len(self.data) / (frame_size * self.frame_rate) if frame_size and self.frame_rate else 0.0
+
+    def to_wav(self):
+        """Returns the clip as the bytes of a WAV file."""
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as f:
+            f.setnchannels(self.channels)
+            f.setsampwidth(self.sample_width)
+            f.setframerate(self.frame_rate)
+            f.writeframes(self.data)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_segment(cls, segment):
+        """Creates a clip from a pydub AudioSegment."""
+        return cls(segment.raw_data, segment.frame_rate, segment.channels, segment.sample_width)
+
+
+class SpeechBackend:
+    """Interface of the text-to-speech backends; synthesize returns a SpeechClip."""
+
+    name = None
+
+    def settings(self):
+        """Returns the settings that change the audio, as part of the audio cache key."""
+        return {}
+
+    def synthesize(self, text):
+        raise NotImplementedError
+
+
+class GTTSBackend(SpeechBackend):
+    name = "gtts"
+
+    def __init__(self, lang="en", speed=SPEECH_SPEED):
+        """Initializes the GTTSBackend, which synthesizes speech with Google Translate's TTS.
+
+        The mp3 audio is decoded and sped up in memory with pydub.
+
+        Args:
+            lang: The language code of the speech.
+            speed: The playback speed-up applied to the synthesized speech.
+        """
+        self.lang = lang
+        self.speed = speed
+
+    def settings(self):
+        return {"lang": self.lang, "speed": self.speed}
+
+    def synthesize(self, text):
+        from gtts import gTTS
+        from pydub import AudioSegment
+
+        with span("tts", backend=self.name, chars=len(text)):
+            buffer = io.BytesIO()
+            gTTS(text=text, lang=self.lang).write_to_fp(buffer)
+            buffer.seek(0)
+
+        with span("speedup", speed=self.speed):
+            sound = AudioSegment.from_file(buffer, format="mp3")
+            if self.speed != 1:
+                sound = sound.speedup(playback_speed=self.speed)
+        return SpeechClip.from_segment(sound)
+
+
+class Pyttsx3Backend(SpeechBackend):
+    name = "pyttsx3"
+
+    def __init__(self, speed=SPEECH_SPEED, base_rate=200):
+        """Initializes the Pyttsx3Backend, which synthesizes speech offline with the system voices.
+
+        The speed-up is applied through the voice's speaking rate instead of resampling.
+
+        Args:
+            speed: The speed-up relative to base_rate.
+            base_rate: The normal speaking rate in words per minute.
+        """
+        self.speed = speed
+        self.base_rate = base_rate
+        self._engine = None
+        self._lock = threading.Lock()  # The pyttsx3 engine is not thread-safe
+
+    def settings(self):
+        return {"rate": round(self.base_rate * self.speed)}
+
+    def synthesize(self, text):
+        with self._lock, span("tts", backend=self.name, chars=len(text)):
+            if self._engine is None:
+                import pyttsx3
+
+                self._engine = pyttsx3.init()
+                self._engine.setProperty("rate", round(self.base_rate * self.speed))
+
+            # pyttsx3 can only write to a file, which is read back and removed right away
+            handle, path = tempfile.mkstemp(suffix=".wav")
+            os.close(handle)
+            try:
+                self._engine.save_to_file(text, path)
+                self._engine.runAndWait()
+                return self._read(path)
+            finally:
+                os.remove(path)
+
+    def _read(self, path):
+        try:
+            with wave.open(path, "rb") as f:
+                return SpeechClip(f.readframes(f.getnframes()), f.getframerate(), f.getnchannels(), f.getsampwidth())
+        except wave.Error:
+            from pydub import AudioSegment  # e.g. AIFF output on macOS
+
+            return SpeechClip.from_segment(AudioSegment.from_file(path))
+
+
+class NullBackend(SpeechBackend):
+    name = "null"
+
+    def __init__(self, frame_rate=16000):
+        """Initializes the NullBackend, which produces empty clips for headless use and tests."""
+        self.frame_rate = frame_rate
+
+    def synthesize(self, text):
+        return SpeechClip(b"", self.frame_rate, 1, 2)
+
+
+SPEECH_BACKENDS = {backend.name: backend for backend in (GTTSBackend, Pyttsx3Backend, NullBackend)}
+
+
+def create_speech_backend(name=SPEECH_BACKEND):
+    """Creates the speech backend selected by the SPEECH_BACKEND environment variable.
+
+    Args:
+        name: 'gtts' (the default), 'pyttsx3' (offline), or 'null' (no audio).
+    """
+    if name not in SPEECH_BACKENDS:
+        raise ValueError(f"Unknown SPEECH_BACKEND: {name!r}")
+    return SPEECH_BACKENDS[name]()
+
+
+class SpeechCache:
+    def __init__(self, backend, max_entries=SPEECH_CACHE_SIZE):
+        """Initializes the SpeechCache, a content-addressed LRU of synthesized clips.
+
+        Repeated sentences, such as 'Everything looks good!' or the greeting, are synthesized
+        once per backend and settings.
+
+        Args:
+            backend: The SpeechBackend used on a miss.
+            max_entries: The maximum number of clips kept in memory.
+        """
+        self.backend = backend
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, text):
+        settings = sorted(self.backend.settings().items())
+        return hashlib.sha256(repr((self.backend.name, settings, text)).encode("utf-8")).hexdigest()
+
+    def synthesize(self, text):
+        """Returns the clip for a text, synthesizing it on a cache miss.
+
+        Args:
+            text: The text to speak, typically one sentence.
+
+        Returns:
+            The SpeechClip.
+        """
+        key = self.key(text)
+        with self._lock:
+            clip = self.entries.get(key)
+            if clip is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return clip
+            self.misses += 1
+
+        clip = self.backend.synthesize(text)
+        with self._lock:
+            self.entries[key] = clip
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return clip
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
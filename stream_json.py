@@ -0,0 +1,250 @@
+import json
+import re
+
+# Opening markdown fence (e.g. "```json") at the start of a model response
+FENCE_OPEN_PATTERN = re.compile(r'```[a-zA-Z]*[ \t]*\n?')
+# Trailing fragments of a literal or number cut off mid-token
+PARTIAL_LITERAL_PATTERN = re.compile(r'(?:\b(?:t|tr|tru|f|fa|fal|fals|n|nu|nul)|[-+.eE])$')
+CLOSERS = {"{": "}", "[": "]"}
+
+
+def _scan(text):
+    """Returns (stack of open containers, whether the text ends inside a string)."""
+    stack = []
+    in_string = escape = False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in CLOSERS:
+            stack.append(char)
+        elif char in "}]" and stack:
+            stack.pop()
+    return stack, in_string
+
+
+def _trailing_string_start(text):
+    """Returns the index of the opening quote of the string that ends the text."""
+    index = len(text) - 2
+    while index >= 0:
+        if text[index] == '"':
+            backslashes = 0
+            while index - backslashes - 1 >= 0 and text[index - backslashes - 1] == "\\":
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return index
+        index -= 1
+    return 0
+
+
+def _remove_trailing_commas(text):
+    """Removes commas that directly precede a closing bracket, outside of strings."""
+    result = []
+    in_string = escape = False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "}]":
+            while result and result[-1].isspace():
+                result.pop()
+            if result and result[-1] == ",":
+                result.pop()
+        result.append(char)
+    return "".join(result)
+
+
+def repair_json(text):
+    """Repairs common defects of truncated or sloppy model JSON output.
+
+    Closes unterminated strings, drops a trailing member that was cut off before its value,
+    removes trailing commas, and closes unclosed arrays and objects.
+
+    Args:
+        text: The JSON text, without markdown fences.
+
+    Returns:
+        The repaired JSON text.
+    """
+    text = text.strip()
+    stack, in_string = _scan(text)
+    if in_string:
+        text += '"'
+
+    while True:
+        text = text.rstrip()
+        if text.endswith(","):
+            text = text[:-1]
+        elif text.endswith(":"):
+            # A key without its value; drop the key as well
+            text = text[:_trailing_string_start(text[:-1].rstrip())]
+        elif stack and stack[-1] == "{" and text.endswith('"'):
+            start = _trailing_string_start(text)
+            if text[:start].rstrip().endswith(("{", ",")):
+                # A key that was cut off before its colon
+                text = text[:start]
+            else:
+                break
+        elif PARTIAL_LITERAL_PATTERN.search(text) and not text.endswith(("true", "false", "null")):
+            text = PARTIAL_LITERAL_PATTERN.sub("", text)
+        else:
+            break
+
+    text = _remove_trailing_commas(text)
+    return text + "".join(CLOSERS[opener] for opener in reversed(stack))
+
+
+def parse_json(text, repair=True):
+    """Parses JSON, repairing it first if it is truncated or has trailing commas.
+
+    Args:
+        text: The JSON text, without markdown fences.
+        repair: Whether to repair the text if it does not parse; a truncated JSON Patch, for
+            example, must not be repaired, since it would parse as an incomplete edit.
+
+    Raises:
+        json.decoder.JSONDecodeError: If the text cannot be parsed (even after repair).
+    """
+    try:
+        return json.loads(text)
+    except json.decoder.JSONDecodeError:
+        if not repair:
+            raise
+        return json.loads(repair_json(text))
+
+
+class IncrementalJSONParser:
+    def __init__(self, on_member=None):
+        """Initializes the IncrementalJSONParser for a streamed model response.
+
+        Args:
+            on_member: Optional callable (key, value) called as soon as a member of the top-level
+                object is complete; for a top-level array, key is the element index.
+        """
+        self.on_member = on_member
+        self.raw = ""
+        self.text = ""
+        self.members = {}
+        self.opened = False
+        self.closed = False
+
+        # Scanner state over self.text
+        self.position = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.member_start = None
+        self.index = 0
+
+    def feed(self, chunk):
+        """Adds a chunk of the response, stripping markdown fences as they arrive.
+
+        Args:
+            chunk: The next piece of the response text.
+        """
+        if self.closed:
+            return
+        self.raw += chunk
+
+        if not self.opened:
+            # Skip any text before the JSON and wait until an opening fence is complete
+            match = re.search(r'```|[{\[]', self.raw)
+            if match is None:
+                return
+            if match.group() == "```":
+                fence = FENCE_OPEN_PATTERN.match(self.raw, match.start())
+                rest = self.raw[match.end():]
+                if not re.search(r'[\n{\[]', rest):
+                    return
+                body = self.raw[fence.end():] if fence else rest
+            else:
+                body = self.raw[match.start():]
+            self.opened = True
+        else:
+            body = chunk
+
+        fence = (self.text + body).find("```", self.position)
+        if fence != -1:
+            body = (self.text + body)[len(self.text):fence]
+            self.closed = True
+        self.text += body
+        self._scan()
+
+    def _scan(self):
+        """Advances the scanner, reporting top-level members that are complete."""
+        text = self.text
+        # Hold back trailing backticks that may be the start of a closing fence
+        end = len(text) if self.closed else len(text.rstrip("`"))
+        for position in range(self.position, end):
+            char = text[position]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in CLOSERS:
+                self.stack.append(char)
+                if len(self.stack) == 1:
+                    self.member_start = position + 1
+            elif char in "}]" and self.stack:
+                if len(self.stack) == 1:
+                    self._complete_member(text[self.member_start:position])
+                self.stack.pop()
+            elif char == "," and len(self.stack) == 1:
+                self._complete_member(text[self.member_start:position])
+                self.member_start = position + 1
+        self.position = end
+
+    def _complete_member(self, member_text):
+        """Parses a complete top-level member and reports it."""
+        if not member_text.strip():
+            return
+        try:
+            if self.stack[0] == "{":
+                member = json.loads("{" + member_text + "}")
+                if len(member) != 1:
+                    return
+                key, value = next(iter(member.items()))
+            else:
+                key, value = self.index, json.loads(member_text)
+                self.index += 1
+        except json.decoder.JSONDecodeError:
+            return  # Left for the tolerant parse of the whole document
+
+        self.members[key] = value
+        if self.on_member is not None:
+            self.on_member(key, value)
+
+    def finish(self, repair=True):
+        """Parses the whole response, repairing truncations and trailing commas.
+
+        Args:
+            repair: Whether to repair the response if it does not parse (see parse_json).
+
+        Returns:
+            The parsed JSON document.
+
+        Raises:
+            json.decoder.JSONDecodeError: If the response cannot be parsed (even after repair).
+        """
+        if not self.opened:
+            self.text = self.raw
+        return parse_json(self.text.strip().rstrip("`"), repair)
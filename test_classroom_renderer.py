@@ -0,0 +1,130 @@
+import unittest
+from classroom_renderer import ClassroomRenderer, VirtualScreen, classroom_cells
+from config_generator import generate_config
+from layout_engine import ClassroomLayout, ICON_WIDTH
+
+
+def make_config(students=3):
+    return {
+        "project_name": "Awesome Project",
+        "phases": [{"name": "Planning", "board": "Main Board"}, {"name": "Testing", "board": "Main Board"}],
+        "boards": [{"board_name": "Main Board", "canvas": {"Planning": ["Managers"], "Testing": ["Managers", "Testers"]}}],
+        "groups": ["Managers", "Testers"],
+        "accounts": {
+            "teachers": {"Ms. Lee": {"groups": ["Managers"], "locations": {"Planning": {"x": 40, "y": 7}, "Testing": {"x": 10, "y": 7}}}},
+            "students": {
+                f"S{i}": {"groups": ["Testers"], "locations": {"Planning": {"x": 5 + 9 * i, "y": 10}, "Testing": {"x": 5 + 9 * i, "y": 30}}}
+                for i in range(students)
+            },
+            "devices": {}
+        }
+    }
+
+
+class TestClassroomRenderer(unittest.TestCase):
+    def setUp(self):
+        self.screen = VirtualScreen()
+        self.renderer = ClassroomRenderer(self.screen, virtual=True)
+
+    def test_draws_phase_accounts_and_resources(self):
+        self.renderer.update(make_config())
+        text = self.screen.text()
+        self.assertIn("Planning", self.screen.row(1))
+        self.assertIn("Ms. Lee", text)
+        self.assertIn("S2", text)
+        self.assertIn("Canvas: Managers", text)
+        self.assertIn("Todo: Resource not defined yet.", text)
+        self.assertIn("Error: No devices defined yet.", text)
+
+    def test_redraws_only_changed_cells(self):
+        config = make_config(students=20)
+        self.renderer.update(config)
+
+        moved = make_config(students=20)
+        moved["accounts"]["students"]["S3"]["locations"]["Planning"] = {"x": 60, "y": 20}
+        self.assertEqual(self.renderer.update(moved), 2)  # The icon and name of S3
+        self.assertEqual(self.renderer.update(moved), 0)
+
+        expected = VirtualScreen()
+        ClassroomRenderer(expected, virtual=True).update(moved)
+        self.assertEqual(self.screen.text(), expected.text())
+
+    def test_sections_fill_in_as_they_stream(self):
+        config = make_config()
+        self.renderer.update(config)
+        new = make_config()
+        new["boards"][0]["canvas"]["Planning"] = ["Managers", "Testers"]
+        new["accounts"]["teachers"] = {"Mr. Park": new["accounts"]["teachers"].pop("Ms. Lee")}
+        self.renderer.show_section(config, "boards", new["boards"])
+        self.renderer.show_section(config, "accounts", new["accounts"])
+        text = self.screen.text()
+        self.assertIn("Canvas: Managers, Testers", text)  # Kept while the next section streams in
+        self.assertIn("Mr. Park", text)
+        self.assertNotIn("Ms. Lee", text)
+
+        self.renderer.suspend()
+        self.renderer.show_section(config, "groups", config["groups"])
+        self.assertIn("Ms. Lee", self.screen.text())  # A new configuration starts from the one it replaces
+
+    def test_room_locations_scale_to_the_screen(self):
+        """Accounts laid out for a screen get distinct cells on it, with every name label visible."""
+        for students, size in ((30, (30, 100)), (60, (40, 120))):
+            config = generate_config(students=students, groups=4)
+            for details in config["accounts"]["students"].values():
+                details["locations"] = {}
+            config = ClassroomLayout(classroom_cells(*size)).apply(config)
+            screen = VirtualScreen(*size)
+            renderer = ClassroomRenderer(screen, virtual=True)
+            renderer.update(config)
+
+            icons = [(y, x) for key, (y, x, *_) in renderer.cells.items() if key[-1] == "icon"]
+            self.assertEqual(len(icons), students + 1)
+            covered = [(y, x + offset) for y, x in icons for offset in range(ICON_WIDTH)]
+            self.assertEqual(len(set(covered)), len(covered))  # Distinct accounts keep distinct cells
+            for account_type, accounts in config["accounts"].items():
+                for name in accounts:
+                    y, x, text, *_ = renderer.cells[(account_type, name, "name")]
+                    self.assertEqual(screen.row(y)[x:x + len(name)], name)
+
+    def test_switch_phase_in_place(self):
+        self.renderer.update(make_config())
+        self.renderer.set_phase(1)
+        self.assertIn("Testing", self.screen.row(1))
+        self.assertIn("Canvas: Managers, Testers", self.screen.text())
+
+        expected = VirtualScreen()
+        renderer = ClassroomRenderer(expected, virtual=True)
+        renderer.phase_index = 1
+        renderer.update(make_config())
+        self.assertEqual(self.screen.text(), expected.text())
+
+        self.renderer.set_phase(2)  # Wraps around to the first phase
+        self.assertIn("Planning", self.screen.row(1))
+
+    def test_select_phase(self):
+        config = make_config()
+        self.renderer.select_phase(config, "Testing")
+        self.renderer.update(config)
+        self.assertIn("Testing", self.screen.row(1))
+        self.renderer.select_phase(config, "next")  # Wraps around to the first phase
+        self.assertEqual(self.renderer.phase_index, 0)
+        self.renderer.select_phase(config, "Unknown")
+        self.assertEqual(self.renderer.phase_index, 0)
+
+    def test_group_colors_cached(self):
+        config = make_config()
+        config["groups"] = [f"Group {i}" for i in range(8)]
+        self.renderer.update(config)
+        self.assertEqual(self.renderer.group_pairs["Group 0"], 1)
+        self.assertEqual(self.renderer.group_pairs["Group 7"], 2)  # Colors are reused after the sixth group
+        self.assertEqual(self.renderer._color_pair("Unknown"), 0)
+
+    def test_messages_for_incomplete_configs(self):
+        self.renderer.update({"phases": [], "boards": [], "groups": [], "accounts": {}})
+        self.assertIn("No phases defined yet.", self.screen.text())
+        self.renderer.update(make_config())
+        self.assertNotIn("No phases defined yet.", self.screen.text())
+
+
+if __name__ == '__main__':
+    unittest.main()
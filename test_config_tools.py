@@ -0,0 +1,550 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock
+import jsonschema
+from config import load_activity_config_schema
+from config_validator import ConfigValidator
+from json_patch import apply_patch, JsonPatchError
+from prompt_builder import PromptBuilder, schema_digest
+from stream_json import IncrementalJSONParser, parse_json
+from layout_engine import ClassroomLayout, parse_intents, zone_bounds, to_cell, ZONES
+from config_diff import diff_configs, summarize_changes
+from config_store import ConfigStore, Journal, make_patch, share_structure
+from config_generator import generate_config, edit_config
+from intent_router import IntentRouter, SchemaIndex, affected_sections
+from section_merge import merge_sections, name_changes
+from visibility import RESOURCES, VisibilityMatrix
+from config_repair import repair_config, closest_name
+
+
+def make_config():
+    return {
+        "project_name": "Awesome Project",
+        "phases": [{"name": "Planning", "board": "Main Board"}],
+        "boards": [{"board_name": "Main Board", "canvas": {"Planning": ["Managers"]}, "buckets": []}],
+        "groups": ["Managers"],
+        "accounts": {"students": {}, "teachers": {}, "devices": {}}
+    }
+
+
+class TestJsonPatch(unittest.TestCase):
+    def test_apply_operations(self):
+        config = make_config()
+        patch = [
+            {"op": "replace", "path": "/project_name", "value": "Renamed"},
+            {"op": "add", "path": "/groups/-", "value": "Developers"},
+            {"op": "add", "path": "/boards/0/canvas/Planning/-", "value": "Developers"},
+            {"op": "add", "path": "/accounts/students/Ada", "value": {"groups": ["Developers"], "locations": {}}},
+            {"op": "copy", "from": "/accounts/students/Ada", "path": "/accounts/students/Grace"},
+            {"op": "move", "from": "/accounts/students/Grace", "path": "/accounts/devices/Tablet~11"},
+            {"op": "remove", "path": "/boards/0/buckets"},
+            {"op": "test", "path": "/groups/1", "value": "Developers"}
+        ]
+
+        patched = apply_patch(config, patch)
+
+        self.assertEqual(patched["project_name"], "Renamed")
+        self.assertEqual(patched["groups"], ["Managers", "Developers"])
+        self.assertEqual(patched["boards"][0]["canvas"]["Planning"], ["Managers", "Developers"])
+        self.assertIn("Ada", patched["accounts"]["students"])
+        self.assertNotIn("Grace", patched["accounts"]["students"])
+        self.assertIn("Tablet/1", patched["accounts"]["devices"])
+        self.assertNotIn("buckets", patched["boards"][0])
+        # The original configuration is left untouched
+        self.assertEqual(config, make_config())
+
+    def test_invalid_patches(self):
+        config = make_config()
+        for patch in [
+            {"op": "add", "path": "/groups/-", "value": "Developers"},
+            [{"op": "replace", "path": "/missing", "value": 1}],
+            [{"op": "remove", "path": "/groups/5"}],
+            [{"op": "add", "path": "/groups/01", "value": "x"}],
+            [{"op": "test", "path": "/project_name", "value": "Other"}],
+            [{"op": "frobnicate", "path": "/project_name"}],
+            [{"op": "add", "path": "project_name", "value": "x"}]
+        ]:
+            with self.assertRaises(JsonPatchError, msg=patch):
+                apply_patch(config, patch)
+
+
+class TestConfigValidator(unittest.TestCase):
+    def error_paths(self, validator, config):
+        return sorted((list(error.path), error.validator) for error in validator.iter_errors(config))
+
+    def test_valid_config(self):
+        validator = ConfigValidator()
+        validator.validate(make_config())
+
+    def test_schema_errors_have_absolute_paths(self):
+        config = make_config()
+        config["boards"][0]["buckets"] = ["A", "B", "C", "D", "E"]
+        config["accounts"]["students"]["Ada"] = {"groups": ["Managers"], "locations": {"Planning": {"x": 250, "y": 0}}}
+
+        self.assertEqual(self.error_paths(ConfigValidator(), config), [
+            (["accounts", "students", "Ada", "locations", "Planning", "x"], "maximum"),
+            (["boards", 0, "buckets"], "maxItems")
+        ])
+
+    def test_cross_references(self):
+        config = make_config()
+        config["phases"].append({"name": "Testing", "board": "Missing Board"})
+        config["boards"][0]["todo"] = {"Deployment": ["Testers"]}
+        config["accounts"]["devices"]["Tablet"] = {"groups": ["Managers"], "locations": {"Review": {"x": 1, "y": 1}}}
+
+        self.assertEqual(self.error_paths(ConfigValidator(), config), [
+            (["accounts", "devices", "Tablet", "locations", "Review"], "phaseReference"),
+            (["boards", 0, "todo", "Deployment"], "phaseReference"),
+            (["boards", 0, "todo", "Deployment", 0], "groupReference"),
+            (["phases", 1, "board"], "boardReference")
+        ])
+
+    def test_incremental_validation(self):
+        """Unchanged subtrees are skipped, but references are rechecked when names change."""
+        validator = ConfigValidator()
+        config = make_config()
+        validator.validate(config)
+
+        # A patched board is validated again; the boards and accounts the patch left alone are not
+        validator.board_validator = Mock(wraps=validator.board_validator)
+        patched = apply_patch(config, [{"op": "add", "path": "/boards/-", "value": {**config["boards"][0], "board_name": "Copy"}},
+                                       {"op": "add", "path": "/boards/0/buckets/-", "value": "A"},
+                                       {"op": "add", "path": "/boards/0/buckets/-", "value": "A"}])
+        self.assertEqual(self.error_paths(validator, patched), [(["boards", 0, "buckets"], "uniqueItems")])
+        validated = [call.args[0]["board_name"] for call in validator.board_validator.iter_errors.call_args_list]
+        self.assertEqual(validated, [config["boards"][0]["board_name"], "Copy"])
+        config = apply_patch(patched, [{"op": "replace", "path": "/boards/0/buckets", "value": []},
+                                       {"op": "remove", "path": "/boards/1"}])
+        validator.board_validator.reset_mock()
+        validator.validate(config)
+        validator.validate(config)
+        self.assertEqual(validator.board_validator.iter_errors.call_count, 1)  # Only the fixed board, and only once
+
+        # Removing a group invalidates the unchanged board that refers to it
+        config["groups"] = ["Developers"]
+        self.assertEqual(self.error_paths(validator, config), [(["boards", 0, "canvas", "Planning", 0], "groupReference")])
+        config["groups"] = ["Managers"]
+        validator.validate(config)
+
+
+class TestStreamJson(unittest.TestCase):
+    def test_members_reported_as_chunks_arrive(self):
+        config = make_config()
+        config["project_name"] = "Quotes \" and , commas }"
+        text = "Here is the configuration:\n```json\n" + json.dumps(config, indent=2) + "\n```\nLet me know!"
+
+        for chunk_size in (1, 5, 64):
+            members = []
+            parser = IncrementalJSONParser(lambda key, value: members.append((key, value)))
+            for start in range(0, len(text), chunk_size):
+                parser.feed(text[start:start + chunk_size])
+                if start < len(text) // 2:
+                    self.assertNotIn("accounts", dict(members))
+
+            self.assertEqual([key for key, _ in members], list(config))
+            self.assertEqual(dict(members), config)
+            self.assertEqual(parser.finish(), config)
+
+    def test_repairs_truncations(self):
+        self.assertEqual(parse_json('{"groups": ["A", "B",'), {"groups": ["A", "B"]})
+        self.assertEqual(parse_json('{"project_name": "Awes'), {"project_name": "Awes"})
+        self.assertEqual(parse_json('{"groups": ["A"], "phases":'), {"groups": ["A"]})
+        self.assertEqual(parse_json('{"groups": ["A"], "pha'), {"groups": ["A"]})
+        self.assertEqual(parse_json('{"groups": ["A",], "buckets": [],}'), {"groups": ["A"], "buckets": []})
+        self.assertEqual(parse_json('[{"op": "remove", "path": "/groups/0"}, {"op": "add", "value": tr'),
+                         [{"op": "remove", "path": "/groups/0"}, {"op": "add"}])
+        with self.assertRaises(json.decoder.JSONDecodeError):
+            parse_json("Sorry, I cannot help with that.")
+
+
+class TestPromptBuilder(unittest.TestCase):
+    def test_schema_digest_is_equivalent_and_smaller(self):
+        """The condensed schema rejects the same configurations as the original schema."""
+        schema = load_activity_config_schema()
+        digest = schema_digest()
+        condensed = json.loads(digest.split("\nSchema notes:\n")[0])
+
+        config = make_config()
+        config["accounts"]["students"]["Ada"] = {"groups": [], "locations": {"Planning": {"x": 300, "y": 1}}}
+        messages = lambda s: sorted(e.message for e in jsonschema.Draft7Validator(s).iter_errors(config))
+        self.assertEqual(messages(condensed), messages(schema))
+        self.assertLess(len(digest), len(json.dumps(schema, indent=2)))
+        self.assertIn("where y=0 is the front", digest)
+        self.assertIs(schema_digest(), digest)
+
+    def test_prefix_is_stable_across_calls(self):
+        builder = PromptBuilder("Do the task.")
+        first = builder.build({"user_input": "Add a group", "current_config": make_config()})
+        second = builder.build({"user_input": "Rename the project", "current_config": {}})
+
+        self.assertEqual(first.prefix, second.prefix)
+        self.assertTrue(first.text.startswith(first.prefix))
+        self.assertNotIn("\n  ", first.body)
+        report = first.report()
+        self.assertEqual(report["prefix_sha256"], second.report()["prefix_sha256"])
+        self.assertEqual(report["total_bytes"], report["prefix_bytes"] + report["body_bytes"])
+        self.assertGreater(report["total_tokens"], 0)
+
+
+class TestLayoutEngine(unittest.TestCase):
+    def make_roster(self, students):
+        config = make_config()
+        config["phases"].append({"name": "Testing", "board": "Main Board"})
+        config["groups"] = ["Managers", "Developers", "Testers"]
+        config["accounts"]["teachers"]["Ms. Lee"] = {"groups": ["Managers"], "locations": {}}
+        for i in range(students):
+            config["accounts"]["students"][f"Student {i}"] = {"groups": [config["groups"][i % 3]], "locations": {}}
+        return config
+
+    def test_places_every_account_without_overlap(self):
+        for students in (100, 300):
+            config = self.make_roster(students)
+            layout = ClassroomLayout()
+            laid_out = layout.apply(config)
+            ConfigValidator().validate(laid_out)
+            self.assertEqual(config["accounts"]["teachers"]["Ms. Lee"]["locations"], {})  # Input is not modified
+
+            for phase in ("Planning", "Testing"):
+                cells = set()
+                for accounts in laid_out["accounts"].values():
+                    for name, details in accounts.items():
+                        # The screen cells of the icon, and with room for every name, of the label centered above it
+                        x, y = to_cell(details["locations"][phase], layout.cells)
+                        footprint = {(x + dx, y) for dx in range(2)}
+                        if students == 100:
+                            footprint |= {(x - len(name) // 2 + dx, y - 1) for dx in range(len(name))}
+                        self.assertFalse(cells & footprint, name)
+                        cells |= footprint
+
+    def test_keeps_existing_locations(self):
+        layout = ClassroomLayout()
+        config = self.make_roster(20)
+        config["accounts"]["students"]["Student 3"]["locations"] = {"Planning": {"x": 150, "y": 50}}
+        laid_out = layout.apply(config)
+        self.assertEqual(laid_out["accounts"]["students"]["Student 3"]["locations"]["Planning"], {"x": 150, "y": 50})
+        self.assertEqual(layout.apply(laid_out), laid_out)
+
+    def test_placement_requests(self):
+        self.assertEqual(parse_intents("Put group Developers near the front. Thanks!", ["Developers", "Testers"]),
+                         [("Developers", None, ZONES["front"])])
+        self.assertEqual(parse_intents("During Testing the Testers sit at the back left.", ["Testers"], ["Planning", "Testing"]),
+                         [("Testers", "Testing", (0.0, 2 / 3, 1 / 3, 1.0))])
+        self.assertEqual(parse_intents("The Developers left early.", ["Developers"]), [])
+
+        layout = ClassroomLayout()
+        laid_out = layout.apply(self.make_roster(60))
+        laid_out = layout.apply(laid_out, "Group Developers near the back.")
+        laid_out = layout.apply(laid_out, "Add a phase.")  # The request is remembered
+        left, top, right, bottom = zone_bounds(ZONES["back"])
+        for details in laid_out["accounts"]["students"].values():
+            if details["groups"] == ["Developers"]:
+                for location in details["locations"].values():
+                    self.assertTrue(top <= location["y"] <= bottom)
+
+
+class TestConfigDiff(unittest.TestCase):
+    def test_matches_items_by_name(self):
+        before = make_config()
+        before["boards"].append({"board_name": "Lab Board", "canvas": {}})
+        before["accounts"]["students"]["Ann"] = {"groups": ["Managers"], "locations": {"Planning": {"x": 10, "y": 20}}}
+        after = json.loads(json.dumps(before))
+        after["boards"].reverse()  # Reordered boards are matched by name, not position
+        after["boards"][1]["canvas"]["Planning"] = ["Developers"]
+        after["boards"][1]["buckets"] = ["Ideas"]
+        after["groups"].append("Developers")
+        after["phases"].append({"name": "Testing", "board": "Lab Board"})
+        after["accounts"]["students"]["Ann"]["locations"]["Planning"] = {"x": 30, "y": 40}
+        after["accounts"]["students"]["Bob"] = {"groups": ["Developers"], "locations": {"Planning": {"x": 5, "y": 5}}}
+
+        self.assertEqual(summarize_changes(diff_configs(before, after)), [
+            "phases: +Testing",
+            "boards/Main Board/canvas/Planning: +Developers -Managers",
+            "boards/Main Board/buckets: +Ideas",
+            "groups: +Developers",
+            "accounts/students: +Bob",
+            "accounts/students/locations/Planning: Ann (10, 20) -> (30, 40)"
+        ])
+        self.assertEqual(diff_configs(before, json.loads(json.dumps(before))), [])
+
+    def test_values_order_and_long_lists(self):
+        before = make_config()
+        before["phases"].append({"name": "Testing", "board": "Main Board"})
+        after = json.loads(json.dumps(before))
+        after["project_name"] = "Renamed"
+        after["phases"].reverse()
+        after["phases"][0]["board"] = "Lab Board"
+        after["groups"] = [f"Team {i}" for i in range(20)]
+
+        self.assertEqual(summarize_changes(diff_configs(before, after)), [
+            'project_name: "Awesome Project" -> "Renamed"',
+            'phases/Testing/board: "Main Board" -> "Lab Board"',
+            "phases: reordered to Testing, Planning",
+            "groups: +Team 0 +Team 1 +Team 2 +Team 3 +Team 4 +Team 5 +Team 6 +Team 7 +12 more -Managers"
+        ])
+
+
+class TestConfigStore(unittest.TestCase):
+    def make_roster(self, students):
+        config = make_config()
+        config["boards"].append({"board_name": "Lab Board", "canvas": {"Planning": []}})
+        for i in range(students):
+            config["accounts"]["students"][f"Student {i}"] = {"groups": ["Managers"], "locations": {"Planning": {"x": i % 200, "y": i // 200}}}
+        return config
+
+    def test_patches_share_unchanged_structure(self):
+        before = self.make_roster(5)
+        after = apply_patch(before, [{"op": "replace", "path": "/accounts/students/Student 1/locations/Planning/x", "value": 42}])
+        self.assertEqual(before["accounts"]["students"]["Student 1"]["locations"]["Planning"]["x"], 1)
+        self.assertIs(after["boards"], before["boards"])
+        self.assertIs(after["accounts"]["students"]["Student 2"], before["accounts"]["students"]["Student 2"])
+
+        rebuilt = json.loads(json.dumps(after))  # e.g. a full configuration from the model
+        rebuilt["boards"].reverse()
+        shared = share_structure(before, rebuilt)
+        self.assertEqual(shared, rebuilt)
+        self.assertIs(shared["boards"][0], before["boards"][1])  # Matched by board name
+        self.assertIs(shared["accounts"]["students"]["Student 2"], before["accounts"]["students"]["Student 2"])
+        self.assertIs(share_structure(before, json.loads(json.dumps(before))), before)
+
+        patch = make_patch(before, shared)
+        self.assertEqual(apply_patch(before, patch), rebuilt)
+        self.assertIn({"op": "replace", "path": "/accounts/students/Student 1/locations/Planning/x", "value": 42}, patch)
+        self.assertEqual(apply_patch({"a": [1, 2, 3]}, make_patch({"a": [1, 2, 3]}, {"a": [1]})), {"a": [1]})
+
+    def test_undo_redo(self):
+        store = ConfigStore(make_config())
+        store.commit({**make_config(), "project_name": "First"})
+        store.commit({**make_config(), "project_name": "Second"})
+        self.assertEqual(store.commit(store.config), 2)  # Unchanged configurations are not new versions
+
+        self.assertEqual(store.undo()["project_name"], "First")
+        self.assertEqual(store.redo()["project_name"], "Second")
+        self.assertIsNone(store.redo())
+        store.undo()
+        store.commit({**make_config(), "project_name": "Third"})  # Drops the version that could be redone
+        self.assertIsNone(store.redo())
+        self.assertEqual([version["project_name"] for version in store.versions], ["Awesome Project", "First", "Third"])
+
+    def test_memory_stays_flat(self):
+        """Versions of a large roster share every account that a turn does not change."""
+        store = ConfigStore(self.make_roster(500), max_history=1000)
+        for turn in range(200):
+            config = json.loads(json.dumps(store.config))
+            config["accounts"]["students"][f"Student {turn}"]["locations"]["Planning"] = {"x": 199, "y": 99}
+            store.commit(config)
+
+        accounts = {id(details) for version in store.versions for details in version["accounts"]["students"].values()}
+        self.assertEqual(len(store.versions), 201)
+        self.assertEqual(len(accounts), 500 + 200)
+
+    def test_resume_replays_the_journal(self):
+        with tempfile.TemporaryDirectory() as root:
+            store = ConfigStore.create(self.make_roster(20), root, max_history=100)
+            store.journal.segment_bytes = 2000  # Several segments, so old ones are compacted away
+            for turn in range(30):
+                store.commit(apply_patch(store.config, [{"op": "replace", "path": "/project_name", "value": f"Turn {turn}"}]))
+            store.undo()
+            expected = store.config
+            store.journal.file.write('{"op": "commit", "par')  # A record cut short by a crash
+            store.journal.file.flush()
+
+            session = os.listdir(root)[0]
+            self.assertEqual(len(Journal(os.path.join(root, session)).segments()), 2)
+            resumed = ConfigStore.resume(root)
+            self.assertEqual(resumed.config, expected)
+            self.assertEqual(resumed.redo()["project_name"], "Turn 29")
+            resumed.undo()
+            self.assertEqual(resumed.undo()["project_name"], "Turn 27")
+            resumed.close()
+            store.close()
+
+            self.assertEqual(ConfigStore.resume(root).config["project_name"], "Turn 27")
+            self.assertIsNone(ConfigStore.resume(os.path.join(root, "missing")))
+
+
+class TestConfigGenerator(unittest.TestCase):
+    def test_generated_configs_are_valid(self):
+        for shape in ({"students": 0}, {"students": 500, "teachers": 3, "devices": 12, "groups": 8, "phases": 5, "boards": 3, "buckets": 4}):
+            config = generate_config(**shape)
+            ConfigValidator().validate(config)
+            self.assertEqual(config, generate_config(**shape))  # Deterministic
+            self.assertEqual(len(config["accounts"]["students"]), shape["students"])
+            self.assertEqual(len(config["phases"]), shape.get("phases", 3))
+
+        with self.assertRaises(ValueError):
+            generate_config(buckets=5)
+        with self.assertRaises(ValueError):
+            generate_config(phases=2, boards=3)
+
+    def test_edit_config(self):
+        config = generate_config(students=50, phases=2)
+        snapshot = json.loads(json.dumps(config))
+        edited = edit_config(config)
+        ConfigValidator().validate(edited)
+        self.assertEqual(config, snapshot)  # Input is not modified
+        kinds = sorted(change.kind for change in diff_configs(config, edited))
+        self.assertEqual(kinds, ["members", "members", "moved"])
+
+
+class TestIntentRouter(unittest.TestCase):
+    def test_classify(self):
+        router = IntentRouter()
+        config = make_config()
+        for text, kind in [
+            ("What does the bucket view do?", "question"),
+            ("Can you explain the monitor view?", "question"),
+            ("Thanks! Which groups can see the canvas?", "question"),
+            ("Thanks, that looks right.", "acknowledge"),
+            ("Show me the planning phase", "navigate"),
+            ("Next phase.", "navigate"),
+            ("Add a phase: Deployment.", "edit"),
+            ("Can you add a phase called Review?", "edit"),
+            ("What about adding a Share phase?", "edit"),
+            ("What if we moved the teachers to the back?", "edit"),
+            ("Should we add a Share phase?", "edit"),
+            ("Is it possible to add a Testing group?", "edit"),
+            ("What if nobody sees the canvas?", "question"),
+            ("The project is Plant Growth. What does the todo view do?", "edit"),
+            ("Show the canvas to Managers in Planning", "edit"),
+            ("Planning", "edit"),
+        ]:
+            self.assertEqual(router.classify(text, config).kind, kind, text)
+        self.assertEqual(router.classify("Show me the planning phase", config).phase, "Planning")
+
+        # Agreeing to a question or a proposal is an edit; otherwise an acknowledgement needs no extraction
+        for prev_system_response, kind in [
+            ("Shall I add a Share phase?", "edit"),
+            ("Everything looks good. Would you like the monitor view in Testing too?", "edit"),
+            ("I suggest adding a Share phase.", "edit"),
+            ("We added the Testing phase. Everything looks good!", "acknowledge"),
+        ]:
+            self.assertEqual(router.classify("Yes, sure.", config, prev_system_response).kind, kind, prev_system_response)
+
+    def test_affected_sections(self):
+        config = generate_config(students=3)
+        self.assertEqual(affected_sections("The project is Plant Lab. Add a phase: Reflect.", config), ("project_name", "phases"))
+        self.assertEqual(affected_sections("Let Managers see the bucket view", config), ("boards",))
+        self.assertEqual(affected_sections("Move Student 2 near the back", config), ("accounts",))
+        self.assertEqual(len(affected_sections("Sounds about right but rename it", config)), 5)  # Unrecognized: all sections
+
+    def test_schema_index(self):
+        index = SchemaIndex(load_activity_config_schema())
+        self.assertEqual(index.search("What does the bucket view do?")[0], "boards.bucket_view")
+        self.assertEqual(index.search("Where do the devices sit?")[0], "accounts.devices")
+        self.assertEqual(index.search("Hello there"), [])
+
+
+class TestSectionMerge(unittest.TestCase):
+    def test_name_changes(self):
+        self.assertEqual(name_changes(["A", "B", "C"], ["A", "X", "C"]), ({"B": "X"}, set()))
+        self.assertEqual(name_changes(["A", "B", "C"], ["C", "A", "B"]), ({}, set()))  # Reordered
+        self.assertEqual(name_changes(["A", "B", "C"], ["A", "C", "D", "E"]), ({}, {"B"}))
+
+    def test_renames_and_removals_reach_other_sections(self):
+        config = generate_config(students=4, groups=2, phases=2)
+        phases = [{**config["phases"][0], "name": "Warm Up"}, config["phases"][1]]
+        merged = merge_sections(config, {"phases": phases, "groups": ["Team A", "Group 2"], "project_name": "Renamed"})
+        ConfigValidator().validate(merged)
+
+        self.assertEqual(config["phases"][0]["name"], "Phase 1")  # Input is not modified
+        self.assertEqual(list(merged["boards"][0]["canvas"]), ["Warm Up", "Phase 2"])
+        self.assertEqual(merged["boards"][0]["canvas"]["Warm Up"],
+                         ["Team A" if group == "Group 1" else group for group in config["boards"][0]["canvas"]["Phase 1"]])
+        student = merged["accounts"]["students"]["Student 1"]
+        self.assertEqual((list(student["locations"]), student["groups"]), (["Warm Up", "Phase 2"], ["Team A"]))
+        self.assertEqual(merged["project_name"], "Renamed")
+
+        merged = merge_sections(config, {"phases": config["phases"][:1]})  # Phase 2 removed
+        ConfigValidator().validate(merged)
+        self.assertEqual(list(merged["boards"][0]["todo"]), ["Phase 1"])
+        self.assertEqual(list(merged["accounts"]["teachers"]["Teacher 1"]["locations"]), ["Phase 1"])
+
+        # A reference no section defines is left for the validator to report
+        conflict = merge_sections(config, {"boards": [{"board_name": "Board 1", "canvas": {"Phase 1": ["Unknown"]}}]})
+        self.assertEqual([error.validator for error in ConfigValidator().iter_errors(conflict)], ["groupReference"])
+
+
+
+class TestVisibilityMatrix(unittest.TestCase):
+    def test_queries(self):
+        config = make_config()
+        config["groups"].append("Developers")
+        config["phases"].append({"name": "Testing", "board": "Lab Board"})
+        config["boards"][0]["todo"] = {"Planning": ["Developers", "Managers"], "Deployment": ["Managers"]}
+        config["boards"].append({"board_name": "Lab Board", "canvas": {"Testing": ["Developers", "Unknown"]}})
+        config["accounts"]["students"] = {"Ann": {"groups": ["Managers"]}, "Bob": {"groups": ["Developers"]}}
+        config["accounts"]["teachers"] = {"Eve": {"groups": ["Managers", "Developers"]}}
+        visibility = VisibilityMatrix(config)
+
+        self.assertEqual(visibility.grants.shape, (2, len(RESOURCES), 2, 2))
+        self.assertEqual(visibility.groups_seeing("todo", "Planning"), ["Managers", "Developers"])  # Group order
+        self.assertEqual(visibility.groups_seeing("canvas", "Testing"), ["Developers"])  # Undefined group left out
+        self.assertEqual((visibility.defines("todo", "Planning"), visibility.defines("todo", "Testing")), (True, False))
+        self.assertEqual(visibility.resources_for("Ann", "Planning"), ["canvas", "todo"])
+        self.assertEqual(visibility.resources_for("Bob"), {"Planning": ["todo"], "Testing": ["canvas"]})
+        self.assertEqual(visibility.accounts_seeing("canvas", "Testing"), ["Bob", "Eve"])
+        self.assertTrue(visibility.can_see("Eve", "canvas", "Testing"))
+        self.assertFalse(visibility.can_see("Ann", "canvas", "Testing"))
+        self.assertEqual((visibility.resources_for("Nobody", "Planning"), visibility.accounts_seeing("todo", "Deployment")), ([], []))
+        self.assertEqual(visibility.export(), {
+            "students": {"Ann": {"Planning": ["canvas", "todo"]}, "Bob": {"Planning": ["todo"], "Testing": ["canvas"]}},
+            "teachers": {"Eve": {"Planning": ["canvas", "todo"], "Testing": ["canvas"]}}
+        })
+
+    def test_matches_nested_scans(self):
+        config = generate_config(students=200, teachers=2, devices=5, groups=6, phases=8, boards=3)
+        visibility = VisibilityMatrix(config)
+        boards = {board["board_name"]: board for board in config["boards"]}
+        for account_type, members in config["accounts"].items():
+            for name, details in list(members.items())[:20]:
+                for phase in config["phases"]:
+                    board = boards[phase["board"]]
+                    expected = [resource for resource in RESOURCES
+                                if set(board[resource].get(phase["name"], [])) & set(details["groups"])]
+                    self.assertEqual(visibility.resources_for(name, phase["name"]), expected)
+        self.assertEqual(VisibilityMatrix({}).export(), {})
+
+
+
+class TestConfigRepair(unittest.TestCase):
+    def test_repairs(self):
+        config = generate_config(students=4, groups=2, phases=2)
+        board = config["boards"][0]
+        board["buckets"] = ["Ideas", "Questions", "Ideas", "Answers", "Votes", "Extra"]
+        board["canvas"]["phase 1"] = board["canvas"].pop("Phase 1")  # Same phase, different case
+        board["todo"]["Phase 9"] = ["Group 1", "Unknown"]  # Undefined phase, dropped with its groups
+        board["workspace"]["Phase 2"] = ["Testers"]  # Undefined group, declared
+        config["accounts"]["students"]["Student 1"]["locations"]["Phase 1"] = {"x": 250, "y": -3.6}
+        config["accounts"]["students"]["Student 5"] = {"groups": ["group 2"]}
+        config["phases"][1]["board"] = "board 1"
+        snapshot = json.loads(json.dumps(config))
+
+        repaired, repairs = repair_config(config, ConfigValidator())
+        ConfigValidator().validate(repaired)
+        self.assertEqual(config, snapshot)  # Input is not modified
+        self.assertEqual(repaired["boards"][0]["buckets"], ["Ideas", "Questions", "Answers", "Votes"])
+        self.assertEqual(repaired["boards"][0]["canvas"]["Phase 1"], config["boards"][0]["canvas"]["phase 1"])
+        self.assertNotIn("Phase 9", repaired["boards"][0]["todo"])
+        self.assertEqual(repaired["groups"], ["Group 1", "Group 2", "Testers"])
+        self.assertEqual(repaired["accounts"]["students"]["Student 1"]["locations"]["Phase 1"], {"x": 200, "y": 0})
+        self.assertEqual(repaired["accounts"]["students"]["Student 5"], {"groups": ["Group 2"], "locations": {}})
+        self.assertEqual(repaired["phases"][1]["board"], "Board 1")
+        self.assertEqual(len(repairs), 11)
+        self.assertEqual(repair_config(repaired, ConfigValidator()), (repaired, []))
+
+    def test_unrepairable_errors_are_raised(self):
+        config = make_config()
+        config["project_name"] = 5
+        config["boards"][0]["buckets"] = ["Ideas", "Ideas"]
+        with self.assertRaises(jsonschema.exceptions.ValidationError) as raised:
+            repair_config(config, ConfigValidator())
+        self.assertEqual(raised.exception.validator, "type")
+
+        self.assertEqual(closest_name("developers", ["Developer", "Managers"]), "Developer")
+        self.assertIsNone(closest_name("Team", ["Team A", "Team B"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,355 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+import time
+from extract_config_client import ExtractConfigClient, SYSTEM_INSTRUCTION
+from user_feedback_client import UserFeedbackClient
+from model_backends import LocalBackend, rule_based_extraction, rule_based_feedback
+from response_cache import ResponseCache, make_key
+from resilient_call import ResilientCaller, TokenBucket, RetryableError, DeadlineExceeded, is_retryable
+from turn_engine import TurnEngine
+from config_store import ConfigStore
+from playback import PlaybackController, NullSink
+
+
+def make_config():
+    return {
+        "project_name": "Awesome Project",
+        "phases": [{"name": "Planning", "board": "Main Board"}],
+        "boards": [{"board_name": "Main Board", "canvas": {"Planning": ["Managers"]}}],
+        "groups": ["Managers"],
+        "accounts": {"students": {}, "teachers": {}, "devices": {}}
+    }
+
+
+class ScriptedResponder:
+    """Returns scripted responses from a local backend and counts the calls."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self, prompt):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_key_depends_on_all_inputs(self):
+        key = make_key("gemini", "system", {"temperature": 0.2}, "prompt")
+        self.assertEqual(key, make_key("gemini", "system", {"temperature": 0.2}, "prompt"))
+        self.assertNotEqual(key, make_key("gemini", "system", {"temperature": 0.3}, "prompt"))
+        self.assertNotEqual(key, make_key("other", "system", {"temperature": 0.2}, "prompt"))
+
+    def test_memory_lru(self):
+        cache = ResponseCache(max_entries=2, directory=None)
+        cache.put("a", "A")
+        cache.put("b", "B")
+        self.assertEqual(cache.get("a"), "A")
+        cache.put("c", "C")  # Evicts "b", the least recently used
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "C")
+        self.assertEqual(cache.stats()["hits"], 2)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_disk_persistence_and_eviction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(max_entries=1, directory=directory, max_disk_bytes=10)
+            cache.put("a", "12345")
+            cache.put("b", "12345")
+            self.assertEqual(cache.get("a"), "12345")  # Served from disk and marked as recently used
+            cache.put("c", "12345")  # Evicts "b" from disk
+
+            reloaded = ResponseCache(max_entries=4, directory=directory, max_disk_bytes=10)
+            self.assertEqual(reloaded.get("a"), "12345")
+            self.assertIsNone(reloaded.get("b"))
+            self.assertEqual(reloaded.get("c"), "12345")
+            self.assertEqual(sorted(os.listdir(directory)), ["a.txt", "c.txt"])
+
+            reloaded.discard("a")
+            self.assertIsNone(reloaded.get("a"))
+            self.assertEqual(os.listdir(directory), ["c.txt"])
+
+    def test_client_uses_cache(self):
+        """Repeated extraction inputs are served from the cache; unusable responses are not kept."""
+        patch = json.dumps([{"op": "replace", "path": "/project_name", "value": "Renamed"}])
+        responder = ScriptedResponder("not a patch", patch)
+        client = ExtractConfigClient(backend=LocalBackend(SYSTEM_INSTRUCTION, responder, replay_dir=None))
+        client.cache = ResponseCache(directory=None)
+
+        with self.assertRaises(json.decoder.JSONDecodeError):
+            client.extract_patch("Hello there!", "Rename the project", make_config())
+        first = client.extract_patch("Hello there!", "Rename the project", make_config())
+        second = client.extract_patch("Hello there!", "Rename the project", make_config())
+
+        self.assertEqual(first["project_name"], "Renamed")
+        self.assertEqual(first, second)
+        self.assertEqual(responder.calls, 2)
+
+    def test_truncated_patch_is_regenerated(self):
+        """A patch cut off at the output limit should not be repaired into a partial edit."""
+        patch = json.dumps([{"op": "replace", "path": "/project_name", "value": "Renamed"},
+                            {"op": "add", "path": "/groups/-", "value": "Visitors"}])
+        expected = {**make_config(), "project_name": "Renamed", "groups": make_config()["groups"] + ["Visitors"]}
+        responder = ScriptedResponder(patch[:patch.index("}, ") + 2], json.dumps(expected))  # Cut after the first operation
+        client = ExtractConfigClient(sectioned=False, backend=LocalBackend(SYSTEM_INSTRUCTION, responder, replay_dir=None))
+        client.cache = ResponseCache(directory=None)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            config = client.extract_values("Hello there!", "Rename the project and add a Visitors group", make_config())
+        self.assertEqual(config["groups"], expected["groups"])
+        self.assertEqual(responder.calls, 2)
+
+    def test_invalid_full_configuration_is_retried_once(self):
+        responder = ScriptedResponder('{"project_name": 5}', json.dumps(make_config()))
+        client = ExtractConfigClient(delta_mode=False, backend=LocalBackend(SYSTEM_INSTRUCTION, responder, replay_dir=None))
+        client.cache = ResponseCache(directory=None)
+
+        config = client.extract_values("Hello there!", "Name the project", make_config())
+        self.assertEqual(config["project_name"], "Awesome Project")
+        self.assertEqual(responder.calls, 2)
+
+    def test_invalid_configuration_is_repaired_locally(self):
+        generated = make_config()
+        generated["boards"][0]["canvas"]["planning"] = generated["boards"][0]["canvas"].pop("Planning")
+        generated["accounts"]["students"]["Ann"] = {"groups": ["managers"], "locations": {"Planning": {"x": 250, "y": 10}}}
+        for repair, calls in ((True, 1), (False, 2)):
+            responder = ScriptedResponder(json.dumps(generated), json.dumps(make_config()))
+            client = ExtractConfigClient(delta_mode=False, repair=repair,
+                                         backend=LocalBackend(SYSTEM_INSTRUCTION, responder, replay_dir=None))
+            client.cache = ResponseCache(directory=None)
+
+            config = client.extract_values("Hello there!", "Add Ann to the managers", make_config())
+            self.assertEqual(responder.calls, calls)
+        repaired = ExtractConfigClient(delta_mode=False).parse_config(generated)
+        self.assertEqual(repaired["boards"][0]["canvas"], {"Planning": ["Managers"]})
+        self.assertEqual(repaired["accounts"]["students"]["Ann"], {"groups": ["Managers"], "locations": {"Planning": {"x": 200, "y": 10}}})
+
+
+class TestLocalBackend(unittest.TestCase):
+    def make_clients(self, **backend_options):
+        extractor = ExtractConfigClient(backend=LocalBackend(SYSTEM_INSTRUCTION, rule_based_extraction, replay_dir=None, **backend_options))
+        feedback_client = UserFeedbackClient(backend=LocalBackend("feedback", rule_based_feedback, replay_dir=None, **backend_options))
+        extractor.cache = feedback_client.cache = ResponseCache(directory=None)
+        return extractor, feedback_client
+
+    def test_rule_based_session(self):
+        extractor, feedback_client = self.make_clients()
+        template = {"project_name": "", "phases": [], "boards": [], "groups": [], "accounts": {"students": {}, "teachers": {}, "devices": {}}}
+        text = "The project name is Awesome Project. The phases are Planning and Testing. The groups are Managers, Developers."
+
+        for delta_mode in (True, False):
+            extractor.delta_mode = delta_mode
+            config = extractor.extract_values("Hello there!", text, template)
+            self.assertEqual(config["project_name"], "Awesome Project")
+            self.assertEqual([phase["name"] for phase in config["phases"]], ["Planning", "Testing"])
+            self.assertEqual(config["boards"], [{"board_name": "Main Board"}])
+            self.assertEqual(config["groups"], ["Managers", "Developers"])
+
+        self.assertIn("Everything looks good!", feedback_client.get_feedback(template, config, text))
+        self.assertIn("To complete the configuration", feedback_client.get_feedback(template, template, "Hi"))
+
+    def test_feedback_without_changes_skips_the_model(self):
+        extractor, feedback_client = self.make_clients()
+        config = make_config()
+
+        self.assertEqual(feedback_client.get_feedback(config, config, "Thanks"),
+                         "We didn't change anything this time. Everything looks good!")
+        self.assertEqual(feedback_client.backend.calls, 0)
+
+        # Changes are sent as a compact summary; questions also get the configuration to answer from
+        renamed = {**config, "project_name": "Renamed"}
+        feedback_client.get_feedback(config, renamed, "Rename the project")
+        self.assertEqual(feedback_client.last_changes, ['project_name: "Awesome Project" -> "Renamed"'])
+        self.assertLess(feedback_client.last_prompt_report["total_bytes"], len(json.dumps(config)) + 2000)
+        answer = feedback_client.get_feedback(config, config, "What does the bucket view do")
+        self.assertEqual(feedback_client.backend.calls, 2)
+        self.assertTrue(answer.startswith("The bucket view can display 0-4 buckets"))  # From the question's topics
+
+    def test_sections_stream_before_extraction_finishes(self):
+        extractor, _ = self.make_clients(tokens_per_second=2000)
+        template = {"project_name": "", "phases": [], "boards": [], "groups": [], "accounts": {"students": {}, "teachers": {}, "devices": {}}}
+        text = "The project name is Awesome Project. The phases are Planning and Testing. The groups are Managers, Developers."
+
+        for delta_mode in (True, False):
+            extractor.delta_mode = delta_mode
+            extractor.cache = ResponseCache(directory=None)
+            sections = {}
+            config = extractor.extract_values("Hello there!", text, template, on_section=sections.__setitem__)
+            self.assertEqual(sections["project_name"], "Awesome Project")
+            self.assertEqual(sections["groups"], config["groups"])
+            self.assertEqual(sections["phases"], config["phases"])
+
+    def test_sectioned_extraction(self):
+        extractor, _ = self.make_clients(latency=0.2)
+        extractor.delta_mode, extractor.sectioned = False, True
+        template = {"project_name": "", "phases": [], "boards": [], "groups": [], "accounts": {"students": {}, "teachers": {}, "devices": {}}}
+        text = "The project name is Awesome Project. The board is called Main Board. The phases are Planning and Testing. The groups are Managers."
+
+        start = time.perf_counter()
+        sections = {}
+        config = extractor.extract_values("Hello there!", text, template, on_section=sections.__setitem__)
+        self.assertLess(time.perf_counter() - start, 0.6)  # Four concurrent calls, not four in a row
+        self.assertEqual(extractor.backend.calls, 4)
+        self.assertEqual(sorted(sections), ["boards", "groups", "phases", "project_name"])
+        self.assertEqual([phase["board"] for phase in config["phases"]], ["Main Board", "Main Board"])
+        self.assertEqual(config["accounts"], template["accounts"])
+
+        # The phases refer to a board the boards section does not define, so the full configuration is regenerated
+        extractor.backend.calls = 0
+        config = extractor.extract_values("Hello there!", "The phases are Planning and Testing. The groups are Managers.", template)
+        self.assertEqual(extractor.backend.calls, 3)
+        self.assertEqual(config["boards"], [{"board_name": "Main Board"}])
+
+    def test_simulated_latency_and_usage(self):
+        backend = LocalBackend("system", lambda prompt: "x" * 400, replay_dir=None, latency=0.05, tokens_per_second=1000)
+        start = time.perf_counter()
+        response = backend.generate_content("prompt")
+        self.assertGreaterEqual(time.perf_counter() - start, 0.15)  # 0.05s latency + 100 tokens at 1000 tokens/s
+        self.assertEqual(response.usage_metadata.candidates_token_count, 100)
+
+    def test_replay_recorded_responses(self):
+        with tempfile.TemporaryDirectory() as directory:
+            generation_config = {"temperature": 0.2}
+            recorded = ResponseCache(directory=directory)
+            recorded.put(make_key(os.getenv("GEMINI_MODEL"), "system", generation_config, "prompt"), "recorded")
+
+            backend = LocalBackend("system", lambda prompt: "generated", replay_dir=directory)
+            self.assertEqual(backend.generate_content("prompt", generation_config).text, "recorded")
+            self.assertEqual(backend.generate_content("other", generation_config).text, "generated")
+
+
+class Flaky:
+    """A model call that fails with the given errors, or is slow, before succeeding."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)  # Exceptions to raise or seconds to sleep, one per call
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, text):
+        with self._lock:
+            outcome = self.outcomes.pop(0) if self.outcomes else 0
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if isinstance(outcome, Exception):
+                raise outcome
+            time.sleep(outcome)
+            return text
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class TestResilientCaller(unittest.TestCase):
+    def test_retries_only_retryable_errors(self):
+        caller = ResilientCaller(backoff=0.01, retries=2, hedge=False)
+        flaky = Flaky(RetryableError("unavailable"), ConnectionResetError("reset"))
+        self.assertEqual(caller.call("test", flaky, "ok"), "ok")
+        self.assertEqual(flaky.calls, 3)
+
+        flaky = Flaky(ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            caller.call("test", flaky, "ok")
+        self.assertEqual(flaky.calls, 1)
+        self.assertFalse(is_retryable(DeadlineExceeded()))
+
+        flaky = Flaky(*[RetryableError("unavailable")] * 3)
+        with self.assertRaises(RetryableError):
+            caller.call("test", flaky, "ok")
+        self.assertEqual(caller.stats()["failures"], 2)
+
+    def test_deadlines(self):
+        """A hung attempt is abandoned and retried; the whole call is bounded by its deadline."""
+        caller = ResilientCaller(first_chunk_timeout=0.1, backoff=0.01, hedge=False)
+        start = time.perf_counter()
+        self.assertEqual(caller.call("test", Flaky(5), "ok"), "ok")
+        self.assertLess(time.perf_counter() - start, 1)
+
+        caller = ResilientCaller(deadline=0.2, first_chunk_timeout=None, hedge=False)
+        start = time.perf_counter()
+        with self.assertRaises(DeadlineExceeded):
+            caller.call("test", Flaky(5), "ok")
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_hedged_request_cuts_tail_latency(self):
+        caller = ResilientCaller(hedge=True, hedge_after=0.05)
+        flaky = Flaky(2, 0)
+        start = time.perf_counter()
+        self.assertEqual(caller.call("test", flaky, "ok"), "ok")
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(caller.stats()["hedge_wins"], 1)
+
+        # Without a fixed threshold, hedging waits for enough latencies to compute the p95
+        caller = ResilientCaller(hedge=True)
+        self.assertIsNone(caller.hedge_delay("test"))
+        for _ in range(20):
+            caller.call("test", Flaky(0.001), "ok")
+        self.assertLess(caller.hedge_delay("test"), 0.5)
+
+    def test_concurrency_and_rate_limits(self):
+        caller = ResilientCaller(max_concurrency=2, hedge=False)
+        flaky = Flaky(*[0.05] * 6)
+        threads = [threading.Thread(target=caller.call, args=("test", flaky, "ok")) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(flaky.calls, 6)
+        self.assertEqual(flaky.max_in_flight, 2)
+
+        bucket = TokenBucket(rate=20, capacity=1)
+        start = time.perf_counter()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertGreaterEqual(time.perf_counter() - start, 0.15)  # One token every 50ms after the first
+        self.assertFalse(bucket.try_acquire())
+
+    def test_clients_recover_from_injected_faults(self):
+        caller = ResilientCaller(backoff=0.01, retries=6, hedge=False)
+        backend = LocalBackend(SYSTEM_INSTRUCTION, rule_based_extraction, replay_dir=None, fault_rate=0.5, seed=3)
+        extractor = ExtractConfigClient(backend=backend, caller=caller)
+        feedback_client = UserFeedbackClient(
+            backend=LocalBackend("feedback", rule_based_feedback, replay_dir=None, fault_rate=0.5, seed=3), caller=caller)
+        extractor.cache = feedback_client.cache = ResponseCache(directory=None)
+
+        for name in ("Alpha", "Beta", "Gamma"):
+            config = extractor.extract_values("Hello there!", f"The project name is {name}.", make_config())
+            self.assertEqual(config["project_name"], name)
+            self.assertIn("To complete the configuration", feedback_client.get_feedback(make_config(), {}, "Hi"))
+        self.assertGreater(backend.calls, 3)
+        self.assertGreater(caller.stats()["retries"], 0)
+
+    def test_session_survives_a_failing_backend(self):
+        """A turn whose model calls all fail should leave the configuration as it was and let the teacher go on."""
+        caller = ResilientCaller(backoff=0.01, retries=2, hedge=False)
+        extractor = ExtractConfigClient(
+            backend=LocalBackend(SYSTEM_INSTRUCTION, rule_based_extraction, replay_dir=None, fault_rate=1.0), caller=caller)
+        feedback_client = UserFeedbackClient(backend=LocalBackend("feedback", rule_based_feedback, replay_dir=None), caller=caller)
+        extractor.cache = feedback_client.cache = ResponseCache(directory=None)
+        store = ConfigStore(make_config())
+        responses = iter(["The project name is Beta.", "What is a bucket?", "exit"])
+        spoken = []
+        engine = TurnEngine(extractor, feedback_client, render=lambda config: None,
+                            synthesize=lambda text: spoken.append(text), player=PlaybackController(NullSink()),
+                            read_input=lambda message, on_keypress: next(responses), store=store)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            config = asyncio.run(engine.run_session("Hello there!"))
+        self.assertEqual((config, store.last_version), (make_config(), 0))
+        self.assertIn("Sorry, the model could not be reached, so nothing was changed.", spoken)
+        self.assertIsNone(engine.last_error)  # The question after the failure was answered
+
+
+if __name__ == '__main__':
+    unittest.main()
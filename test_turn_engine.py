@@ -0,0 +1,427 @@
+import asyncio
+import contextlib
+import io
+import json
+import os
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from turn_engine import TurnEngine, failure_message, split_sentences
+from tracing import Tracer
+from speech import SpeechBackend, SpeechCache, SpeechClip, NullBackend
+from playback import PlaybackController, NullSink, first_keys
+from batch import BatchRunner, read_conversations, read_checkpoint
+from layout_engine import ClassroomLayout
+from config_generator import generate_config
+
+
+class FakeExtractor:
+    def extract_values(self, prev_system_response, user_input, current_config, on_section=None):
+        return {**current_config, "project_name": user_input}
+
+
+class FakeFeedbackClient:
+    def __init__(self):
+        self.started = threading.Event()
+
+    def get_feedback(self, previous_config, modified_config, user_input):
+        self.started.set()
+        return f"We named the project {modified_config['project_name']}. Everything looks good!"
+
+
+class TestTurnEngine(unittest.TestCase):
+    def test_split_sentences(self):
+        self.assertEqual(split_sentences("Hello there! What should we build? "), ["Hello there!", "What should we build?"])
+        self.assertEqual(split_sentences(""), [])
+
+    def test_feedback_starts_while_rendering(self):
+        """The feedback call should already be running while the classroom is displayed."""
+        feedback_client = FakeFeedbackClient()
+        overlapped = []
+
+        def render(config):
+            overlapped.append(feedback_client.started.wait(timeout=5))
+
+        engine = TurnEngine(FakeExtractor(), feedback_client, render=render, synthesize=lambda text: None)
+        config, feedback = asyncio.run(engine.run_turn("Hello there!", "Awesome Project", {}, {"project_name": ""}))
+
+        self.assertEqual(overlapped, [True])
+        self.assertEqual(config["project_name"], "Awesome Project")
+        self.assertIn("Everything looks good!", feedback)
+
+    def test_stop_speaking_cancels_playback(self):
+        """Speech still in progress is cancelled when the teacher responds."""
+        engine = TurnEngine(FakeExtractor(), FakeFeedbackClient(), render=lambda config: None,
+                            synthesize=lambda text: SpeechClip(b"\0\0" * 80000, 16000, 1, 2),
+                            player=PlaybackController(NullSink()))
+
+        async def speak_then_interrupt():
+            engine.start_speaking("First sentence. Second sentence.")
+            task = engine.speech_task
+            await asyncio.sleep(0.2)
+            engine.stop_speaking()
+            await asyncio.gather(task, return_exceptions=True)
+            return task
+
+        task = asyncio.run(speak_then_interrupt())
+        self.assertTrue(task.cancelled())
+
+    def test_clients_load_during_greeting(self):
+        """The clients are created in the background while the teacher types the first response."""
+        loaded = threading.Event()
+
+        def load_clients():
+            loaded.set()
+            return FakeExtractor(), FakeFeedbackClient()
+
+        def read_input(message, on_keypress):
+            loaded_before_response.append(loaded.wait(timeout=5))
+            return "Awesome Project" if message == "Teacher response: " else "exit"
+
+        loaded_before_response = []
+        engine = TurnEngine(None, None, render=lambda config: None, synthesize=lambda text: None,
+                            player=PlaybackController(NullSink()), read_input=read_input, load_clients=load_clients)
+        config = asyncio.run(engine.run_session("Hello there!", {"project_name": ""}))
+
+        self.assertEqual(loaded_before_response, [True, True])
+        self.assertEqual(config["project_name"], "Awesome Project")
+        self.assertIsInstance(engine.extractor, FakeExtractor)
+
+    def test_client_load_failure_fails_the_turn(self):
+        """A failure to load the clients is reported for the turn, and loading is retried on the next one."""
+        attempts = []
+
+        def load_clients():
+            attempts.append(None)
+            if len(attempts) == 1:
+                raise ConnectionError("no route to host")
+            return FakeExtractor(), FakeFeedbackClient()
+
+        engine = TurnEngine(None, None, render=lambda config: None, synthesize=lambda text: None,
+                            load_clients=load_clients)
+        config = {"project_name": ""}
+        with contextlib.redirect_stdout(io.StringIO()):
+            failed, message = asyncio.run(engine.run_turn("", "Awesome Project", config, config))
+            self.assertIsInstance(engine.last_error, ConnectionError)
+            self.assertEqual((failed, message), (config, failure_message(engine.last_error)))
+            extracted, _ = asyncio.run(engine.run_turn("", "Awesome Project", config, config))
+        self.assertEqual((len(attempts), extracted["project_name"]), (2, "Awesome Project"))
+
+    def test_undo_and_redo_commands(self):
+        responses = iter(["First", "Second", "undo", "undo", "redo", "exit"])
+        engine = TurnEngine(FakeExtractor(), FakeFeedbackClient(), render=lambda config: None, synthesize=lambda text: None,
+                            player=PlaybackController(NullSink()), read_input=lambda message, on_keypress: next(responses))
+        config = asyncio.run(engine.run_session("Hello there!", {"project_name": ""}))
+
+        self.assertEqual(config["project_name"], "First")
+        self.assertEqual([version["project_name"] for version in engine.store.versions], ["", "First", "Second"])
+
+    def test_questions_and_navigation_skip_extraction(self):
+        extractor = FakeExtractor()
+        extractor.extract_values = lambda *args, **kwargs: self.fail("extraction was called")
+        shown = []
+        engine = TurnEngine(extractor, FakeFeedbackClient(), render=lambda config: None, synthesize=lambda text: None,
+                            show_phase=lambda config, phase: shown.append(phase))
+        config = {"project_name": "Awesome Project", "phases": [{"name": "Testing", "board": "Main Board"}]}
+
+        self.assertEqual(asyncio.run(engine.run_turn("", "What does the bucket view do?", config, config))[0], config)
+        self.assertEqual(engine.last_intent.kind, "question")
+        self.assertEqual(asyncio.run(engine.run_turn("", "Thanks!", config, config))[0], config)
+        _, message = asyncio.run(engine.run_turn("", "Show me the Testing phase", config, config))
+        self.assertEqual((shown, message), (["Testing"], "Here is the Testing phase."))
+
+    def test_agreeing_to_a_proposal_extracts(self):
+        engine = TurnEngine(FakeExtractor(), FakeFeedbackClient(), render=lambda config: None, synthesize=lambda text: None)
+        config = {"project_name": "Awesome Project"}
+        extracted, _ = asyncio.run(engine.run_turn("Shall I add a Share phase?", "Sure", config, config))
+        self.assertEqual((engine.last_intent.kind, extracted["project_name"]), ("edit", "Sure"))
+
+    def test_streamed_sections_end_with_extraction(self):
+        """The display of streamed sections is ended whether extraction succeeds or fails."""
+        class StreamingExtractor(FakeExtractor):
+            def extract_values(self, prev_system_response, user_input, current_config, on_section=None):
+                on_section("project_name", user_input)
+                if user_input == "fail":
+                    raise RuntimeError("model unavailable")
+                return super().extract_values(prev_system_response, user_input, current_config)
+
+        events = []
+        engine = TurnEngine(StreamingExtractor(), FakeFeedbackClient(), render=lambda config: events.append("render"),
+                            synthesize=lambda text: None, on_section=lambda key, value: events.append(value),
+                            end_sections=lambda: events.append("end"))
+        config = {"project_name": "Awesome Project"}
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(engine.run_turn("", "Rename it to Renamed", config, config))
+            asyncio.run(engine.run_turn("", "fail", config, config))
+        self.assertEqual(events, ["Rename it to Renamed", "end", "render", "fail", "end"])
+
+
+class SlowExtractor(FakeExtractor):
+    """An extractor that takes as long as a model call, and fails on 'fail'."""
+
+    def extract_values(self, prev_system_response, user_input, current_config, on_section=None):
+        time.sleep(0.1)
+        if user_input == "fail":
+            raise RuntimeError("model unavailable")
+        return super().extract_values(prev_system_response, user_input, current_config, on_section)
+
+
+class TestBatchRunner(unittest.TestCase):
+    def run_batch(self, conversations, output_path, workers, resume=False):
+        runner = BatchRunner(output_path, workers=workers, resume=resume,
+                             make_clients=lambda caller: (SlowExtractor(), FakeFeedbackClient()))
+        with contextlib.redirect_stdout(io.StringIO()):
+            return asyncio.run(runner.run(conversations))
+
+    def test_workers_run_conversations_concurrently(self):
+        conversations = [{"id": f"c{i}", "turns": ["Awesome Project", "What is a bucket?", "undo", f"Project {i}"]}
+                         for i in range(6)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.jsonl")
+            sequential = self.run_batch(conversations, path, workers=1)
+            concurrent = self.run_batch(conversations, path, workers=6)
+            self.assertLess(concurrent["seconds"], sequential["seconds"] / 3)
+
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual(sorted(record["id"] for record in records), [f"c{i}" for i in range(6)])
+        record = next(record for record in records if record["id"] == "c2")
+        self.assertEqual([turn["intent"] for turn in record["turns"]], ["edit", "question", "undo", "edit"])
+        self.assertEqual(record["config"]["project_name"], "Project 2")
+        self.assertIn("extraction", record["turns"][0]["timings"])
+        self.assertEqual((concurrent["done"], concurrent["turns"]), (6, 24))
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            script, path = os.path.join(directory, "conversations.jsonl"), os.path.join(directory, "results.jsonl")
+            with open(script, "w") as f:
+                f.write(json.dumps({"id": "first", "turns": ["Awesome Project"]}) + "\n\n")
+                f.write(json.dumps({"turns": ["fail"]}) + "\n")
+                f.write(json.dumps({"name": "third", "turns": ["Another Project"], "config": {"project_name": ""}}) + "\n")
+            conversations = read_conversations(script)
+            self.assertEqual([conversation["id"] for conversation in conversations], ["first", "line-3", "third"])
+
+            summary = self.run_batch(conversations, path, workers=2)
+            self.assertEqual((summary["done"], summary["failed"]), (2, 1))
+            with open(path, "a") as f:
+                f.write('{"id": "cut short')  # As if the process was killed while writing
+            self.assertEqual(read_checkpoint(path), {"first", "third"})
+
+            summary = self.run_batch(conversations, path, workers=2, resume=True)
+            self.assertEqual((summary["skipped"], summary["failed"]), (2, 1))  # Only the failed conversation runs again
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual([record["id"] for record in records].count("line-3"), 2)
+        failed = records[-1]
+        self.assertEqual((failed["status"], failed["error"], failed["turns"]), ("failed", "RuntimeError: model unavailable", []))
+
+
+    def test_placement_requests_do_not_carry_over(self):
+        """A worker's next conversation should not inherit the placements requested in the last one."""
+        class LayoutExtractor(FakeExtractor):
+            def __init__(self):
+                self.layout = ClassroomLayout()
+
+            def extract_values(self, prev_system_response, user_input, current_config, on_section=None):
+                return self.layout.apply(current_config, user_input)
+
+        config = generate_config(students=4, groups=2, phases=1)
+        for details in config["accounts"]["students"].values():
+            details["locations"] = {}
+        conversations = [{"id": "a", "config": config, "turns": ["Put Group 1 at the back."]},
+                         {"id": "b", "config": config, "turns": ["Lay out the students."]}]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.jsonl")
+            runner = BatchRunner(path, workers=1, make_clients=lambda caller: (LayoutExtractor(), FakeFeedbackClient()))
+            with contextlib.redirect_stdout(io.StringIO()):
+                asyncio.run(runner.run(conversations))
+            with open(path) as f:
+                records = {record["id"]: record["config"] for record in map(json.loads, f)}
+        location = lambda config: config["accounts"]["students"]["Student 1"]["locations"]["Phase 1"]
+        fresh = LayoutExtractor().extract_values("", "Lay out the students.", config)
+        self.assertNotEqual(location(records["a"]), location(fresh))
+        self.assertEqual(location(records["b"]), location(fresh))
+
+
+class CountingBackend(SpeechBackend):
+    """Returns a millisecond of silence per character and counts the calls."""
+
+    name = "counting"
+
+    def __init__(self):
+        self.calls = []
+
+    def synthesize(self, text):
+        self.calls.append(text)
+        return SpeechClip(b"\0\0" * 16 * len(text), 16000, 1, 2)
+
+
+class TestSpeech(unittest.TestCase):
+    def test_clip_duration_and_wav(self):
+        clip = CountingBackend().synthesize("Hi")
+        self.assertAlmostEqual(clip.duration, 0.002)
+        self.assertTrue(clip.to_wav().startswith(b"RIFF"))
+        self.assertEqual(NullBackend().synthesize("Hi").duration, 0)
+
+    def test_repeated_sentences_are_cached(self):
+        backend = CountingBackend()
+        cache = SpeechCache(backend, max_entries=2)
+        engine = TurnEngine(FakeExtractor(), FakeFeedbackClient(), render=lambda config: None,
+                            synthesize=cache.synthesize, player=PlaybackController(NullSink()))
+
+        async def speak_twice():
+            await engine.speak("We added a phase. Everything looks good!")
+            await engine.speak("Everything looks good!")
+
+        asyncio.run(speak_twice())
+
+        self.assertEqual(sorted(backend.calls), ["Everything looks good!", "We added a phase."])
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 2, "entries": 2})
+
+        cache.synthesize("A third sentence.")  # Evicts the least recently used clip
+        cache.synthesize("We added a phase.")
+        self.assertEqual(backend.calls.count("We added a phase."), 2)
+
+
+class RecordingSink(NullSink):
+    name = "recording"
+
+    def __init__(self):
+        self.played = []
+
+    def play(self, clip, stop_event):
+        self.played.append(clip)
+        super().play(clip, stop_event)
+
+
+class TestPlayback(unittest.TestCase):
+    def test_first_keys(self):
+        self.assertEqual(first_keys(b"ab\n"), ("ab", True))  # Pasted lines end the read
+        self.assertEqual(first_keys(b"\r"), ("", True))
+        self.assertEqual(first_keys(b"a\x7fb"), ("ab", False))  # Only the backspace is dropped
+        self.assertEqual(first_keys(b"\x1b[A"), ("", False))
+        self.assertEqual(first_keys(b"x\x1b[1"), ("x", False))
+        self.assertEqual(first_keys("é".encode()), ("é", False))
+
+    def test_queue_plays_in_order(self):
+        sink = RecordingSink()
+        player = PlaybackController(sink)
+        clips = [SpeechClip(b"\0\0" * 160 * i, 16000, 1, 2) for i in (1, 2, 3)]
+        player.play(clips[0])
+        player.queue(clips[1])
+        player.queue(clips[2])
+        self.assertTrue(player.wait(timeout=5))
+
+        self.assertEqual(sink.played, clips)
+        self.assertEqual(player.status(), {"state": "idle", "queued": 0, "interrupted": False, "played_seconds": 0.06})
+        player.close()
+
+    def test_stop_interrupts_playback(self):
+        player = PlaybackController(NullSink())
+        player.play(SpeechClip(b"\0\0" * 160000, 16000, 1, 2))  # Ten seconds
+        player.queue(SpeechClip(b"\0\0" * 160000, 16000, 1, 2))
+        time.sleep(0.05)
+        start = time.perf_counter()
+        player.stop()
+        self.assertTrue(player.wait(timeout=1))
+
+        self.assertLess(time.perf_counter() - start, 0.5)
+        status = player.status()
+        self.assertTrue(status["interrupted"])
+        self.assertLess(status["played_seconds"], 1)
+        player.close()
+
+    def test_typing_barges_in(self):
+        """Speech stops as soon as the teacher starts typing, before the response is complete."""
+        player = PlaybackController(NullSink())
+        stopped_while_typing = []
+
+        def read_input(message, on_keypress):
+            time.sleep(0.1)
+            on_keypress()
+            stopped_while_typing.append(player.wait(timeout=1))
+            return "Add a group"
+
+        engine = TurnEngine(FakeExtractor(), FakeFeedbackClient(), render=lambda config: None,
+                            synthesize=lambda text: SpeechClip(b"\0\0" * 160000, 16000, 1, 2),
+                            player=player, read_input=read_input)
+
+        async def speak_then_respond():
+            engine.start_speaking("A very long sentence.")
+            return await engine.prompt("Teacher response: ")
+
+        self.assertEqual(asyncio.run(speak_then_respond()), "Add a group")
+        self.assertEqual(stopped_while_typing, [True])
+        self.assertTrue(engine.last_playback["interrupted"])
+        player.close()
+
+
+class TestTracing(unittest.TestCase):
+    def test_turn_spans_and_profile(self):
+        """Each stage of a turn is written as a span of the turn; the profiled turn is captured."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "trace.jsonl")
+            tracer = Tracer(path=path, profile_turn=2)
+            engine = TurnEngine(FakeExtractor(), FakeFeedbackClient(), render=lambda config: None,
+                                synthesize=lambda text: None, tracer=tracer)
+
+            async def two_turns():
+                await engine.run_turn("Hello there!", "First", {}, {"project_name": ""})
+                await engine.run_turn("Hello there!", "Second", {}, {"project_name": "First"})
+
+            asyncio.run(two_turns())
+            tracer.close()
+
+            with open(path) as f:
+                records = [json.loads(line) for line in f]
+            turns = {record["turn"]: record for record in records if record["span"] == "turn"}
+            self.assertEqual(sorted(turns), [1, 2])
+            stages = {record["span"]: record for record in records if record["turn"] == 2 and record["span"] != "turn"}
+            self.assertEqual(set(stages), {"extraction", "feedback", "render", "feedback_wait"})
+            for record in stages.values():
+                self.assertEqual(record["parent"], turns[2]["id"])
+                self.assertGreaterEqual(turns[2]["duration_ms"], record["duration_ms"])
+
+            self.assertNotIn("profile", turns[1])
+            self.assertTrue(os.path.exists(turns[2]["profile"]))
+            self.assertIn("extract_values", str(pstats.Stats(turns[2]["profile"]).stats))
+
+    def test_sessions_count_turns_apart(self):
+        """Conversations run at once with one tracer should each number their own turns and keep their own spans."""
+        tracer = Tracer(path=None)
+
+        async def conversation(name):
+            with tracer.session(conversation=name):
+                engine = TurnEngine(SlowExtractor(), FakeFeedbackClient(), render=lambda config: None,
+                                    synthesize=lambda text: None, tracer=tracer)
+                turns = []
+                for i in range(3):
+                    await engine.run_turn("Hello there!", f"{name} {i}", {}, {"project_name": ""})
+                    turns.append((tracer.turn_count, {(record["conversation"], record["turn"]) for record in tracer.last_spans}))
+                return turns
+
+        async def both():
+            return await asyncio.gather(conversation("a"), conversation("b"))
+
+        for name, turns in zip("ab", asyncio.run(both())):
+            self.assertEqual(turns, [(i, {(name, i)}) for i in (1, 2, 3)])
+        self.assertEqual((tracer.turn_count, tracer.last_spans), (0, []))  # Outside any session
+
+    def test_span_records_errors_and_events(self):
+        tracer = Tracer(path=None)
+        with self.assertRaises(ValueError):
+            with tracer.span("model_call", model="local") as span:
+                span.mark("ttft")
+                span.mark("ttft")  # Only the first event is kept
+                raise ValueError("bad response")
+
+        record = tracer.last_spans[-1]
+        self.assertEqual(record["span"], "model_call")
+        self.assertEqual(record["error"], "ValueError")
+        self.assertLessEqual(record["ttft_ms"], record["duration_ms"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+from config import TRACE_FILE, TRACE_PROFILE_TURN
+
+# The span that new spans are nested in; copied into threads started with asyncio.to_thread
+_current_span = contextvars.ContextVar("current_span", default=None)
+# The TraceSession that turns and spans are counted in, as for the span
+_current_session = contextvars.ContextVar("current_session", default=None)
+
+
+def usage_attributes(usage_metadata):
+    """Converts model usage metadata to span attributes."""
+    if usage_metadata is None:
+        return {}
+    return {
+        name: getattr(usage_metadata, name)
+        for name in ("prompt_token_count", "candidates_token_count", "total_token_count")
+        if isinstance(getattr(usage_metadata, name, None), int)
+    }
+
+
+class Span:
+    def __init__(self, name, span_id, parent_id, turn, attributes):
+        """Initializes the Span, a timed stage of a turn.
+
+        Args:
+            name: The stage name (e.g. 'model_call').
+            span_id: The id of the span, unique within the process.
+            parent_id: The id of the enclosing span, or None.
+            turn: The number of the turn the span belongs to (0 before the first turn).
+            attributes: Initial attributes, such as sizes.
+        """
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.turn = turn
+        self.attributes = dict(attributes)
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        """Adds attributes to the span."""
+        self.attributes.update(attributes)
+
+    def mark(self, event):
+        """Records the milliseconds from the start of the span to an event, once (e.g. 'ttft')."""
+        self.attributes.setdefault(f"{event}_ms", round((time.perf_counter() - self.start) * 1000, 3))
+
+    def record(self):
+        return {
+            "turn": self.turn,
+            "span": self.name,
+            "id": self.span_id,
+            "parent": self.parent_id,
+            "start": round(self.start_time, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            **self.attributes
+        }
+
+
+class TraceSession:
+    def __init__(self, tracer, attributes):
+        """Initializes the TraceSession, the turns and spans of one session of a tracer.
+
+        Args:
+            tracer: The Tracer the session belongs to.
+            attributes: Attributes added to every span of the session, e.g. a conversation id.
+        """
+        self.tracer = tracer
+        self.attributes = dict(attributes)
+        self.turn_count = 0
+        self.last_spans = []  # Spans of the last turn, for inspection and tests
+
+
+class Tracer:
+    def __init__(self, path=TRACE_FILE, profile_turn=TRACE_PROFILE_TURN):
+        """Initializes the Tracer, which writes the spans of each turn to a JSON-lines file.
+
+        Args:
+            path: The JSON-lines file to append spans to, or None to only keep them in memory.
+            profile_turn: Optional number of a turn (starting at 1) to capture with cProfile;
+                the profile is written next to the trace file as '<path>.turn<N>.prof'.
+        """
+        self.path = path
+        self.profile_turn = profile_turn
+        self._default_session = TraceSession(self, {})
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = None
+        self._profiles = None  # cProfile.Profile objects of the turn being profiled
+        self._profiler = threading.local()
+
+    @property
+    def turn_count(self):
+        """The number of turns of the current session."""
+        return self._session().turn_count
+
+    @property
+    def last_spans(self):
+        """The spans of the last turn of the current session."""
+        return self._session().last_spans
+
+    def _session(self):
+        session = _current_session.get()
+        return session if session is not None and session.tracer is self else self._default_session
+
+    @contextlib.contextmanager
+    def session(self, **attributes):
+        """Counts the turns and spans opened inside it (also in threads) apart from other sessions.
+
+        Sessions let several conversations run at once with one tracer, e.g. in a batch: each
+        has its own turn numbers and last spans, and its spans are written with its attributes.
+
+        Args:
+            **attributes: Attributes added to every span of the session.
+
+        Yields:
+            The TraceSession.
+        """
+        session = TraceSession(self, attributes)
+        token = _current_session.set(session)
+        try:
+            yield session
+        finally:
+            _current_session.reset(token)
+
+    def profile_next_turn(self):
+        """Captures the next turn with cProfile."""
+        self.profile_turn = self.turn_count + 1
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        """Times a stage; spans opened inside it (also in threads) are recorded as its children.
+
+        Args:
+            name: The stage name.
+            **attributes: Initial attributes of the span.
+
+        Yields:
+            The Span, to add attributes or mark events.
+        """
+        parent = _current_span.get()
+        session = self._session()
+        span = Span(name, next(self._ids), parent.span_id if parent else None, session.turn_count,
+                    {**session.attributes, **attributes})
+        token = _current_span.set(span)
+        profiler = self._start_profiler()
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._profiler.active = None
+            span.duration = time.perf_counter() - span.start
+            _current_span.reset(token)
+            self._write(span, session)
+
+    @contextlib.contextmanager
+    def turn(self, **attributes):
+        """Opens the span of a new turn, capturing it with cProfile if it is the profiled turn."""
+        session = self._session()
+        with self._lock:
+            session.turn_count += 1
+            session.last_spans = []
+            # One turn is profiled at a time, even if several sessions reach the profiled turn
+            profiled = session.turn_count == self.profile_turn and self._profiles is None
+            if profiled:
+                self._profiles = []
+
+        try:
+            with self.span("turn", **attributes) as span:
+                yield span
+                if profiled:
+                    span.set(profile=self._profile_path())
+        finally:
+            if profiled:
+                self._dump_profiles()
+
+    def _start_profiler(self):
+        """Starts a profiler in this thread if the current turn is profiled and none is running."""
+        if self._profiles is None or getattr(self._profiler, "active", None) is not None:
+            return None
+        import cProfile  # Only needed in the profiled turn
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return None  # Python 3.12+ allows one profiler at a time, which covers all threads
+        self._profiler.active = profiler
+        with self._lock:
+            self._profiles.append(profiler)
+        return profiler
+
+    def _profile_path(self):
+        return f"{self.path or 'trace'}.turn{self.turn_count}.prof"
+
+    def _dump_profiles(self):
+        import pstats
+
+        with self._lock:
+            profiles, self._profiles = self._profiles, None
+        stats = None
+        for profiler in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profiler)
+                else:
+                    stats.add(profiler)
+            except TypeError:
+                continue  # A profiler that recorded nothing
+        if stats is not None:
+            stats.dump_stats(self._profile_path())
+
+    def _write(self, span, session):
+        record = span.record()
+        with self._lock:
+            session.last_spans.append(record)
+            if self.path is None:
+                return
+            if self._file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._file = open(self.path, "a")
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+_tracer = None
+
+
+def get_tracer():
+    """Returns the tracer shared by the clients and the turn engine."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def span(name, **attributes):
+    """Times a stage with the shared tracer; see Tracer.span."""
+    return get_tracer().span(name, **attributes)
+
+
+def read_trace(path):
+    """Reads the spans of a trace file, grouped by span name as durations in seconds."""
+    samples = {}
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                samples.setdefault(record["span"], []).append(record["duration_ms"] / 1000)
+    return samples
@@ -0,0 +1,304 @@
+import asyncio
+import json
+import re
+import time
+from tracing import get_tracer
+from playback import PlaybackController, POLL_SECONDS, read_line
+from config_store import ConfigStore
+from intent_router import IntentRouter
+
+# Split feedback into sentences so speech can start before the whole text is synthesized
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+# Spoken when a turn fails, so that the teacher can try again
+TURN_FAILED_MESSAGE = "Sorry, {reason}, so nothing was changed. Please try again."
+# Spoken when the change was saved but the turn failed afterwards (e.g. while generating feedback)
+FEEDBACK_FAILED_MESSAGE = "We made the change, but {reason}, so there is no feedback this time."
+
+
+def split_sentences(text):
+    """Splits feedback text into sentences for incremental speech synthesis."""
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+
+
+def failure_message(error, changed=False):
+    """Returns the message for the teacher when a turn fails with error, after or before the change was saved."""
+    if isinstance(error, TimeoutError):
+        reason = "the model took too long to answer"
+    elif isinstance(error, ValueError):
+        reason = "I could not make sense of the model's answer"
+    else:
+        reason = "the model could not be reached"
+    return (FEEDBACK_FAILED_MESSAGE if changed else TURN_FAILED_MESSAGE).format(reason=reason)
+
+
+class TurnEngine:
+    def __init__(self, extractor, feedback_client, render, synthesize, player=None, on_section=None, tracer=None,
+                 read_input=read_line, load_clients=None, store=None, router=None, show_phase=None,
+                 end_sections=None):
+        """Initializes the TurnEngine with the clients and stage callables for a turn.
+
+        Args:
+            extractor: The ExtractConfigClient used to update the configuration.
+            feedback_client: The UserFeedbackClient used to generate feedback.
+            render: Blocking callable that displays the classroom for a configuration.
+            synthesize: Blocking callable (text) returning a SpeechClip, e.g. SpeechCache.synthesize.
+            player: The PlaybackController that plays speech; defaults to one using PLAYBACK_BACKEND.
+            on_section: Optional callable (key, value) called while extraction streams, as soon
+                as a top-level section of the new configuration is known.
+            tracer: The Tracer that records the spans of each turn; defaults to the shared one.
+            read_input: Blocking callable (message, on_keypress) that reads the teacher's response,
+                calling on_keypress as soon as the teacher starts typing.
+            load_clients: Optional blocking callable returning (extractor, feedback_client), used
+                when the clients are None; run_session loads them in the background while the
+                teacher reads the greeting and types the first response.
+            store: The ConfigStore of the session; run_session creates an unjournaled one if None.
+            router: The IntentRouter that decides which responses need extraction; defaults to a new one.
+            show_phase: Optional blocking callable (config, phase) that displays a phase (by name, or
+                'next' or 'previous') for navigation commands; render is used if None.
+            end_sections: Optional callable run once extraction has finished or failed,
+                e.g. to hand the terminal back after on_section drew the streamed sections.
+        """
+        self.extractor = extractor
+        self.feedback_client = feedback_client
+        self.render = render
+        self.synthesize = synthesize
+        self.player = player or PlaybackController()
+        self.on_section = on_section
+        self.tracer = tracer or get_tracer()
+        self.read_input = read_input
+        self.load_clients = load_clients
+        self.clients_task = None
+        self.store = store
+        self.router = router or IntentRouter()
+        self.show_phase = show_phase or (lambda config, phase: render(config))
+        self.end_sections = end_sections
+        self.speech_task = None
+        # Playback state of the last feedback when the teacher responded (see PlaybackController.status)
+        self.last_playback = None
+        # Seconds spent in each stage of the last turn, and the intent the turn was routed by
+        self.last_timings = {}
+        self.last_intent = None
+        # The exception that made the last turn fail, if it did
+        self.last_error = None
+
+    def _timed(self, stage, function, *args, **kwargs):
+        """Calls a blocking function in a span, recording its duration in last_timings."""
+        start = time.perf_counter()
+        try:
+            with self.tracer.span(stage):
+                return function(*args, **kwargs)
+        finally:
+            self.last_timings[stage] = time.perf_counter() - start
+
+    def start_loading_clients(self):
+        """Starts loading the clients in the background if they are not loaded yet."""
+        if self.extractor is None and self.clients_task is None:
+            self.clients_task = asyncio.create_task(
+                asyncio.to_thread(self._timed, "load_clients", self.load_clients)
+            )
+
+    async def _clients_ready(self):
+        """Waits until the clients are loaded, loading them now if they were not started."""
+        if self.extractor is not None:
+            return
+        self.start_loading_clients()
+        try:
+            self.extractor, self.feedback_client = await self.clients_task
+        except Exception:
+            self.clients_task = None  # Loaded again on the next turn
+            raise
+
+    async def run_turn(self, prev_system_response, user_input, previous_config, current_config):
+        """Runs one turn, requesting feedback as soon as extraction returns.
+
+        The feedback call runs in the background while the classroom is rendered, so the
+        time spent looking at the classroom overlaps with the feedback generation.
+        The extracted configuration is committed to the store, if there is one, before it is
+        displayed. Responses that are only questions or acknowledgements skip extraction and
+        go straight to feedback, and navigation commands are handled by the renderer alone.
+        If the turn fails (e.g. the model calls run out of retries or time), the error is kept
+        in last_error and the feedback says what happened: unless the extracted configuration
+        was already committed, the configuration is left as it was for the teacher to try again.
+
+        Args:
+            prev_system_response: The last message spoken to the teacher.
+            user_input: The teacher's response.
+            previous_config: The configuration before this turn.
+            current_config: The configuration to be modified.
+
+        Returns:
+            A tuple of the extracted configuration and the feedback text.
+        """
+        route_start = time.perf_counter()
+        self.last_intent = intent = self.router.classify(user_input, current_config, prev_system_response)
+        self.last_timings = {"route": time.perf_counter() - route_start}
+        self.last_error = None
+        start = time.perf_counter()
+        committed = None
+        try:
+            if intent.kind != "navigate":
+                await self._clients_ready()
+            with self.tracer.turn(user_input_chars=len(user_input), intent=intent.kind):
+                if intent.kind == "navigate":
+                    await asyncio.to_thread(self._timed, "render", self.show_phase, current_config, intent.phase)
+                    return current_config, f"Here is the {intent.phase} phase."
+                if intent.kind != "edit":
+                    # Nothing to extract: questions are answered from the current configuration
+                    feedback = await asyncio.to_thread(
+                        self._timed, "feedback", self.feedback_client.get_feedback, previous_config, current_config,
+                        user_input
+                    )
+                    return current_config, feedback
+
+                try:
+                    extracted_config = await asyncio.to_thread(
+                        self._timed, "extraction", self.extractor.extract_values, prev_system_response, user_input,
+                        current_config, on_section=self.on_section
+                    )
+                finally:
+                    if self.end_sections is not None:
+                        self.end_sections()
+                feedback_task = asyncio.create_task(asyncio.to_thread(
+                    self._timed, "feedback", self.feedback_client.get_feedback, previous_config, extracted_config, user_input
+                ))
+
+                try:
+                    if self.store is not None:
+                        # Saved before anything else can fail, so a crash does not lose the turn
+                        await asyncio.to_thread(self._timed, "commit", self.store.commit, extracted_config)
+                    committed = extracted_config
+                    print("\nExtracted Configuration:")  #Optional Print Statement
+                    print(json.dumps(extracted_config, indent=2)+"\nAnalyzing for feedback...\n\n")
+                    await asyncio.to_thread(self._timed, "render", self.render, extracted_config)
+                    wait_start = time.perf_counter()
+                    with self.tracer.span("feedback_wait"):
+                        feedback = await feedback_task
+                    self.last_timings["feedback_wait"] = time.perf_counter() - wait_start
+                except BaseException:
+                    feedback_task.cancel()
+                    raise
+                return extracted_config, feedback
+        except Exception as e:
+            print(f"The turn failed: {type(e).__name__}: {e}")
+            self.last_error = e
+            return (current_config if committed is None else committed), failure_message(e, changed=committed is not None)
+        finally:
+            self.last_timings["turn"] = time.perf_counter() - start
+
+    async def speak(self, text):
+        """Speaks text sentence by sentence, playing the first while the rest are synthesized.
+
+        Args:
+            text: The text to speak.
+        """
+        sentences = split_sentences(text)
+        synth_tasks = [
+            asyncio.create_task(asyncio.to_thread(self._synthesize, i, sentence))
+            for i, sentence in enumerate(sentences)
+        ]
+
+        try:
+            started = False
+            for task in synth_tasks:
+                clip = await task
+                if clip is not None and clip.data:
+                    # The first clip starts a new utterance; later ones play after it
+                    (self.player.queue if started else self.player.play)(clip)
+                    started = True
+            while self.player.is_playing:
+                await asyncio.sleep(POLL_SECONDS)
+        finally:
+            for task in synth_tasks:
+                task.cancel()
+            self.player.stop()
+
+    def _synthesize(self, index, sentence):
+        with self.tracer.span("synthesize", sentence=index, chars=len(sentence)):
+            return self.synthesize(sentence)
+
+    def start_speaking(self, text):
+        """Starts speaking text in the background, cancelling any speech still in progress."""
+        self.stop_speaking()
+        self.speech_task = asyncio.create_task(self.speak(text))
+
+    def stop_speaking(self):
+        """Cancels speech synthesis and playback that are still in progress."""
+        self.player.stop()
+        if self.speech_task is not None and not self.speech_task.done():
+            self.speech_task.cancel()
+        self.speech_task = None
+
+    async def prompt(self, message):
+        """Waits for the teacher's next response, stopping speech as soon as they start typing."""
+        loop = asyncio.get_running_loop()
+
+        def barge_in():
+            # Called from the input thread: silence the audio now, cancel synthesis on the loop
+            self.player.stop()
+            loop.call_soon_threadsafe(self.stop_speaking)
+
+        try:
+            return await asyncio.to_thread(self.read_input, message, barge_in)
+        finally:
+            self.last_playback = self.player.status()
+            self.stop_speaking()
+
+    async def step_history(self, command):
+        """Undoes or redoes the last change to the configuration and displays the result.
+
+        Args:
+            command: 'undo' or 'redo'.
+
+        Returns:
+            The message for the teacher.
+        """
+        config = self.store.undo() if command == "undo" else self.store.redo()
+        if config is None:
+            return f"There is nothing to {command}."
+        await asyncio.to_thread(self._timed, "render", self.render, config)
+        return "We undid the last change." if command == "undo" else "We redid the change."
+
+    async def run_session(self, greeting, extracted_config=None):
+        """Runs the extraction and feedback loop until the teacher exits.
+
+        Each turn's configuration is committed to the store; the teacher can also type 'undo'
+        or 'redo' to step through the versions of the session. A turn that fails is reported to
+        the teacher, who can try again, rather than ending the session.
+
+        Args:
+            greeting: The initial message spoken to the teacher.
+            extracted_config: The starting configuration, if the engine has no store yet.
+
+        Returns:
+            The final configuration.
+        """
+        if self.store is None:
+            self.store = ConfigStore(extracted_config)
+
+        self.start_loading_clients()
+        print(greeting + "\nInitiating AI voice...")
+        self.start_speaking(greeting)
+        prev_system_response = greeting
+
+        text_input = await self.prompt("Teacher response: ")
+
+        while True:
+            command = text_input.strip().lower()
+            if command in ("undo", "redo"):
+                feedback = await self.step_history(command)
+            else:
+                current_config = self.store.config
+                extracted_config, feedback = await self.run_turn(
+                    prev_system_response, text_input, current_config, current_config
+                )
+            print(feedback)
+            print("Initiating AI voice...")
+            self.start_speaking(feedback)
+            prev_system_response = feedback
+
+            text_input = await self.prompt("Teacher response (Enter 'undo' or 'redo' to step through changes, 'exit' to save and quit): ")
+
+            if text_input == "exit":
+                break
+
+        return self.store.config
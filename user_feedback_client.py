@@ -1,51 +1,94 @@
-import os
-import json
 from config import *
-from vertexai.generative_models import GenerativeModel
-import vertexai.preview.generative_models as generative_models
-import vertexai
 import utils
+from response_cache import get_response_cache, make_key
+from model_backends import create_backend, rule_based_feedback
+from resilient_call import get_model_caller
+from prompt_builder import PromptBuilder
+from tracing import span, usage_attributes
+from config_diff import diff_configs, summarize_changes
+from intent_router import is_question, schema_index
+
+FEEDBACK_INSTRUCTIONS = (
+    "You will be given a JSON object containing the user input, the changes that you and the user made to the configuration ('changes', one line each: '+' added, '-' removed, 'a -> b' changed), and the required items that are still missing ('missing').\n"
+    "Create a conversational response for the user. In your response, do the following:\n"
+    "1. If the 'user_input' contains any questions related the configuration:\n"
+    "    - Provide an answer to the 'user_input' question using the configuration ('current_config') and the descriptions of the configuration items it is about ('topics'), but only answer questions about this project configuration; if unrelated, state that you are an AI only able to assist with project configurations.\n"
+    "2. If 'changes' is not empty:\n"
+    "    - Briefly report the types of changes made.\n"
+    "    - If 'missing' is empty, state 'Everything looks good!'; otherwise, state 'To complete the configuration...' followed by a clear and concise prompt to provide the first missing item.\n"
+    "    - Do not use any JSON in your response."
+)
+
+# Required items of a complete configuration, with the words used for them in feedback
+REQUIRED_ITEMS = (("project_name", "project name"), ("phases", "phase"), ("boards", "board"), ("groups", "group"))
+
+
+def missing_items(config):
+    """Returns the required items (project name, phase, board, group) missing from a configuration."""
+    return [label for key, label in REQUIRED_ITEMS if not (config or {}).get(key)]
+
+
+def template_feedback(missing):
+    """Returns the feedback for a turn without changes or questions, which needs no model call."""
+    if missing:
+        return f"We didn't change anything this time. To complete the configuration, please tell me about at least one {missing[0]}."
+    return "We didn't change anything this time. Everything looks good!"
+
+SYSTEM_INSTRUCTION = """You are an expert in generating helpful feedback and co-design for users configuring a project. Your task is to create a conversational response that summarizes changes to a configuration the word 'we' to to refer to work both of you have done so far, then provide prompts to guide further changes."""
 
 class UserFeedbackClient:
-    def __init__(self):
-        """Initializes the UserFeedbackClient with the Gemini model."""
-        self.config = load_activity_config()
-        self.schema = load_activity_config_schema()
-        vertexai.init(project=PROJECT_ID, location=LOCATION)
-        self.model = GenerativeModel(os.getenv("GEMINI_MODEL"),
-            system_instruction="""You are an expert in generating helpful feedback and co-design for users configuring a project. Your task is to create a conversational response that summarizes changes to a configuration the word 'we' to to refer to work both of you have done so far, then provide prompts to guide further changes."""
-        )
+    def __init__(self, backend=None, caller=None):
+        """Initializes the UserFeedbackClient with the Gemini model.
+
+        Args:
+            backend: The model backend to use; defaults to the one selected by MODEL_BACKEND.
+            caller: The ResilientCaller that makes the model calls; defaults to the shared one.
+        """
+        self.schema = activity_config_schema()
+        # Changes are reported from a local diff; the schema and configuration are only sent to answer questions
+        self.prompt = PromptBuilder(FEEDBACK_INSTRUCTIONS, include_schema=False)
+        self.question_prompt = PromptBuilder(FEEDBACK_INSTRUCTIONS)
+        self.last_changes = []
+        self.last_prompt_report = None
+        self.cache = get_response_cache()
+        self.backend = backend or create_backend(SYSTEM_INSTRUCTION, local_responder=rule_based_feedback)
+        self.caller = caller or get_model_caller()
+
+    def warm_up(self):
+        """Prepares the model connection ahead of the first turn (e.g. on a background thread)."""
+        self.backend.warm_up()
 
     def get_feedback(self, previous_config, modified_config, user_input):
         """Generates feedback for the user based on the previous and modified configurations.
 
+        The changes are summarized locally, so the prompt grows with the size of the edit rather
+        than the size of the configuration. Without changes or a question, no model call is made.
+
         Args:
-            original_config: The original (template) configuration.
-            extracted_config: The configuration extracted from user input.
+            previous_config: The configuration before the turn.
+            modified_config: The configuration extracted from user input.
+            user_input: The user's response.
 
         Returns:
             A string containing the feedback message for the user.
         """
 
-        payload = {
-            "original_config": previous_config,
-            "extracted_config": modified_config,
-            "schema": self.schema,
-            "user_input": user_input
-        }
+        with span("diff") as diff:
+            self.last_changes = summarize_changes(diff_configs(previous_config, modified_config))
+            missing = missing_items(modified_config)
+            question = is_question(user_input)
+            diff.set(changes=len(self.last_changes), question=question)
+        if not self.last_changes and not question:
+            return template_feedback(missing)
 
-        json_payload = json.dumps(payload, indent=2)
-        prompt = (
-            "The following is a JSON object containing the previous configuration, the modified configuration that you and the user contributed, and the configuration schema:\n\n"
-            f"{json_payload}\n\n"
-            "Create a conversational response for the user. In your response, do the following:\n"
-            "1. If the 'user_input' contains any questions related the configuration:\n"
-            "    - Provide an answer to the 'user_input' question, but only answer questions about this project configuration; if unrelated, state that you are an AI only able to assist with project configurations.\n"
-            "2. If 'extracted_config' contains any changes compared to the 'original_config':\n"
-            "    - Briefly report the types of changes made.\n"
-            "    - If a project name and at least one phase, board, and group are in 'extracted_config', state 'Everything looks good!'; if one is missing, state 'To complete the configuration...' followed by a clear and concise prompt to provide one of those missing items.\n"
-            "    - Do not use any JSON in your response.\n\n"
-        )
+        with span("prompt_build", mode="question" if question else "feedback") as build:
+            payload = {"user_input": user_input, "changes": self.last_changes, "missing": missing}
+            if question:
+                payload["topics"] = schema_index().describe(user_input)
+                payload["current_config"] = modified_config
+            prompt = (self.question_prompt if question else self.prompt).build(payload)
+            self.last_prompt_report = prompt.report()
+            build.set(prompt_bytes=self.last_prompt_report["total_bytes"], prompt_tokens=self.last_prompt_report["total_tokens"])
 
         # Call the model to predict and get results in string format
         generation_config = {
@@ -55,15 +98,20 @@ class UserFeedbackClient:
             "top_k": 40
         }
 
-        safety_settings = {
-            generative_models.HarmCategory.HARM_CATEGORY_HATE_SPEECH: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-            generative_models.HarmCategory.HARM_CATEGORY_HARASSMENT: generative_models.HarmBlockThreshold.BLOCK_MEDIUM_AND_ABOVE,
-        }
-        
-        # Call the model to predict and get results in string format
-        response = self.model.generate_content(prompt, generation_config=generation_config, safety_settings=safety_settings).text
-        clean_response = utils.remove_json_markdown(response)
+        key = make_key(self.backend.model_name, self.backend.system_instruction, generation_config, prompt.text)
+        with span("model_call", model=self.backend.model_name, max_output_tokens=1024) as call:
+            response = self.cache.get(key)
+            call.set(cached=response is not None)
+            if response is None:
+                # Call the model to predict and get results in string format
+                result = self.caller.call("feedback", self.backend.generate_content, prompt.text, span=call,
+                                          generation_config=generation_config)
+                response = result.text
+                self.cache.put(key, response)
+                call.set(**usage_attributes(getattr(result, "usage_metadata", None)))
+            call.set(response_bytes=len(response.encode("utf-8")))
+
+        with span("parse"):
+            clean_response = utils.remove_json_markdown(response)
 
         return clean_response  
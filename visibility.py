@@ -0,0 +1,194 @@
+import functools
+# numpy is imported where arrays are built, which keeps it off the designer's startup path
+
+# Board resources whose keys are phase names and whose values are group names
+RESOURCES = ("canvas", "bucket_view", "monitor_view", "todo", "workspace")
+ACCOUNT_TYPES = ("students", "teachers", "devices")
+
+
+def _names(items, key=None):
+    """Returns the names of a list of named objects (or strings), with None for malformed entries."""
+    names = [item.get(key) if isinstance(item, dict) and key else item for item in items]
+    return [name if isinstance(name, str) else None for name in names]
+
+
+def _index(names):
+    """Returns {name: position} for the first occurrence of each name."""
+    index = {}
+    for position, name in enumerate(names):
+        if name is not None:
+            index.setdefault(name, position)
+    return index
+
+
+def _list(config, key):
+    return config.get(key) if isinstance(config.get(key), list) else []
+
+
+def resource_grants(visibility, phase_index, group_index):
+    """Compiles a board resource's visibility ({phase: [groups]}) into a [phase, group] boolean array.
+
+    Args:
+        visibility: The resource's value in a board.
+        phase_index: {phase name: row} of the phases to compile for.
+        group_index: {group name: column} of the groups to compile for.
+
+    Returns:
+        A tuple of the array and the references it could not resolve, as (phase, index, group)
+        triples: index and group are None for a phase missing from phase_index, and otherwise
+        give the position and name of a group missing from group_index.
+    """
+    import numpy as np
+
+    grants = np.zeros((len(phase_index), len(group_index)), dtype=bool)
+    unresolved = []
+    if not isinstance(visibility, dict):
+        return grants, unresolved
+    for phase, groups in visibility.items():
+        row = phase_index.get(phase)
+        if row is None:
+            unresolved.append((phase, None, None))
+        columns = []
+        for index, group in enumerate(groups if isinstance(groups, list) else []):
+            column = group_index.get(group) if isinstance(group, str) else None
+            if column is None:
+                unresolved.append((phase, index, group))
+            else:
+                columns.append(column)
+        if row is not None:
+            grants[row, columns] = True
+    return grants, unresolved
+
+
+class VisibilityMatrix:
+    def __init__(self, config):
+        """Initializes the VisibilityMatrix, which compiles who sees which resource in which phase.
+
+        Board visibility is compiled into a boolean array indexed by [board, resource, phase,
+        group], and account groups into an [account, group] membership array, one row of group
+        bits per account. Questions such as which resources an account sees in a phase, or
+        which accounts see a resource, are then answered with array operations over all
+        accounts and phases at once. References to undefined phases or groups are left out.
+
+        Args:
+            config: The configuration to compile; it is not kept.
+        """
+        import numpy as np
+
+        config = config if isinstance(config, dict) else {}
+        self.phases = _names(_list(config, "phases"), "name")
+        self.boards = _names(_list(config, "boards"), "board_name")
+        self.groups = _names(_list(config, "groups"))
+        self.phase_index, self.group_index = _index(self.phases), _index(self.groups)
+        board_index = _index(self.boards)
+
+        self.grants = np.zeros((len(self.boards), len(RESOURCES), len(self.phases), len(self.groups)), dtype=bool)
+        self.defined = np.zeros((len(self.boards), len(RESOURCES)), dtype=bool)  # Resources a board has
+        for row, board in enumerate(_list(config, "boards")):
+            for column, resource in enumerate(RESOURCES):
+                if isinstance(board, dict) and resource in board:
+                    self.defined[row, column] = True
+                    self.grants[row, column] = resource_grants(board[resource], self.phase_index, self.group_index)[0]
+
+        # Each phase shows its own board; the visibility in a phase is indexed by [phase, resource, group]
+        self.phase_boards = np.array([
+            board_index.get(phase["board"], -1) if isinstance(phase, dict) and isinstance(phase.get("board"), str) else -1
+            for phase in _list(config, "phases")
+        ], dtype=np.intp)
+        shown = np.flatnonzero(self.phase_boards >= 0)
+        self.visible = np.zeros((len(self.phases), len(RESOURCES), len(self.groups)), dtype=bool)
+        self.visible[shown] = self.grants[self.phase_boards[shown], :, shown, :]
+        self.phase_defined = np.zeros((len(self.phases), len(RESOURCES)), dtype=bool)
+        self.phase_defined[shown] = self.defined[self.phase_boards[shown]]
+
+        accounts = config.get("accounts") if isinstance(config.get("accounts"), dict) else {}
+        self.accounts = [
+            (account_type, name)
+            for account_type in ACCOUNT_TYPES if isinstance(accounts.get(account_type), dict)
+            for name in accounts[account_type]
+        ]
+        self.account_index = _index(name for _, name in self.accounts)
+        self.membership = np.zeros((len(self.accounts), len(self.groups)), dtype=bool)
+        for row, (account_type, name) in enumerate(self.accounts):
+            details = accounts[account_type][name]
+            groups = details.get("groups") if isinstance(details, dict) else None
+            for group in groups if isinstance(groups, list) else []:
+                if isinstance(group, str) and group in self.group_index:
+                    self.membership[row, self.group_index[group]] = True
+
+    @functools.cached_property
+    def access(self):
+        """The resources each account sees in each phase, as a boolean [account, phase, resource] array.
+
+        An account sees a resource in a phase if any of its groups does.
+        """
+        import numpy as np
+
+        visible = self.visible.reshape(len(self.phases) * len(RESOURCES), len(self.groups))
+        # Counts of shared groups, as a matrix product (float32 for BLAS)
+        shared = self.membership.astype(np.float32) @ visible.T.astype(np.float32)
+        return (shared > 0).reshape(len(self.accounts), len(self.phases), len(RESOURCES))
+
+    def defines(self, resource, phase):
+        """Returns whether the board of a phase has a resource at all."""
+        row = self.phase_index.get(phase)
+        return row is not None and bool(self.phase_defined[row, RESOURCES.index(resource)])
+
+    def groups_seeing(self, resource, phase):
+        """Returns the groups that see a resource in a phase, in the order of the configuration's groups."""
+        import numpy as np
+
+        row = self.phase_index.get(phase)
+        if row is None:
+            return []
+        return [self.groups[column] for column in np.flatnonzero(self.visible[row, RESOURCES.index(resource)])]
+
+    def accounts_seeing(self, resource, phase):
+        """Returns the names of the accounts that see a resource in a phase."""
+        import numpy as np
+
+        row = self.phase_index.get(phase)
+        if row is None:
+            return []
+        return [self.accounts[index][1] for index in np.flatnonzero(self.access[:, row, RESOURCES.index(resource)])]
+
+    def resources_for(self, account, phase=None):
+        """Returns the resources an account sees in a phase, or {phase: [resources]} for every phase.
+
+        Unknown accounts and phases see nothing.
+        """
+        import numpy as np
+
+        row = self.account_index.get(account)
+        if phase is not None:
+            column = self.phase_index.get(phase)
+            if row is None or column is None:
+                return []
+            return [RESOURCES[index] for index in np.flatnonzero(self.access[row, column])]
+        if row is None:
+            return {}
+        return {self.phases[column]: self.resources_for(account, self.phases[column])
+                for column in np.flatnonzero(self.access[row].any(axis=1))}
+
+    def can_see(self, account, resource, phase):
+        """Returns whether an account sees a resource in a phase."""
+        row, column = self.account_index.get(account), self.phase_index.get(phase)
+        return row is not None and column is not None and bool(self.access[row, column, RESOURCES.index(resource)])
+
+    def export(self):
+        """Returns the whole class's access: {account type: {name: {phase: [resources]}}}.
+
+        Every account is listed, and only the phases in which it sees something.
+        """
+        import numpy as np
+
+        # Each (account, phase) as a bit per resource, so that the resource lists are built once per combination
+        codes = self.access.astype(np.intp) @ (1 << np.arange(len(RESOURCES)))
+        combinations = [[resource for bit, resource in enumerate(RESOURCES) if code >> bit & 1]
+                        for code in range(1 << len(RESOURCES))]
+        exported = {}
+        for (account_type, name), row in zip(self.accounts, codes.tolist()):
+            exported.setdefault(account_type, {})[name] = {
+                phase: combinations[code][:] for phase, code in zip(self.phases, row) if code
+            }
+        return exported